@@ -1,14 +1,45 @@
 # app.py
 import asyncio
 import streamlit as st
-from shopy.main import main
-from shopy.models import State
-from shopy.utils import clean_llm_output
-
-
-async def run_shopy(query, email):
-    """Runs the Shopy agent and returns the final state."""
-    return await main(query, email) # modified main call
+from shopy.runtime import get_runtime
+
+
+async def run_shopy(query, email, sections):
+    """Runs the Shopy agent, filling in each section of the page as soon as its data exists."""
+    runtime = get_runtime()
+    if not await runtime.ensure_authenticated():
+        return None
+
+    summary = ""
+    final_state = None
+    async for event in runtime.agent.astream(query, email):
+        if event["event"] == "token":
+            summary += event["text"]
+            sections["summary"].markdown(f"**Summary:**\n\n{summary}")
+        elif event["event"] == "update":
+            node, data = event["node"], event["data"]
+            if node == "dedupe" and data.get("products"):
+                names = ", ".join(str(p.get("name")) for p in data["products"])
+                sections["products"].caption(f"Found {len(data['products'])} products: {names}")
+            elif node == "product_comparison":
+                best_product = data.get("best_product") or {}
+                if best_product:
+                    with sections["best_product"].container():
+                        st.subheader(f"Here is what ShopyAgent suggests: {best_product.get('product_name', 'No product')}")
+                        st.markdown(f"**Justification:**\n {best_product.get('justification', 'No justification')}")
+                if data.get("comparison"):
+                    with sections["comparison"].container():
+                        st.subheader("Product Comparisons")
+                        st.table(data["comparison"])
+            elif node == "youtube_review" and data.get("youtube_link"):
+                sections["youtube_link"].markdown(f"**See the review here:** {data['youtube_link']}")
+            elif node in ("generate_summary", "summarize_and_email") and data.get("summary"):
+                sections["summary"].markdown(f"**Summary:**\n\n{data['summary']}")
+        elif event["event"] == "done":
+            final_state = event["state"]
+    # Email is delivered in the background; make sure it goes out before asyncio.run returns.
+    await runtime.tools.email.flush()
+    return final_state
 
 
 st.title("Shopy: Your AI Shopping Assistant")
@@ -20,25 +51,12 @@ if st.button("Search"):
     if not query:
         st.warning("Please enter a product query.")
     else:
+      sections = {
+          name: st.empty()
+          for name in ("products", "best_product", "youtube_link", "comparison", "summary")
+      }
       with st.spinner("Searching for products..."):
-        final_state = asyncio.run(run_shopy(query, email))
-
-        if final_state and isinstance(final_state, dict):
-            display_data = final_state.get('display_data', {})
-            if display_data:
-                if display_data.get('best_product'):
-                    st.subheader(f"Here is what ShopyAgent suggests: {display_data['best_product'].get('product_name', 'No product')}")
-                    st.markdown(f"**Justification:**\n {display_data['best_product'].get('justification', 'No justification')}")
-                    if display_data.get('youtube_link'):
-                        st.markdown(f"**See the review here:** {display_data['youtube_link']}")
-                    if display_data.get('comparison'):
-                        st.subheader("Product Comparisons")
-                        st.table(display_data['comparison'])
-                    if display_data.get('summary'):
-                        st.subheader("Summary:")
-                        with st.expander("Show Summary"):
-                            clean_llm_output(display_data['summary'], console=st)
-
-                
-        else:
-            st.error("There was an error processing your query. Please try again.")
\ No newline at end of file
+        final_state = asyncio.run(run_shopy(query, email, sections))
+
+        if final_state is None:
+            st.error("There was an error processing your query. Please try again.")
@@ -0,0 +1,214 @@
+# benchmarks/bench_checkpoint.py
+"""Measure what retrying a failed run costs with and without checkpoints, and what checkpointing adds to a run.
+
+Runs the full graph against fake Tavily, shop page, LLM, YouTube and SMTP backends.
+For each failure scenario, `--runs` runs are started while one backend is down:
+
+* llm: every LLM call fails, so generate_summary fails.
+* youtube: every YouTube lookup fails, inside the analysis subgraph.
+* smtp: the SMTP server rejects every message, so the email is never delivered.
+
+The backend then recovers and each run is retried. Without checkpoints the run is
+simply started again. With a SQLite checkpointer it is resumed from its last
+completed step. For both, the benchmark reports the calls the retries made to each
+backend and their total wall time.
+
+Finally, healthy runs are timed with and without the checkpointer, to show the
+latency it adds, the checkpoints written per run and the database size per run.
+
+Usage:
+    python -m benchmarks.bench_checkpoint --runs 20 --llm-latency 0.8 --page-latency 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fakes import (
+    FakeHTTPServer,
+    FakeLLM,
+    FakeSMTPServer,
+    FakeYouTubeTool,
+    Latency,
+    fake_product_page_routes,
+    fake_tavily_routes,
+)
+from shopy.agent import ShopyAgent
+from shopy.checkpoint import SQLiteCheckpointer
+from shopy.exceptions import RunFailedError
+from shopy.runtime import Toolset
+from shopy.tools import DataStructuringTool, DedupeTool, DisplayTool, EmailTool, ProductComparisonTool, TavilyTool
+from shopy.utils import percentile
+
+
+class Backends:
+    """The fake servers and tools one scenario runs against, with counters of the work they did."""
+
+    def __init__(self, args: argparse.Namespace, stack: contextlib.AsyncExitStack):
+        self.args = args
+        self.stack = stack
+
+    async def start(self) -> "Backends":
+        args = self.args
+        rng = random.Random(args.seed)
+        self.pages = await self.stack.enter_async_context(FakeHTTPServer(
+            fake_product_page_routes(pages=args.results, latency=args.page_latency, rng=rng)
+        ))
+        page_urls = [f"{self.pages.base_url}/products/{i}" for i in range(args.results)]
+        self.tavily = await self.stack.enter_async_context(FakeHTTPServer(
+            fake_tavily_routes(latency=args.tavily_latency, results=args.results, rng=rng, page_urls=page_urls)
+        ))
+        self.smtp = await self.stack.enter_async_context(FakeSMTPServer(send_latency=args.smtp_latency, rng=rng))
+        self.llm = FakeLLM(latency=args.llm_latency, rng=rng)
+        self.youtube = FakeYouTubeTool(latency=args.youtube_latency, rng=rng)
+        return self
+
+    def toolset(self) -> Toolset:
+        email = EmailTool(
+            gmail_user="bench@example.com",
+            gmail_pass="bench",
+            smtp_server="127.0.0.1",
+            port=self.smtp.port,
+            use_ssl=False,
+            max_retries=1,
+        )
+        email.outbox.backoff = 0.01
+        return Toolset(
+            llm=self.llm,
+            tavily=TavilyTool(api_key="bench", base_url=self.tavily.base_url),
+            dedupe=DedupeTool(),
+            data_structuring=DataStructuringTool(parse_workers=0),
+            youtube=self.youtube,
+            product_comparison=ProductComparisonTool(),
+            email=email,
+            display=DisplayTool(),
+        )
+
+    def break_backend(self, name: str, broken: bool) -> None:
+        rate = 1.0 if broken else 0.0
+        if name == "llm":
+            self.llm.failure_rate = rate
+        elif name == "youtube":
+            self.youtube.failure_rate = rate
+        else:
+            self.smtp.failure_rate = rate
+
+    def work(self) -> Dict[str, int]:
+        return {
+            "tavily": self.tavily.requests,
+            "pages": self.pages.requests,
+            "llm": self.llm.calls,
+            "youtube": self.youtube.calls,
+            "emails": len(self.smtp.messages),
+        }
+
+
+async def retry_scenario(args: argparse.Namespace, broken: str, checkpoints: Optional[str]) -> Dict[str, Any]:
+    async with contextlib.AsyncExitStack() as stack:
+        backends = await Backends(args, stack).start()
+        tools = backends.toolset()
+        checkpointer = SQLiteCheckpointer(checkpoints) if checkpoints else None
+        agent = ShopyAgent(tools=tools, checkpointer=checkpointer)
+        run_ids: List[str] = []
+
+        backends.break_backend(broken, True)
+        for i in range(args.runs):
+            try:
+                state = await agent.run(f"benchmark product query {i}", f"user{i}@example.com", display=False)
+                run_ids.append(state.trace_id)
+            except RunFailedError as e:
+                run_ids.append(e.run_id)
+        await tools.email.flush()
+        backends.break_backend(broken, False)
+
+        before = backends.work()
+        start = time.perf_counter()
+        for i, run_id in enumerate(run_ids):
+            if checkpointer is not None:
+                await agent.resume(run_id)
+            else:
+                await agent.run(f"benchmark product query {i}", f"user{i}@example.com", display=False)
+        await tools.email.flush()
+        wall = time.perf_counter() - start
+        after = backends.work()
+        await tools.aclose()
+        if checkpointer is not None:
+            checkpointer.close()
+    return {"wall": wall, "work": {name: after[name] - before[name] for name in after}}
+
+
+async def overhead(args: argparse.Namespace, checkpoints: Optional[str]) -> Dict[str, Any]:
+    async with contextlib.AsyncExitStack() as stack:
+        backends = await Backends(args, stack).start()
+        tools = backends.toolset()
+        checkpointer = SQLiteCheckpointer(checkpoints) if checkpoints else None
+        agent = ShopyAgent(tools=tools, checkpointer=checkpointer)
+        latencies = []
+        for i in range(args.runs):
+            start = time.perf_counter()
+            await agent.run(f"benchmark product query {i}", "", display=False)
+            latencies.append(time.perf_counter() - start)
+        await tools.aclose()
+        result = {"latencies": latencies}
+        if checkpointer is not None:
+            (count,) = checkpointer._db.execute("SELECT COUNT(*) FROM checkpoints").fetchone()
+            checkpointer.close()
+            result["checkpoints"] = count
+            result["bytes"] = sum(
+                os.path.getsize(checkpoints + suffix) for suffix in ("", "-wal") if os.path.exists(checkpoints + suffix)
+            )
+    return result
+
+
+def format_work(work: Dict[str, int]) -> str:
+    return "  ".join(f"{name} {count:>4}" for name, count in work.items())
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"{args.runs} runs, {args.results} results each; latency: tavily {args.tavily_latency}, "
+        f"pages {args.page_latency}, llm {args.llm_latency}, youtube {args.youtube_latency}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for broken in ("llm", "youtube", "smtp"):
+            print(f"{broken} down for the first attempt, then retried:")
+            for label, path in (("rerun", None), ("resume", os.path.join(directory, f"{broken}.sqlite"))):
+                result = await retry_scenario(args, broken, path)
+                print(f"  {label:<7} wall {result['wall']:6.2f} s  {format_work(result['work'])}")
+
+        print("healthy runs:")
+        plain = await overhead(args, None)
+        checkpointed = await overhead(args, os.path.join(directory, "overhead.sqlite"))
+        for label, result in (("no checkpoints", plain), ("checkpoints", checkpointed)):
+            latencies = result["latencies"]
+            line = (
+                f"  {label:<15} mean {sum(latencies) / len(latencies) * 1000:7.1f} ms  "
+                f"p95 {percentile(latencies, 95) * 1000:7.1f} ms"
+            )
+            if "checkpoints" in result:
+                line += (
+                    f"  {result['checkpoints'] / args.runs:.1f} checkpoints/run  "
+                    f"{result['bytes'] / args.runs / 1024:.1f} KB/run"
+                )
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--results", type=int, default=5, help="Search results per query.")
+    parser.add_argument("--tavily-latency", type=Latency.parse, default=Latency(0.3, 0.1, "lognormal"))
+    parser.add_argument("--page-latency", type=Latency.parse, default=Latency(0.2, 0.05, "lognormal"))
+    parser.add_argument("--llm-latency", type=Latency.parse, default=Latency(0.8, 0.3, "lognormal"))
+    parser.add_argument("--youtube-latency", type=Latency.parse, default=Latency(0.1, 0.03, "lognormal"))
+    parser.add_argument("--smtp-latency", type=Latency.parse, default=Latency(0.05, 0.01, "lognormal"))
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    sys.exit(asyncio.run(main(args)))
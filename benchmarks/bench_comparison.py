@@ -0,0 +1,82 @@
+# benchmarks/bench_comparison.py
+"""Measure ProductComparisonTool on large synthetic candidate sets.
+
+Candidates get random spec strings in the formats shop pages use ("4500mAh",
+"A15 Bionic", "$1,299", "1.2 kg"), so the timing covers spec parsing, NumPy
+scoring and top-k selection. The parse cache is cleared before each size unless
+`--warm` is given.
+
+Usage:
+    python -m benchmarks.bench_comparison --sizes 10 100 1000 10000 --repeat 5
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Any, Dict, List
+
+from shopy import scoring
+from shopy.tools import ProductComparisonTool
+
+PROCESSORS = ["A15 Bionic", "A17 Pro", "Snapdragon 888", "Snapdragon 8 Gen 3", "Google Tensor G4",
+              "Intel Core i7-1360P", "Intel Core Ultra 7 155U", "Apple M3", "Dimensity 9300", "Unknown SoC"]
+
+
+def make_candidates(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    candidates = []
+    for i in range(count):
+        specs = {
+            "Processor": rng.choice(PROCESSORS),
+            "RAM": f"{rng.choice([4, 6, 8, 12, 16, 32])} GB",
+            "Storage": rng.choice(["128GB", "256 GB", "512GB SSD", "1 TB"]),
+            "Battery": rng.choice([f"{rng.randrange(3000, 6000, 100)}mAh", f"{rng.randrange(40, 100)} Wh", f"Up to {rng.randrange(8, 30)} hours"]),
+            "Rear camera": f"{rng.choice([12, 48, 50, 108, 200])} MP",
+            "Display": f'{rng.uniform(5.8, 16.0):.1f}" OLED, {rng.choice([60, 90, 120, 144])} Hz',
+            "Weight": rng.choice([f"{rng.randrange(150, 250)} g", f"{rng.uniform(0.9, 2.5):.2f} kg"]),
+        }
+        for key in rng.sample(list(specs), rng.randrange(0, 3)):
+            del specs[key]
+        candidates.append({"name": f"Product {i}", "price": f"${rng.randrange(99, 3000):,}", "specs": specs})
+    return candidates
+
+
+def main(sizes: List[int], repeat: int, top_k: int, warm: bool, query: str, seed: int) -> None:
+    rng = random.Random(seed)
+    tool = ProductComparisonTool(top_k=top_k)
+    print(f"query: {query!r}, top {top_k}")
+    print(f"{'candidates':>10} {'median ms':>10} {'best ms':>8} {'score-only ms':>13} {'top-k ms':>9} {'full sort ms':>12}")
+    for size in sizes:
+        candidates = make_candidates(size, rng)
+        timings = []
+        for _ in range(repeat):
+            if not warm:
+                scoring._parse_cached.cache_clear()
+            start = time.perf_counter()
+            tool.rank(candidates, query)
+            timings.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        scores, _, _, _ = scoring.score(candidates, query)
+        score_only = time.perf_counter() - start
+        start = time.perf_counter()
+        scoring.top_k(scores, top_k)
+        partition = time.perf_counter() - start
+        start = time.perf_counter()
+        sorted(range(len(scores)), key=lambda i: -scores[i])[:top_k]
+        full_sort = time.perf_counter() - start
+        print(
+            f"{size:>10} {statistics.median(timings) * 1000:>10.2f} {min(timings) * 1000:>8.2f} "
+            f"{score_only * 1000:>13.2f} {partition * 1000:>9.3f} {full_sort * 1000:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--warm", action="store_true", help="Keep parsed spec strings cached between repeats.")
+    parser.add_argument("--query", default="fast phone with a great camera under $1000")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    main(args.sizes, args.repeat, args.top_k, args.warm, args.query, args.seed)
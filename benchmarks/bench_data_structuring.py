@@ -0,0 +1,132 @@
+# benchmarks/bench_data_structuring.py
+"""Measure DataStructuringTool page fetching and parsing against local servers that serve fixture pages.
+
+Each shop is a separate fake server (a separate host:port), so the per-host
+connection limit applies per shop. For every parse-worker setting the script
+reports pages/s, p50/p95 time per batch of search results and the worst event
+loop stall seen while parsing. It also checks that every fixture page yields
+the name, price, currency and number of specs listed in
+`benchmarks/fixtures/expected.json`, and exits 1 if one doesn't.
+
+Usage:
+    python -m benchmarks.bench_data_structuring --shops 4 --batches 32 --padding-kb 64 --workers 0 2 4
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+from benchmarks.fakes import FIXTURES, FakeHTTPServer, Latency, fake_product_page_routes, fixture_expectations
+from shopy.tools import DataStructuringTool
+from shopy.utils import percentile
+
+
+async def watch_loop_lag(interval: float, lags: List[float]) -> None:
+    """Records how late each wake-up of a short periodic sleep is; large values mean the loop was blocked."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+def check_fixtures(records: List[Dict[str, Any]]) -> List[str]:
+    """Compares records for /products/0 .. /products/<fixtures - 1> against the expected values."""
+    problems = []
+    names = sorted(path.name for path in FIXTURES.glob("*.html"))
+    expected = fixture_expectations()
+    for name, record in zip(names, records):
+        want = expected[name]
+        got = {"name": record["name"], "price": record["price"], "currency": record["currency"], "specs": len(record["specs"])}
+        if got != want:
+            problems.append(f"{name}: expected {want}, got {got}")
+    return problems
+
+
+async def run(args: argparse.Namespace, workers: int, urls: List[str], fixture_urls: List[str], rng: random.Random) -> Dict[str, Any]:
+    tool = DataStructuringTool(
+        max_connections=args.max_connections, max_per_host=args.max_per_host, parse_workers=workers
+    )
+    batches = [
+        [{"name": f"result {i}", "url": url} for i, url in enumerate(rng.sample(urls, args.results))]
+        for _ in range(args.batches)
+    ]
+    # Warm up the session and start the worker processes before timing.
+    await tool.map_schema(batches[0])
+
+    lags: List[float] = []
+    watcher = asyncio.create_task(watch_loop_lag(0.005, lags))
+    durations = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(batch):
+        async with semaphore:
+            start = time.perf_counter()
+            await tool.map_schema(batch)
+            durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(batch) for batch in batches))
+    wall = time.perf_counter() - start
+    watcher.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await watcher
+    problems = check_fixtures(await tool.map_schema([{"url": url} for url in fixture_urls]))
+    await tool.aclose()
+    return {
+        "workers": workers,
+        "pages_per_second": args.batches * args.results / wall,
+        "batch_p50_ms": percentile(durations, 50) * 1000,
+        "batch_p95_ms": percentile(durations, 95) * 1000,
+        "max_loop_lag_ms": max(lags, default=0.0) * 1000,
+        "problems": problems,
+    }
+
+
+async def main(args: argparse.Namespace) -> int:
+    rng = random.Random(args.seed)
+    async with contextlib.AsyncExitStack() as stack:
+        servers = [
+            await stack.enter_async_context(FakeHTTPServer(fake_product_page_routes(
+                pages=args.pages, latency=args.page_latency, padding_kb=args.padding_kb, rng=random.Random(args.seed + i)
+            )))
+            for i in range(args.shops)
+        ]
+        urls = [f"{server.base_url}/products/{page}" for page in range(args.pages) for server in servers]
+        fixture_urls = [f"{servers[0].base_url}/products/{page}" for page in range(len(fixture_expectations()))]
+        print(f"{args.shops} shops, {args.results} results per batch, {args.concurrency} batches at once, "
+              f"pages padded by {args.padding_kb} KB, page latency {args.page_latency}")
+        failed = False
+        for workers in args.workers:
+            result = await run(args, workers, urls, fixture_urls, rng)
+            print(
+                f"parse workers {workers:>2}: {result['pages_per_second']:8.1f} pages/s  "
+                f"batch p50 {result['batch_p50_ms']:7.1f} ms  p95 {result['batch_p95_ms']:7.1f} ms  "
+                f"max loop stall {result['max_loop_lag_ms']:7.1f} ms"
+            )
+            for problem in result["problems"]:
+                print(f"    FAIL: {problem}")
+                failed = True
+        print(f"requests served: {sum(s.requests for s in servers)}, connections opened: {sum(s.connections for s in servers)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shops", type=int, default=4, help="Fake shop servers (distinct hosts).")
+    parser.add_argument("--pages", type=int, default=12, help="Product pages per shop.")
+    parser.add_argument("--results", type=int, default=5, help="Search results (pages) per batch.")
+    parser.add_argument("--batches", type=int, default=32, help="Batches to structure.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Batches structured at once.")
+    parser.add_argument("--padding-kb", type=int, default=64, help="Extra markup per page, to make parsing CPU-bound.")
+    parser.add_argument("--page-latency", type=Latency.parse, default=Latency(0.05, 0.02, "lognormal"))
+    parser.add_argument("--max-connections", type=int, default=20)
+    parser.add_argument("--max-per-host", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4], help="Parse worker processes (0 parses in a thread).")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,127 @@
+# benchmarks/bench_dedupe.py
+"""Measure search result deduplication speed and accuracy on synthetic labelled results.
+
+Results are drawn from a catalogue of models that differ by a number or a
+variant word ("Pixel 8" / "Pixel 8 Pro" / "Pixel 9"), so near-misses are common.
+A share of results repeat an earlier model as a retailer listing, a review, a
+colour or capacity variant or a tracking-parameter URL. The script reports the
+time per batch and pairwise precision and recall of the groups found against the
+true models, and exits 1 if either falls below `--min-accuracy`. The title and
+URL caches are cleared before each repeat unless `--warm` is given.
+
+Usage:
+    python -m benchmarks.bench_dedupe --sizes 10 100 1000 --duplicates 0.4 --repeat 5
+"""
+import argparse
+import itertools
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from shopy import dedupe
+
+# Model name templates, the numbers filled in and the variant suffixes of each line.
+LINES = [
+    ("Apple iPhone {n}{v}", ["13", "14", "15", "16"], ["", " Pro", " Pro Max", " Plus"]),
+    ("Google Pixel {n}{v}", ["7", "7a", "8", "8a", "9"], ["", " Pro", " Pro XL"]),
+    ("Samsung Galaxy S{n}{v}", ["22", "23", "24", "25"], ["", "+", " Ultra", " FE"]),
+    ("OnePlus {n}{v}", ["10", "11", "12", "13"], ["", " Pro", "R"]),
+    ("Sony WH-{n}{v}", ["1000XM3", "1000XM4", "1000XM5", "CH720N"], [""]),
+    ("Lenovo ThinkPad X1 Carbon Gen {n}{v}", ["9", "10", "11", "12"], [""]),
+    ("Dell XPS {n}{v}", ["13", "14", "15", "16"], ["", " Plus"]),
+]
+SHOPS = ["amazon.com", "bestbuy.com", "walmart.com", "target.com", "newegg.com", "ebay.com"]
+SHOP_NAMES = {"amazon.com": "Amazon.com", "bestbuy.com": "Best Buy", "walmart.com": "Walmart", "target.com": "Target",
+              "newegg.com": "Newegg", "ebay.com": "eBay"}
+
+
+def catalogue() -> List[str]:
+    return [template.format(n=number, v=suffix) for template, numbers, suffixes in LINES for number in numbers for suffix in suffixes]
+
+
+def variant(model: str, rng: random.Random) -> Tuple[str, str]:
+    """A (title, url) for `model` as some page on the web might show it."""
+    slug = model.lower().replace(" ", "-").replace("+", "-plus")
+    shop = rng.choice(SHOPS)
+    url = f"https://www.{shop}/{slug}"
+    kind = rng.randrange(6)
+    if kind == 0:
+        return f"{model} | {SHOP_NAMES[shop]}", url
+    if kind == 1:
+        return f"{model} review: {rng.choice(['worth it?', 'the best yet', 'a great upgrade'])}", f"https://reviews.example.com/{slug}-review"
+    if kind == 2:
+        return f"{model} {rng.choice(['128GB', '256 GB', '512GB'])} - {rng.choice(['Black', 'Blue', 'Silver'])}", url
+    if kind == 3:
+        return f"Buy {model} - Best Price", f"{url}?utm_source=google&utm_medium=cpc&gclid={rng.randrange(10 ** 9)}"
+    if kind == 4:
+        return f"{SHOP_NAMES[shop]}: {model}", url + "/"
+    return model, url
+
+
+def make_results(size: int, duplicates: float, rng: random.Random) -> Tuple[List[str], List[str], List[str]]:
+    models = catalogue()
+    titles, urls, labels = [], [], []
+    seen: List[str] = []
+    unused = rng.sample(models, len(models))
+    for _ in range(size):
+        if seen and (rng.random() < duplicates or not unused):
+            model = rng.choice(seen)
+        else:
+            model = unused.pop() if unused else rng.choice(models)
+            seen.append(model)
+        title, url = variant(model, rng)
+        titles.append(title)
+        urls.append(url)
+        labels.append(model)
+    return titles, urls, labels
+
+
+def pairwise_accuracy(groups: List[List[int]], labels: List[str]) -> Tuple[float, float]:
+    """Precision and recall of the same-product pairs implied by `groups`."""
+    found = {pair for group in groups for pair in itertools.combinations(sorted(group), 2)}
+    by_label: Dict[str, List[int]] = {}
+    for i, label in enumerate(labels):
+        by_label.setdefault(label, []).append(i)
+    truth = {pair for members in by_label.values() for pair in itertools.combinations(members, 2)}
+    precision = len(found & truth) / len(found) if found else 1.0
+    recall = len(found & truth) / len(truth) if truth else 1.0
+    return precision, recall
+
+
+def main(args: argparse.Namespace) -> int:
+    rng = random.Random(args.seed)
+    print(f"threshold {args.threshold}, {args.num_perm} hash functions in {args.bands} bands, duplicate share {args.duplicates}")
+    print(f"{'results':>8} {'products':>9} {'groups':>7} {'median ms':>10} {'precision':>10} {'recall':>7}")
+    failed = False
+    for size in args.sizes:
+        titles, urls, labels = make_results(size, args.duplicates, rng)
+        timings = []
+        for _ in range(args.repeat):
+            if not args.warm:
+                dedupe.normalize_title.cache_clear()
+                dedupe.canonicalize_url.cache_clear()
+            start = time.perf_counter()
+            groups = dedupe.cluster(titles, urls, threshold=args.threshold, num_perm=args.num_perm, bands=args.bands)
+            timings.append(time.perf_counter() - start)
+        precision, recall = pairwise_accuracy(groups, labels)
+        print(f"{size:>8} {len(set(labels)):>9} {len(groups):>7} {statistics.median(timings) * 1000:>10.2f} "
+              f"{precision:>10.3f} {recall:>7.3f}")
+        if min(precision, recall) < args.min_accuracy:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--duplicates", type=float, default=0.4, help="Share of results repeating an earlier product.")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--bands", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warm", action="store_true", help="Keep normalized titles and URLs cached between repeats.")
+    parser.add_argument("--min-accuracy", type=float, default=0.9, help="Exit 1 if precision or recall is lower.")
+    parser.add_argument("--seed", type=int, default=1234)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,69 @@
+# benchmarks/bench_email_outbox.py
+"""Compare per-message SMTP connections with the pooled EmailOutbox against a local SMTP stand-in.
+
+Usage:
+    python -m benchmarks.bench_email_outbox --messages 200 --connect-latency 0.05 --send-latency 0.002
+"""
+import argparse
+import asyncio
+import logging
+import smtplib
+import time
+from email.message import EmailMessage
+
+from benchmarks.fakes import FakeSMTPServer
+from shopy.outbox import EmailOutbox
+
+
+def make_message(i: int) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = "shopy@example.com"
+    message["To"] = f"user{i}@example.com"
+    message["Subject"] = f"Recommendation {i}"
+    message.set_content("Product B is the best match for your query.")
+    return message
+
+
+def send_per_connection(port: int, messages) -> None:
+    """The previous behaviour: connect, log in and send once per message."""
+    for message in messages:
+        with smtplib.SMTP("127.0.0.1", port) as server:
+            server.login("user", "pass")
+            server.send_message(message)
+
+
+async def main(count: int, connect_latency: float, send_latency: float, fail_every: int) -> None:
+    messages = [make_message(i) for i in range(count)]
+
+    async with FakeSMTPServer(connect_latency=connect_latency, send_latency=send_latency) as server:
+        start = time.perf_counter()
+        await asyncio.to_thread(send_per_connection, server.port, messages)
+        baseline = time.perf_counter() - start
+        print(f"per-message connections: {count} sent in {baseline:.3f}s "
+              f"({count / baseline:.1f} msg/s, {server.connections} connections)")
+
+    async with FakeSMTPServer(connect_latency=connect_latency, send_latency=send_latency, fail_every=fail_every) as server:
+        outbox = EmailOutbox("127.0.0.1", server.port, "user", "pass", use_ssl=False, backoff=0.01)
+        start = time.perf_counter()
+        for message in messages:
+            outbox.enqueue(message)
+        enqueued = time.perf_counter() - start
+        await outbox.flush()
+        pooled = time.perf_counter() - start
+        print(f"pooled outbox:           {len(server.messages)} sent in {pooled:.3f}s "
+              f"({count / pooled:.1f} msg/s, {server.connections} connections, "
+              f"enqueue of all messages took {enqueued * 1000:.2f} ms)")
+        print(f"outbox stats: {outbox.stats()}")
+        await outbox.aclose()
+    print(f"speedup: {baseline / pooled:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--connect-latency", type=float, default=0.05, help="Simulated handshake/login time per connection.")
+    parser.add_argument("--send-latency", type=float, default=0.002, help="Simulated time to accept one message.")
+    parser.add_argument("--fail-every", type=int, default=0, help="Make every Nth delivery fail transiently.")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    asyncio.run(main(args.messages, args.connect_latency, args.send_latency, args.fail_every))
@@ -0,0 +1,318 @@
+# benchmarks/bench_end_to_end.py
+"""Run the compiled ShopyAgent graph end to end against fake Tavily, shop page, LLM, YouTube and SMTP backends.
+
+Each concurrency level reports throughput, p50/p95/p99 latency, the tracemalloc
+peak and the memory each run in flight holds, a per-node and per-service
+breakdown, the estimated size of each prompt and the number of duplicate search
+results dropped. Results can be saved as JSON and
+compared against a previous run to catch regressions between commits.
+
+Latencies are given as seconds ("0.1") or "<distribution>:<mean>[:<spread>]" with
+distribution fixed, normal, lognormal or exponential (e.g. "lognormal:0.8:0.3").
+
+Usage:
+    python -m benchmarks.bench_end_to_end --levels 1 4 16 --runs 64 --output results.json
+    python -m benchmarks.bench_end_to_end --levels 1 4 16 --compare results.json --max-regression 10
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fakes import (
+    FakeHTTPServer,
+    FakeLLM,
+    FakeSMTPServer,
+    FakeYouTubeTool,
+    Latency,
+    fake_product_page_routes,
+    fake_tavily_routes,
+)
+from shopy.agent import ShopyAgent
+from shopy.cache import TTLCache
+from shopy.metrics import NODE_CACHE, NODE_ERRORS, REGISTRY, SEARCH_DUPLICATES
+from shopy.ratelimit import AdaptiveLimiter
+from shopy.resilience import BackendGuard
+from shopy.runtime import Toolset
+from shopy.tools import DataStructuringTool, DedupeTool, DisplayTool, EmailTool, ProductComparisonTool, TavilyTool
+from shopy.utils import percentile
+
+
+def make_requests(count: int, unique_queries: int, email_share: float, rng: random.Random) -> List[Dict[str, str]]:
+    return [
+        {
+            "query": f"benchmark product query {i % unique_queries}",
+            "email": f"user{i}@example.com" if rng.random() < email_share else "",
+        }
+        for i in range(count)
+    ]
+
+
+def series_summary(name: str, label: str) -> Dict[str, Dict[str, Any]]:
+    """Summarizes one histogram from the metrics registry, keyed by the value of `label`."""
+    summary = {}
+    for series in REGISTRY.to_dict()[name]["series"]:
+        key = series["labels"].get(label, "")
+        if series["labels"].get("outcome", "ok") != "ok":
+            key += f" ({series['labels']['outcome']})"
+        summary[key] = {
+            "count": series["count"],
+            "mean_ms": series["mean"] * 1000,
+            "p50_ms": series["p50"] * 1000,
+            "p95_ms": series["p95"] * 1000,
+        }
+    return summary
+
+
+async def run_requests(agent: ShopyAgent, requests: List[Dict[str, str]], concurrency: int) -> Dict[str, Any]:
+    latencies = []
+    failed = 0
+    start = time.perf_counter()
+    async for result in agent.run_many(requests, concurrency=concurrency):
+        latencies.append(result["latency"])
+        if not result["ok"]:
+            failed += 1
+    await agent.tools.email.flush()
+    wall = time.perf_counter() - start
+    return {"latencies": latencies, "failed": failed, "wall": wall}
+
+
+async def run_level(agent: ShopyAgent, concurrency: int, args: argparse.Namespace, rng: random.Random) -> Dict[str, Any]:
+    # Warm up connection pools so the first level doesn't pay for them.
+    await run_requests(agent, make_requests(concurrency, args.unique_queries, args.email_share, rng), concurrency)
+    REGISTRY.reset()
+
+    requests = make_requests(args.runs, args.unique_queries, args.email_share, rng)
+    timing = await run_requests(agent, requests, concurrency)
+    latencies = timing["latencies"]
+    result = {
+        "concurrency": concurrency,
+        "runs": len(latencies),
+        "failed": timing["failed"],
+        "wall_seconds": timing["wall"],
+        "throughput_per_second": len(latencies) / timing["wall"],
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p95_ms": percentile(latencies, 95) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "latency_max_ms": max(latencies) * 1000,
+        "node_errors": {s["labels"]["node"]: s["value"] for s in REGISTRY.to_dict()[NODE_ERRORS.name]["series"]},
+        "nodes": series_summary("shopy_node_duration_seconds", "node"),
+        "services": series_summary("shopy_external_call_duration_seconds", "service"),
+        "search_duplicates": SEARCH_DUPLICATES.value(),
+        "node_cache_hits": {
+            s["labels"]["node"]: s["value"] for s in REGISTRY.to_dict()[NODE_CACHE.name]["series"] if s["labels"]["result"] == "hit"
+        },
+        "prompt_tokens": {
+            s["labels"]["prompt"]: {"count": s["count"], "mean": s["mean"], "max": s["max"]}
+            for s in REGISTRY.to_dict()["shopy_prompt_tokens"]["series"]
+        },
+    }
+
+    if not args.skip_memory:
+        # tracemalloc slows every allocation, so memory is measured in a separate pass.
+        tracemalloc.start()
+        await run_requests(agent, make_requests(args.runs, args.unique_queries, args.email_share, rng), concurrency)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["memory_peak_mb"] = peak / (1024 * 1024)
+        # The peak is reached with `concurrency` runs in flight. What is still held once they have all
+        # finished (caches, pooled connections, metrics) is not theirs, so the rest is split between them.
+        result["memory_per_run_kb"] = (peak - retained) / concurrency / 1024
+    return result
+
+
+def print_level(result: Dict[str, Any]) -> None:
+    memory = (
+        f"{result['memory_peak_mb']:.1f} MB ({result['memory_per_run_kb']:.0f} KB/run)" if "memory_peak_mb" in result else "n/a"
+    )
+    print(
+        f"concurrency {result['concurrency']:>3}: {result['throughput_per_second']:7.1f} runs/s  "
+        f"p50 {result['latency_p50_ms']:7.1f} ms  p95 {result['latency_p95_ms']:7.1f} ms  "
+        f"p99 {result['latency_p99_ms']:7.1f} ms  failed {result['failed']}  peak mem {memory}"
+    )
+    if result["node_errors"]:
+        print("    errors handled in nodes: " + ", ".join(f"{node} {int(count)}" for node, count in result["node_errors"].items()))
+    if result.get("node_cache_hits"):
+        print("    node cache hits: " + ", ".join(f"{node} {int(count)}" for node, count in result["node_cache_hits"].items()))
+    if result.get("search_duplicates"):
+        print(f"    duplicate search results dropped: {int(result['search_duplicates'])}")
+    for title, breakdown in (("node", result["nodes"]), ("service", result["services"])):
+        for name, stats in sorted(breakdown.items(), key=lambda item: -item[1]["mean_ms"]):
+            print(f"    {title} {name:<28} mean {stats['mean_ms']:8.2f} ms  p95~{stats['p95_ms']:8.2f} ms  n={stats['count']}")
+    for name, stats in sorted(result["prompt_tokens"].items()):
+        print(f"    prompt {name:<27} mean {stats['mean']:8.1f} tokens  max {stats['max']:6.0f}  n={stats['count']}")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline_path: str, max_regression: float) -> bool:
+    """Prints throughput, p95 and memory changes against a saved run; returns False on a regression beyond the limit."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {level["concurrency"]: level for level in json.load(f)["levels"]}
+    ok = True
+    print(f"\ncompared with {baseline_path}:")
+    for level in results["levels"]:
+        before = baseline.get(level["concurrency"])
+        if before is None:
+            continue
+        throughput = (level["throughput_per_second"] / before["throughput_per_second"] - 1) * 100
+        p95 = (level["latency_p95_ms"] / before["latency_p95_ms"] - 1) * 100
+        regressed = max_regression and (throughput < -max_regression or p95 > max_regression)
+        ok = ok and not regressed
+        memory = ""
+        if "memory_per_run_kb" in level and "memory_per_run_kb" in before:
+            memory = f"  memory/run {(level['memory_per_run_kb'] / before['memory_per_run_kb'] - 1) * 100:+6.1f}%"
+        print(f"concurrency {level['concurrency']:>3}: throughput {throughput:+6.1f}%  p95 {p95:+6.1f}%{memory}"
+              + ("  REGRESSION" if regressed else ""))
+    return ok
+
+
+async def main(args: argparse.Namespace) -> int:
+    # Each fake draws from its own seeded generator so that one service's samples
+    # don't depend on how calls to the others happen to interleave.
+    rng, tavily_rng, llm_rng, youtube_rng, smtp_rng, page_rng = (random.Random(args.seed + i) for i in range(6))
+    async with contextlib.AsyncExitStack() as servers:
+        # Search results point at pages on `--shops` separate servers, so they spread over
+        # several hosts as real results do and the per-host connection limit applies per shop.
+        page_urls = []
+        for shop in range(args.shops):
+            page_server = await servers.enter_async_context(FakeHTTPServer(
+                fake_product_page_routes(pages=args.results, latency=args.page_latency, padding_kb=args.page_padding_kb, rng=page_rng)
+            ))
+            page_urls.extend(f"{page_server.base_url}/products/{i}" for i in range(shop, args.results, args.shops))
+        tavily_server = await servers.enter_async_context(FakeHTTPServer(
+            fake_tavily_routes(
+                latency=args.tavily_latency,
+                results=args.results,
+                failure_rate=args.tavily_failure_rate,
+                rng=tavily_rng,
+                page_urls=page_urls,
+                duplicate_rate=args.search_duplicates,
+                stall_rate=args.tavily_stall_rate,
+                stall=args.tavily_stall,
+                quota=args.tavily_quota,
+            )
+        ))
+        smtp_server = await servers.enter_async_context(FakeSMTPServer(
+            connect_latency=args.smtp_connect_latency, send_latency=args.smtp_latency, failure_rate=args.smtp_failure_rate, rng=smtp_rng
+        ))
+        tools = Toolset(
+            llm=FakeLLM(latency=args.llm_latency, failure_rate=args.llm_failure_rate, rng=llm_rng),
+            tavily=TavilyTool(
+                api_key="bench",
+                base_url=tavily_server.base_url,
+                max_connections=max(args.levels),
+                cache=TTLCache(namespace="bench", max_entries=4096) if args.search_cache else None,
+                guard=BackendGuard(
+                    "tavily",
+                    rng=random.Random(args.seed),
+                    limiter=AdaptiveLimiter("tavily", max_concurrency=max(args.levels)) if args.rate_limit else None,
+                ) if args.guard or args.rate_limit else None,
+                fallback=args.guard or args.rate_limit,
+            ),
+            dedupe=DedupeTool(),
+            data_structuring=DataStructuringTool(
+                max_connections=max(args.levels) * args.results,
+                max_per_host=args.page_max_per_host,
+                parse_workers=args.parse_workers,
+            ),
+            youtube=FakeYouTubeTool(latency=args.youtube_latency, failure_rate=args.youtube_failure_rate, rng=youtube_rng),
+            product_comparison=ProductComparisonTool(),
+            email=EmailTool(
+                gmail_user="bench@example.com",
+                gmail_pass="bench",
+                smtp_server="127.0.0.1",
+                port=smtp_server.port,
+                use_ssl=False,
+            ),
+            display=DisplayTool(),
+            node_cache=TTLCache(namespace="bench_nodes", max_entries=4096) if args.node_cache else None,
+        )
+        agent = ShopyAgent(tools=tools, combine_llm_calls=args.combine_llm_calls, run_budget=args.run_budget)
+        tools.email.outbox.backoff = 0.01
+
+        levels = []
+        for concurrency in args.levels:
+            result = await run_level(agent, concurrency, args, rng)
+            print_level(result)
+            levels.append(result)
+        await tools.aclose()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "settings": {
+                key: value.to_dict() if isinstance(value, Latency) else value
+                for key, value in vars(args).items()
+                if key not in ("output", "compare", "max_regression")
+            },
+        },
+        "levels": levels,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64], help="Concurrency levels to measure.")
+    parser.add_argument("--runs", type=int, default=128, help="Graph runs per concurrency level.")
+    parser.add_argument("--unique-queries", type=int, default=1_000_000, help="Distinct queries to cycle through.")
+    parser.add_argument("--email-share", type=float, default=0.5, help="Share of runs that send an email.")
+    parser.add_argument("--results", type=int, default=5, help="Search results returned per query.")
+    parser.add_argument("--search-duplicates", type=float, default=0.0,
+                        help="Share of search results that repeat an earlier product (retailer, review or tracking URL).")
+    parser.add_argument("--search-cache", action="store_true", help="Enable the in-memory search cache.")
+    parser.add_argument("--node-cache", action="store_true", help="Memoize schema mapping, comparison and YouTube lookups in memory.")
+    parser.add_argument("--combine-llm-calls", action="store_true", help="One structured LLM call for summary and email.")
+    parser.add_argument("--tavily-latency", type=Latency.parse, default=Latency(0.15, 0.05, "lognormal"))
+    parser.add_argument("--tavily-stall-rate", type=float, default=0.0, help="Share of Tavily requests that stall.")
+    parser.add_argument("--tavily-stall", type=float, default=2.0, help="Seconds a stalled Tavily request takes longer.")
+    parser.add_argument("--guard", action="store_true", help="Run Tavily calls under a BackendGuard (retries, hedging, breaker).")
+    parser.add_argument("--tavily-quota", type=float, default=0.0, help="Tavily requests per second before it answers 429.")
+    parser.add_argument("--rate-limit", action="store_true", help="Guard Tavily calls with an adaptive rate limiter too.")
+    parser.add_argument("--run-budget", type=float, help="Seconds each run may take before guarded calls fall back.")
+    parser.add_argument("--page-latency", type=Latency.parse, default=Latency(0.2, 0.1, "lognormal"))
+    parser.add_argument("--shops", type=int, default=5, help="Fake shop servers the search results point at.")
+    parser.add_argument("--page-max-per-host", type=int, default=4, help="Concurrent page fetches per shop.")
+    parser.add_argument("--page-padding-kb", type=int, default=32, help="Extra markup per shop page.")
+    parser.add_argument("--parse-workers", type=int, default=2, help="Page parsing processes (0 parses in a thread).")
+    parser.add_argument("--llm-latency", type=Latency.parse, default=Latency(0.8, 0.3, "lognormal"))
+    parser.add_argument("--youtube-latency", type=Latency.parse, default=Latency(0.1, 0.03, "lognormal"))
+    parser.add_argument("--smtp-latency", type=Latency.parse, default=Latency(0.01))
+    parser.add_argument("--smtp-connect-latency", type=Latency.parse, default=Latency(0.1))
+    parser.add_argument("--tavily-failure-rate", type=float, default=0.0)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--youtube-failure-rate", type=float, default=0.0)
+    parser.add_argument("--smtp-failure-rate", type=float, default=0.0)
+    parser.add_argument("--skip-memory", action="store_true", help="Skip the tracemalloc pass.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    parser.add_argument("--compare", help="A previous --output file to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.0,
+                        help="With --compare, exit 1 if throughput drops or p95 grows by more than this percentage.")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,92 @@
+# benchmarks/bench_import_time.py
+"""Measure how long importing the shopy modules takes and which heavy dependencies they load.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, so
+results are not skewed by modules already imported by this script.
+
+Usage:
+    python -m benchmarks.bench_import_time --repeat 5 --max-ms 400
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+MODULES = ["shopy", "shopy.models", "shopy.tools", "shopy.runtime", "shopy.agent", "shopy.main"]
+
+# Dependencies that are only needed once a run actually happens. None of them
+# should be pulled in just by importing shopy.
+HEAVY_MODULES = ["google.generativeai", "langgraph", "langchain_core", "aiohttp", "rich", "streamlit", "numpy"]
+
+
+def import_profile(module: str) -> Tuple[float, List[Tuple[float, str]], List[str]]:
+    """Imports `module` in a new interpreter and returns (total ms, per-module cumulative ms, loaded heavy modules)."""
+    code = (
+        f"import {module}, sys; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = []
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        ms = int(cumulative) / 1000
+        name = name.strip()
+        if name == "site":
+            # Everything reported so far was loaded by interpreter startup, not by `module`.
+            timings = []
+            continue
+        timings.append((ms, name))
+        if name == module:
+            total = ms
+    heavy = [m for m in result.stdout.strip().split(",") if m]
+    return total, timings, heavy
+
+
+def main(modules: List[str], repeat: int, top: int, max_ms: float) -> int:
+    failures = []
+    for module in modules:
+        totals = []
+        timings: List[Tuple[float, str]] = []
+        heavy: List[str] = []
+        for _ in range(repeat):
+            total, timings, heavy = import_profile(module)
+            totals.append(total)
+        best = min(totals)
+        print(f"{module:<16} best {best:7.1f} ms   median {statistics.median(totals):7.1f} ms")
+
+        top_level: Dict[str, float] = {}
+        for ms, name in timings:
+            if name != module and not name.startswith("shopy"):
+                root = name.split(".")[0]
+                top_level[root] = max(top_level.get(root, 0.0), ms)
+        slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:top]
+        print("    slowest dependencies: " + ", ".join(f"{name} {ms:.1f} ms" for name, ms in slowest))
+
+        if heavy:
+            print(f"    heavy modules loaded: {', '.join(heavy)}")
+            failures.append(f"{module} imports {', '.join(heavy)}")
+        if max_ms and best > max_ms:
+            failures.append(f"{module} took {best:.1f} ms (limit {max_ms:.1f} ms)")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module; the best time is reported.")
+    parser.add_argument("--top", type=int, default=5, help="How many of the slowest dependencies to list.")
+    parser.add_argument("--max-ms", type=float, default=0, help="Fail if any module takes longer than this to import.")
+    args = parser.parse_args()
+    sys.exit(main(args.modules, args.repeat, args.top, args.max_ms))
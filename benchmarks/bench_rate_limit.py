@@ -0,0 +1,115 @@
+# benchmarks/bench_rate_limit.py
+"""Measure goodput and latency of concurrent Tavily callers against a rate-limited fake backend.
+
+The fake Tavily server accepts `--quota` requests per second (beyond that it
+answers 429) and serves `--capacity` requests at a time, so latency climbs when
+more are sent. `--callers` workers each run `--calls` searches back to back;
+one in `--interactive-every` of them is interactive and the rest batch.
+
+Every caller uses a guarded TavilyTool with retries and no fallback, like a run
+under load. The limiter settings compared are:
+
+* none: no limiter, only the guard's retries.
+* static: a token bucket at the quota and a fixed concurrency limit.
+* adaptive: no known quota; AIMD concurrency only.
+* both: a token bucket at the quota plus AIMD concurrency.
+
+For each it reports goodput (successful searches per second), 429s received,
+searches that failed after retries and the p50/p95 latency per priority.
+
+Usage:
+    python -m benchmarks.bench_rate_limit --callers 64 --calls 10 --quota 100 --capacity 16
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fakes import FakeHTTPServer, Latency, fake_tavily_routes
+from shopy.metrics import THROTTLED
+from shopy.ratelimit import BATCH, INTERACTIVE, AdaptiveLimiter, priority_var
+from shopy.resilience import BackendGuard
+from shopy.tools import TavilyTool
+from shopy.utils import percentile
+
+
+async def run_callers(tool: TavilyTool, args: argparse.Namespace) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = {INTERACTIVE: [], BATCH: []}
+    failures = 0
+
+    async def caller(index: int) -> None:
+        nonlocal failures
+        priority = INTERACTIVE if index % args.interactive_every == 0 else BATCH
+        priority_var.set(priority)
+        for call in range(args.calls):
+            start = time.perf_counter()
+            try:
+                await tool.search(f"caller {index} query {call}")
+                latencies[priority].append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller(i) for i in range(args.callers)))
+    return {"wall": time.perf_counter() - start, "latencies": latencies, "failures": failures}
+
+
+async def scenario(label: str, args: argparse.Namespace, limiter: Optional[AdaptiveLimiter]) -> None:
+    routes = fake_tavily_routes(latency=args.latency, quota=args.quota, capacity=args.capacity, rng=random.Random(args.seed))
+    async with FakeHTTPServer(routes) as server:
+        guard = BackendGuard(
+            "tavily", timeout=args.timeout, retries=args.retries, hedge=False,
+            failure_threshold=10 ** 9, rng=random.Random(args.seed), limiter=limiter,
+        )
+        tool = TavilyTool(api_key="bench", base_url=server.base_url, timeout=args.timeout, max_connections=256, guard=guard)
+        throttled_before = THROTTLED.value(service="tavily")
+        result = await run_callers(tool, args)
+        await tool.aclose()
+    succeeded = args.callers * args.calls - result["failures"]
+    # Without a limiter nothing counts 429s client-side, but every request beyond the successes was one.
+    throttled = THROTTLED.value(service="tavily") - throttled_before if limiter is not None else server.requests - succeeded
+    line = (
+        f"  {label:<9} goodput {succeeded / result['wall']:7.1f}/s  429s {int(throttled):>5}  failed {result['failures']:>4}"
+    )
+    for priority in (INTERACTIVE, BATCH):
+        values = result["latencies"][priority]
+        if values:
+            line += f"  {priority} p50 {percentile(values, 50) * 1000:6.0f} ms p95 {percentile(values, 95) * 1000:6.0f} ms"
+    if limiter is not None:
+        line += f"  final limit {limiter.concurrency}"
+    print(line)
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"{args.callers} callers x {args.calls} searches, 1 in {args.interactive_every} interactive; "
+        f"backend quota {args.quota}/s, capacity {args.capacity}, latency {args.latency}"
+    )
+    await scenario("none", args, None)
+    await scenario("static", args, AdaptiveLimiter(
+        "tavily", requests_per_second=args.quota, max_concurrency=args.capacity, adaptive=False
+    ))
+    await scenario("adaptive", args, AdaptiveLimiter("tavily", max_concurrency=args.max_concurrency))
+    await scenario("both", args, AdaptiveLimiter(
+        "tavily", requests_per_second=args.quota, max_concurrency=args.max_concurrency
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--callers", type=int, default=64)
+    parser.add_argument("--calls", type=int, default=10, help="Searches per caller.")
+    parser.add_argument("--interactive-every", type=int, default=8, help="One caller in this many is interactive.")
+    parser.add_argument("--latency", type=Latency.parse, default=Latency(0.05, 0.01, "lognormal"))
+    parser.add_argument("--quota", type=float, default=100.0, help="Requests per second the backend accepts.")
+    parser.add_argument("--capacity", type=int, default=16, help="Requests the backend serves at once.")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Starting and maximum limit of the adaptive limiters.")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,112 @@
+# benchmarks/bench_resilience.py
+"""Measure how deadlines, retries, hedging and circuit breakers change Tavily call latency.
+
+Three scenarios run against a local fake Tavily server:
+
+* tail: most responses are fast, but a `--stall-rate` share stall for `--stall`
+  seconds. Compares a plain TavilyTool with guarded ones with and without hedging.
+* outage: every request fails with a 500. Compares plain calls, guarded calls that
+  keep retrying, and the circuit breaker failing fast to the mock results.
+* deadline: stalls as in `tail`, but each call runs with only `--budget` seconds
+  left of its run budget, so no call may take longer than that.
+
+For each it reports p50/p95/p99/max latency, errors, fallbacks and the requests
+the server received.
+
+Usage:
+    python -m benchmarks.bench_resilience --calls 400 --concurrency 8 --stall-rate 0.03 --stall 2
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fakes import FakeHTTPServer, Latency, fake_tavily_routes
+from shopy.metrics import FALLBACKS, HEDGED_REQUESTS
+from shopy.resilience import BackendGuard, deadline_var
+from shopy.tools import TavilyTool
+from shopy.utils import percentile
+
+
+async def run_calls(tool: TavilyTool, calls: int, concurrency: int, budget: Optional[float]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            if budget is not None:
+                deadline_var.set(time.monotonic() + budget)
+            start = time.perf_counter()
+            try:
+                await tool.search(f"query {i}")
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return {"latencies": latencies, "errors": errors}
+
+
+async def scenario(
+    label: str, args: argparse.Namespace, guard: Optional[BackendGuard], fallback: bool, budget: Optional[float] = None,
+    failure_rate: float = 0.0, stall_rate: float = 0.0,
+) -> None:
+    routes = fake_tavily_routes(
+        latency=args.latency, failure_rate=failure_rate, stall_rate=stall_rate, stall=args.stall, rng=random.Random(args.seed)
+    )
+    async with FakeHTTPServer(routes) as server:
+        tool = TavilyTool(api_key="bench", base_url=server.base_url, timeout=args.timeout, guard=guard, fallback=fallback)
+        fallbacks = FALLBACKS.value(service="tavily")
+        hedges = HEDGED_REQUESTS.value(service="tavily", result="sent")
+        result = await run_calls(tool, args.calls, args.concurrency, budget)
+        await tool.aclose()
+        latencies = result["latencies"]
+        print(
+            f"  {label:<26} p50 {percentile(latencies, 50) * 1000:7.1f} ms  p95 {percentile(latencies, 95) * 1000:7.1f} ms  "
+            f"p99 {percentile(latencies, 99) * 1000:7.1f} ms  max {max(latencies) * 1000:7.1f} ms  "
+            f"errors {result['errors']:>4}  fallbacks {int(FALLBACKS.value(service='tavily') - fallbacks):>4}  "
+            f"hedges {int(HEDGED_REQUESTS.value(service='tavily', result='sent') - hedges):>3}  requests {server.requests}"
+        )
+
+
+def guard(args: argparse.Namespace, **overrides: Any) -> BackendGuard:
+    options = dict(timeout=args.timeout, retries=args.retries, reset_after=args.reset_after, rng=random.Random(args.seed))
+    options.update(overrides)
+    return BackendGuard("tavily", **options)
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{args.calls} calls, {args.concurrency} at once, latency {args.latency}, timeout {args.timeout}s")
+    print(f"tail: {args.stall_rate:.0%} of requests stall for {args.stall}s")
+    await scenario("plain", args, None, False, stall_rate=args.stall_rate)
+    await scenario("guard, no hedging", args, guard(args, hedge=False), False, stall_rate=args.stall_rate)
+    await scenario("guard, hedging at p95", args, guard(args), False, stall_rate=args.stall_rate)
+    print("outage: every request answers 500")
+    await scenario("plain", args, None, False, failure_rate=1.0)
+    await scenario("retries, no breaker", args, guard(args, failure_threshold=10 ** 9), True, failure_rate=1.0)
+    await scenario("retries and breaker", args, guard(args), True, failure_rate=1.0)
+    print(f"deadline: {args.budget}s left of the run budget, stalls as in tail")
+    await scenario("plain", args, None, False, stall_rate=args.stall_rate)
+    await scenario("guard with deadline", args, guard(args, hedge=False), True, budget=args.budget, stall_rate=args.stall_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=Latency.parse, default=Latency(0.03, 0.01, "lognormal"))
+    parser.add_argument("--stall-rate", type=float, default=0.03, help="Share of requests that stall.")
+    parser.add_argument("--stall", type=float, default=2.0, help="Seconds a stalled request takes longer.")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Per-attempt timeout.")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--reset-after", type=float, default=30.0, help="Seconds an open circuit stays open.")
+    parser.add_argument("--budget", type=float, default=0.5, help="Run budget left for each call in the deadline scenario.")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    sys.exit(asyncio.run(main(args)))
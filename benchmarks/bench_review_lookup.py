@@ -0,0 +1,84 @@
+# benchmarks/bench_review_lookup.py
+"""Measure how long review links for a whole comparison table take with per-product and batched lookups.
+
+A fake YouTube Data API server answers each search after `--latency`. For each
+table size, `--tables` comparison tables of distinct products are resolved three ways:
+
+* sequential: one `fetch_review_link` call per product, one after another.
+* batched: one `fetch_review_links` call per table, searching its products concurrently.
+* cached: the batched call again, answered from the review link cache.
+
+Each reports the mean time per table and the API requests made. Every table also
+names one product twice under another spelling, which the batched lookup resolves once.
+
+Usage:
+    python -m benchmarks.bench_review_lookup --sizes 1 5 10 20 --latency 0.15
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+from benchmarks.fakes import FakeHTTPServer, Latency, fake_youtube_routes
+from shopy.cache import TTLCache
+from shopy.tools import YouTubeTool
+
+
+def make_tables(count: int, size: int) -> List[List[Dict[str, Any]]]:
+    tables = []
+    for t in range(count):
+        table = [{"product_name": f"Brand{t} Phone {size}{i} Pro"} for i in range(size)]
+        # The same product as a shop would list it.
+        table.append({"product_name": f"brand{t} phone {size}0 pro | Example Shop"})
+        tables.append(table)
+    return tables
+
+
+async def timed(tables: List[List[Dict[str, Any]]], resolve) -> float:
+    start = time.perf_counter()
+    for table in tables:
+        links = await resolve(table)
+        assert all(links.get(p["product_name"]) for p in table), "missing review link"
+    return (time.perf_counter() - start) / len(tables)
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{args.tables} tables per size; API latency {args.latency}, {args.concurrency} lookups in flight")
+    routes = fake_youtube_routes(latency=args.latency, rng=random.Random(args.seed))
+    async with FakeHTTPServer(routes) as server:
+        for size in args.sizes:
+            tables = make_tables(args.tables, size)
+            tool = YouTubeTool(
+                api_key="bench", base_url=server.base_url, max_concurrency=args.concurrency,
+                cache=TTLCache(namespace="youtube", max_entries=100000, default_ttl=3600),
+            )
+
+            async def sequential(table: List[Dict[str, Any]]) -> Dict[str, str]:
+                plain = YouTubeTool(api_key="bench", base_url=server.base_url)
+                try:
+                    return {p["product_name"]: await plain.fetch_review_link(p) for p in table}
+                finally:
+                    await plain.aclose()
+
+            results = []
+            for label, resolve in (("sequential", sequential), ("batched", tool.fetch_review_links), ("cached", tool.fetch_review_links)):
+                before = server.requests
+                per_table = await timed(tables, resolve)
+                results.append(f"{label} {per_table * 1000:7.1f} ms {(server.requests - before) / len(tables):5.1f} req")
+            await tool.aclose()
+            print(f"  {size:>3} products + 1 alias:  " + "   ".join(results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--tables", type=int, default=5, help="Comparison tables per size.")
+    parser.add_argument("--latency", type=Latency.parse, default=Latency(0.15, 0.05, "lognormal"))
+    parser.add_argument("--concurrency", type=int, default=8, help="YouTube lookups in flight per table.")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,46 @@
+# benchmarks/bench_tavily_concurrency.py
+"""Measure how TavilyTool.search scales with concurrency against a local fake Tavily server.
+
+Usage:
+    python -m benchmarks.bench_tavily_concurrency --latency 0.1 --levels 1 2 4 8 16 32 64
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from benchmarks.fakes import FakeHTTPServer, fake_tavily_routes
+from shopy.tools import TavilyTool
+
+
+async def run_level(tool: TavilyTool, concurrency: int) -> float:
+    """Run `concurrency` searches at once and return the wall time."""
+    start = time.perf_counter()
+    await asyncio.gather(*(tool.search(f"query {i}") for i in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def main(latency: float, levels, max_connections: int) -> None:
+    async with FakeHTTPServer(fake_tavily_routes(latency=latency)) as server:
+        tool = TavilyTool(api_key="bench", base_url=server.base_url, max_connections=max_connections)
+        await run_level(tool, max(levels))  # warm up the connection pool
+
+        print(f"fake Tavily latency: {latency * 1000:.0f} ms, pool size: {max_connections}")
+        print(f"{'concurrency':>11} {'wall (s)':>9} {'req/s':>8} {'speedup':>8} {'efficiency':>10}")
+        baseline = await run_level(tool, 1)
+        for level in levels:
+            wall = await run_level(tool, level)
+            speedup = level * baseline / wall
+            print(f"{level:>11} {wall:>9.3f} {level / wall:>8.1f} {speedup:>8.1f} {speedup / level:>10.0%}")
+        print(f"connections opened: {server.connections}, requests served: {server.requests}")
+        await tool.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.1, help="Simulated Tavily response time in seconds.")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--max-connections", type=int, default=64)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    asyncio.run(main(args.latency, args.levels, args.max_connections))
@@ -0,0 +1,125 @@
+# benchmarks/bench_worker_pool.py
+"""Measure job throughput of the worker pool by process count, and check that jobs survive a killed worker.
+
+The fake Tavily and shop page servers run in this process; every worker process
+builds its own agent with a fake LLM and YouTube tool (see `make_agent`). For each
+`--processes` value, `--jobs` queries are submitted to a fresh SQLite job queue and
+the pool runs them until the queue is empty. Throughput is jobs per second of wall
+time from start to finish, process start-up included.
+
+The crash test then starts `--crash-processes` workers, SIGKILLs one of them once
+jobs are flowing and waits for the queue to drain. It reports how many jobs were
+run again after their worker was lost and whether any job ended up failed or lost.
+
+Usage:
+    python -m benchmarks.bench_worker_pool --jobs 200 --processes 1 2 4 --concurrency 8
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+from benchmarks.fakes import FakeHTTPServer, FakeLLM, FakeYouTubeTool, Latency, fake_product_page_routes, fake_tavily_routes
+from shopy.jobs import DONE, JobQueue, WorkerPool
+
+
+def make_agent(tavily_url: str, llm_latency: Latency, youtube_latency: Latency, seed: int):
+    """Builds a worker's agent against the fake backends; runs in the worker process."""
+    from shopy.agent import ShopyAgent
+    from shopy.runtime import Toolset
+    from shopy.tools import DataStructuringTool, DedupeTool, DisplayTool, EmailTool, ProductComparisonTool, TavilyTool
+
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(seed + os.getpid())
+    return ShopyAgent(tools=Toolset(
+        llm=FakeLLM(latency=llm_latency, rng=rng),
+        tavily=TavilyTool(api_key="bench", base_url=tavily_url),
+        dedupe=DedupeTool(),
+        data_structuring=DataStructuringTool(parse_workers=0),
+        youtube=FakeYouTubeTool(latency=youtube_latency, rng=rng),
+        product_comparison=ProductComparisonTool(),
+        email=EmailTool(gmail_user="bench@example.com", gmail_pass="bench", smtp_server="127.0.0.1", port=1, use_ssl=False),
+        display=DisplayTool(),
+    ))
+
+
+async def drain(args: argparse.Namespace, path: str, processes: int, factory: Any, kill_after: float = 0.0) -> Dict[str, Any]:
+    queue = JobQueue(path, lease_seconds=args.lease)
+    job_ids = queue.submit_many(f"benchmark product query {i}" for i in range(args.jobs))
+    pool = WorkerPool(path, processes=processes, concurrency=args.concurrency, lease_seconds=args.lease, agent_factory=factory)
+    start = time.perf_counter()
+    pool.start()
+    supervisor = asyncio.create_task(pool.supervise(until_idle=True, check_interval=0.1))
+    if kill_after:
+        # Kill once the victim holds jobs, so some are lost mid-run.
+        await asyncio.sleep(kill_after)
+        pool.kill(pool.names[0])
+    await supervisor
+    wall = time.perf_counter() - start
+    pool.stop()
+    statuses = [queue.status(job_id) for job_id in job_ids]
+    queue.close()
+    return {
+        "wall": wall,
+        "done": sum(1 for status in statuses if status["status"] == DONE),
+        "retried": sum(1 for status in statuses if status["attempts"] > 1),
+        "restarts": pool.restarts,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"{args.jobs} jobs, {args.concurrency} in flight per worker, {os.cpu_count()} CPU cores; latency: "
+        f"tavily {args.tavily_latency}, pages {args.page_latency}, llm {args.llm_latency}, youtube {args.youtube_latency}"
+    )
+    rng = random.Random(args.seed)
+    async with contextlib.AsyncExitStack() as stack:
+        pages = await stack.enter_async_context(FakeHTTPServer(
+            fake_product_page_routes(pages=args.results, latency=args.page_latency, rng=rng)
+        ))
+        page_urls = [f"{pages.base_url}/products/{i}" for i in range(args.results)]
+        tavily = await stack.enter_async_context(FakeHTTPServer(
+            fake_tavily_routes(latency=args.tavily_latency, results=args.results, rng=rng, page_urls=page_urls)
+        ))
+        factory = functools.partial(make_agent, tavily.base_url, args.llm_latency, args.youtube_latency, args.seed)
+        with tempfile.TemporaryDirectory() as directory:
+            for processes in args.processes:
+                result = await drain(args, os.path.join(directory, f"jobs-{processes}.sqlite"), processes, factory)
+                print(
+                    f"  {processes:>2} processes  {result['done']:>5}/{args.jobs} done  "
+                    f"wall {result['wall']:6.2f} s  {result['done'] / result['wall']:6.1f} jobs/s"
+                )
+            result = await drain(
+                args, os.path.join(directory, "crash.sqlite"), args.crash_processes, factory, kill_after=args.kill_after
+            )
+            print(
+                f"crash test ({args.crash_processes} processes, one SIGKILLed after {args.kill_after:.1f} s, "
+                f"{args.lease:.0f} s leases): {result['done']}/{args.jobs} done, {result['retried']} run again, "
+                f"{result['restarts']} worker restarts, wall {result['wall']:.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=8, help="Jobs in flight per worker process.")
+    parser.add_argument("--lease", type=float, default=3.0, help="Job lease in seconds.")
+    parser.add_argument("--crash-processes", type=int, default=2)
+    parser.add_argument("--kill-after", type=float, default=4.0, help="Seconds after start to kill a worker.")
+    parser.add_argument("--results", type=int, default=5, help="Search results per query.")
+    parser.add_argument("--tavily-latency", type=Latency.parse, default=Latency(0.3, 0.1, "lognormal"))
+    parser.add_argument("--page-latency", type=Latency.parse, default=Latency(0.2, 0.05, "lognormal"))
+    parser.add_argument("--llm-latency", type=Latency.parse, default=Latency(0.8, 0.3, "lognormal"))
+    parser.add_argument("--youtube-latency", type=Latency.parse, default=Latency(0.1, 0.03, "lognormal"))
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,486 @@
+# benchmarks/fakes.py
+"""Local stand-ins for the external services Shopy talks to."""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs
+
+from shopy.exceptions import LLMError, YouTubeReviewError
+from shopy.llm import mock_structured
+from shopy.metrics import EXTERNAL_SECONDS
+from shopy.tools import YouTubeTool
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Tuple[int, Any]]]
+
+REASONS = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class Latency:
+    """
+    A response-time distribution for a fake service.
+
+    `distribution` is one of "fixed", "normal", "lognormal" or "exponential". `mean`
+    is in seconds; `spread` is the standard deviation for "normal" and "lognormal"
+    and is ignored otherwise. Samples are never negative.
+    """
+
+    DISTRIBUTIONS = ("fixed", "normal", "lognormal", "exponential")
+
+    def __init__(self, mean: float, spread: float = 0.0, distribution: str = "fixed"):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution!r}, expected one of {self.DISTRIBUTIONS}")
+        self.mean = mean
+        self.spread = spread
+        self.distribution = distribution
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """Parses "0.1" (fixed), or "<distribution>:<mean>[:<spread>]" such as "lognormal:0.5:0.2"."""
+        parts = spec.split(":")
+        if len(parts) == 1:
+            return cls(float(parts[0]))
+        return cls(float(parts[1]), float(parts[2]) if len(parts) > 2 else 0.0, parts[0])
+
+    def sample(self, rng: random.Random) -> float:
+        if self.mean <= 0:
+            return 0.0
+        if self.distribution == "normal":
+            return max(0.0, rng.gauss(self.mean, self.spread))
+        if self.distribution == "lognormal":
+            # Pick mu/sigma so the samples have the requested mean and standard deviation.
+            sigma2 = math.log(1 + (self.spread / self.mean) ** 2)
+            return rng.lognormvariate(math.log(self.mean) - sigma2 / 2, math.sqrt(sigma2))
+        if self.distribution == "exponential":
+            return rng.expovariate(1 / self.mean)
+        return self.mean
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"distribution": self.distribution, "mean": self.mean, "spread": self.spread}
+
+    def __repr__(self) -> str:
+        return f"Latency({self.distribution}, mean={self.mean}, spread={self.spread})"
+
+
+def _as_latency(latency: Union[float, Latency], jitter: float = 0.0) -> Latency:
+    if isinstance(latency, Latency):
+        return latency
+    return Latency(latency, jitter, "normal" if jitter else "fixed")
+
+
+class FakeHTTPServer:
+    """A minimal keep-alive HTTP/1.1 server that dispatches JSON requests to async handlers."""
+
+    def __init__(self, routes: Dict[Tuple[str, str], Handler], host: str = "127.0.0.1", port: int = 0):
+        self.routes = routes
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def __aenter__(self) -> "FakeHTTPServer":
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path, _, query_string = target.partition("?")
+                request = {"method": method, "path": path, "query": query_string, "headers": headers, "body": body}
+                self.requests += 1
+
+                handler = self.routes.get((method, path))
+                if handler is None:
+                    status, payload = 404, {"detail": "not found"}
+                else:
+                    status, payload = await handler(request)
+                if isinstance(payload, (bytes, str)):
+                    data = payload.encode() if isinstance(payload, str) else payload
+                    content_type = "text/html; charset=utf-8"
+                else:
+                    data = json.dumps(payload).encode()
+                    content_type = "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    "Connection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def fake_tavily_routes(
+    latency: Union[float, Latency] = 0.05,
+    jitter: float = 0.0,
+    results: int = 5,
+    failure_rate: float = 0.0,
+    rng: Optional[random.Random] = None,
+    page_urls: Optional[List[str]] = None,
+    duplicate_rate: float = 0.0,
+    stall_rate: float = 0.0,
+    stall: float = 0.0,
+    quota: float = 0.0,
+    capacity: int = 0,
+) -> Dict[Tuple[str, str], Handler]:
+    """
+    Routes emulating the Tavily /search endpoint with a configurable response time.
+
+    A `failure_rate` share of requests answer 500 after the same delay. Result URLs
+    are taken in turn from `page_urls` (e.g. a fake product page server), or point
+    at an unreachable example.com shop. Each result names a different model, except
+    that a `duplicate_rate` share of results after the first repeat an earlier one
+    as a retailer listing, a review or a tracking-parameter URL. A `stall_rate`
+    share of requests take `stall` seconds longer, like a backend's slow tail.
+
+    With a `quota`, requests beyond that many per second (with a one-second burst)
+    answer 429 at once, like a provider's rate limit. With a `capacity`, at most that
+    many requests are served at a time and the rest queue, so latency climbs with load.
+    """
+    latency = _as_latency(latency, jitter)
+    rng = rng or random.Random()
+    allowance = {"level": quota, "updated": time.monotonic()}
+    slots = asyncio.Semaphore(capacity) if capacity else None
+
+    def over_quota() -> bool:
+        now = time.monotonic()
+        allowance["level"] = min(quota, allowance["level"] + (now - allowance["updated"]) * quota)
+        allowance["updated"] = now
+        if allowance["level"] < 1:
+            return True
+        allowance["level"] -= 1
+        return False
+    variants = ("{title} | Example Shop", "{title} review", "Buy {title} - best price")
+
+    async def search(request: Dict[str, Any]) -> Tuple[int, Any]:
+        if quota and over_quota():
+            return 429, {"detail": "rate limit exceeded"}
+        if slots is not None:
+            async with slots:
+                return await respond(request)
+        return await respond(request)
+
+    async def respond(request: Dict[str, Any]) -> Tuple[int, Any]:
+        query = json.loads(request["body"] or b"{}").get("query", "")
+        await asyncio.sleep(latency.sample(rng) + (stall if stall_rate and rng.random() < stall_rate else 0.0))
+        if failure_rate and rng.random() < failure_rate:
+            return 500, {"detail": "injected failure"}
+        items: List[Dict[str, str]] = []
+        originals: List[Dict[str, str]] = []
+        for i in range(results):
+            if originals and duplicate_rate and rng.random() < duplicate_rate:
+                original = rng.choice(originals)
+                items.append({
+                    "title": rng.choice(variants).format(title=original["title"]),
+                    "url": f"{original['url']}?utm_source=bench&ref=result{i}",
+                })
+                continue
+            n = len(originals)
+            originals.append({
+                "title": f"{query} model {n + 1}",
+                "url": page_urls[n % len(page_urls)] if page_urls else f"https://shop.example.com/{n}",
+            })
+            items.append(originals[-1])
+        return 200, {"query": query, "results": items}
+
+    return {("POST", "/search"): search}
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def fake_product_page_routes(
+    pages: int = 5,
+    latency: Union[float, Latency] = 0.0,
+    padding_kb: int = 0,
+    failure_rate: float = 0.0,
+    rng: Optional[random.Random] = None,
+) -> Dict[Tuple[str, str], Handler]:
+    """
+    Routes serving the fixture product pages in `benchmarks/fixtures` at /products/0 .. /products/<pages - 1>.
+
+    Pages cycle through the fixtures. `padding_kb` appends that much extra markup
+    (a long review list) to each page to make parsing CPU-bound, and a
+    `failure_rate` share of requests answer 500.
+    """
+    latency = _as_latency(latency)
+    rng = rng or random.Random()
+    fixtures = [path.read_text(encoding="utf-8") for path in sorted(FIXTURES.glob("*.html"))]
+    review = '<li class="review"><span class="stars">4/5</span><p>Solid build, good value, would buy again.</p></li>'
+    padding = "<ul>" + review * (padding_kb * 1024 // len(review)) + "</ul>" if padding_kb else ""
+
+    def page_handler(html: str) -> Handler:
+        body = html.replace("</body>", padding + "</body>")
+
+        async def page(request: Dict[str, Any]) -> Tuple[int, Any]:
+            await asyncio.sleep(latency.sample(rng))
+            if failure_rate and rng.random() < failure_rate:
+                return 500, "<html><body>injected failure</body></html>"
+            return 200, body
+
+        return page
+
+    return {("GET", f"/products/{i}"): page_handler(fixtures[i % len(fixtures)]) for i in range(pages)}
+
+
+def fake_youtube_routes(
+    latency: Union[float, Latency] = 0.1,
+    failure_rate: float = 0.0,
+    no_result_rate: float = 0.0,
+    rng: Optional[random.Random] = None,
+    capacity: int = 0,
+) -> Dict[Tuple[str, str], Handler]:
+    """
+    Routes emulating the YouTube Data API /youtube/v3/search endpoint.
+
+    Each search answers with one video whose ID is derived from the query, so a
+    product always gets the same link. A `no_result_rate` share of searches find
+    nothing and a `failure_rate` share answer 500. With a `capacity`, at most that
+    many requests are served at a time and the rest queue.
+    """
+    latency = _as_latency(latency)
+    rng = rng or random.Random()
+    slots = asyncio.Semaphore(capacity) if capacity else None
+
+    async def search(request: Dict[str, Any]) -> Tuple[int, Any]:
+        if slots is not None:
+            async with slots:
+                return await respond(request)
+        return await respond(request)
+
+    async def respond(request: Dict[str, Any]) -> Tuple[int, Any]:
+        query = parse_qs(request["query"]).get("q", [""])[0]
+        await asyncio.sleep(latency.sample(rng))
+        if failure_rate and rng.random() < failure_rate:
+            return 500, {"error": {"code": 500, "message": "injected failure"}}
+        if no_result_rate and rng.random() < no_result_rate:
+            return 200, {"kind": "youtube#searchListResponse", "items": []}
+        video_id = hashlib.sha1(query.encode("utf-8")).hexdigest()[:11]
+        return 200, {
+            "kind": "youtube#searchListResponse",
+            "items": [{"id": {"kind": "youtube#video", "videoId": video_id}, "snippet": {"title": query}}],
+        }
+
+    return {("GET", "/youtube/v3/search"): search}
+
+
+def fixture_expectations() -> Dict[str, Dict[str, Any]]:
+    """The name, price and currency each fixture page should yield, keyed by file name."""
+    with open(FIXTURES / "expected.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeSMTPServer:
+    """
+    A minimal SMTP server that accepts AUTH PLAIN and stores delivered messages.
+
+    `connect_latency` delays the greeting to mimic the TCP/TLS handshake and login
+    cost of a real provider; `send_latency` delays the reply to each DATA command.
+    Both accept seconds or a Latency. `fail_every` makes every Nth delivery fail
+    with a transient 451 error, and `failure_rate` fails that share at random.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        connect_latency: Union[float, Latency] = 0.0,
+        send_latency: Union[float, Latency] = 0.0,
+        fail_every: int = 0,
+        failure_rate: float = 0.0,
+        rng: Optional[random.Random] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.connect_latency = _as_latency(connect_latency)
+        self.send_latency = _as_latency(send_latency)
+        self.fail_every = fail_every
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        self._deliveries = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def __aenter__(self) -> "FakeSMTPServer":
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+
+        async def reply(line: str) -> None:
+            writer.write((line + "\r\n").encode())
+            await writer.drain()
+
+        try:
+            await asyncio.sleep(self.connect_latency.sample(self.rng))
+            await reply("220 fake-smtp ready")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("latin-1").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb in ("EHLO", "HELO"):
+                    await reply("250-fake-smtp\r\n250-AUTH PLAIN\r\n250 SIZE 10485760")
+                elif verb == "AUTH":
+                    self.logins += 1
+                    await reply("235 2.7.0 Authentication successful")
+                elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = []
+                    while True:
+                        data_line = await reader.readline()
+                        if data_line in (b".\r\n", b".\n", b""):
+                            break
+                        data.append(data_line)
+                    await asyncio.sleep(self.send_latency.sample(self.rng))
+                    self._deliveries += 1
+                    if (self.fail_every and self._deliveries % self.fail_every == 0) or (
+                        self.failure_rate and self.rng.random() < self.failure_rate
+                    ):
+                        await reply("451 4.3.0 Temporary failure, try again")
+                    else:
+                        self.messages.append(b"".join(data))
+                        await reply("250 OK queued")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class FakeLLM:
+    """
+    An LLM stand-in with the interface of GeminiLLM and a tunable response time.
+
+    Structured calls get a schema-valid placeholder reply, so the whole email path
+    runs; other prompts get a short bulleted summary. Streaming
+    spreads the sampled latency over the chunks. A `failure_rate` share of calls
+    raise LLMError after the delay.
+    """
+
+    def __init__(
+        self,
+        latency: Union[float, Latency] = 0.0,
+        failure_rate: float = 0.0,
+        summary_words: int = 60,
+        rng: Optional[random.Random] = None,
+    ):
+        self.latency = _as_latency(latency)
+        self.failure_rate = failure_rate
+        self.summary_words = summary_words
+        self.rng = rng or random.Random()
+        self.calls = 0
+
+    async def check_auth(self) -> bool:
+        return True
+
+    def _respond(self, messages: List[Dict]) -> str:
+        words = " ".join(f"word{i}" for i in range(self.summary_words))
+        return f"* **Product A**: {words}\n* **Product B**: {words}"
+
+    def _maybe_fail(self) -> None:
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            raise LLMError("Injected LLM failure")
+
+    async def agenerate(self, messages: List[Dict], temperature: Optional[float] = None) -> str:
+        self.calls += 1
+        with EXTERNAL_SECONDS.time(service="llm"):
+            await asyncio.sleep(self.latency.sample(self.rng))
+            self._maybe_fail()
+        return self._respond(messages)
+
+    async def agenerate_structured(self, messages: List[Dict], schema, temperature: Optional[float] = None):
+        self.calls += 1
+        with EXTERNAL_SECONDS.time(service="llm"):
+            await asyncio.sleep(self.latency.sample(self.rng))
+            self._maybe_fail()
+        return mock_structured(schema, filler=" ".join(f"word{i}" for i in range(self.summary_words // 4)))
+
+    async def astream(self, messages: List[Dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        self.calls += 1
+        start = time.perf_counter()
+        total = self.latency.sample(self.rng)
+        words = self._respond(messages).split(" ")
+        # Roughly a third of the time goes to the first token, as with hosted models.
+        await asyncio.sleep(total / 3)
+        try:
+            self._maybe_fail()
+        except LLMError:
+            EXTERNAL_SECONDS.observe(time.perf_counter() - start, service="llm", outcome="error")
+            raise
+        step = (total - total / 3) / len(words)
+        for i, word in enumerate(words):
+            if step:
+                await asyncio.sleep(step)
+            yield word if i == len(words) - 1 else word + " "
+        EXTERNAL_SECONDS.observe(time.perf_counter() - start, service="llm", outcome="ok")
+
+
+class FakeYouTubeTool(YouTubeTool):
+    """YouTubeTool with a simulated API round trip per lookup and injectable failures (use fake_youtube_routes for HTTP)."""
+
+    def __init__(
+        self,
+        latency: Union[float, Latency] = 0.0,
+        failure_rate: float = 0.0,
+        rng: Optional[random.Random] = None,
+        **settings: Any,
+    ):
+        super().__init__(api_key="fake", **settings)
+        self.latency = _as_latency(latency)
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self.calls = 0
+
+    async def _request(self, query: str, timeout: float) -> str:
+        self.calls += 1
+        with EXTERNAL_SECONDS.time(service="youtube"):
+            await asyncio.sleep(self.latency.sample(self.rng))
+            if self.failure_rate and self.rng.random() < self.failure_rate:
+                raise YouTubeReviewError("Injected YouTube failure")
+        return self._mock_link(query)
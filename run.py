@@ -1,6 +1,64 @@
 # run.py
+import argparse
 import asyncio
-from shopy.main import main
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shopy: your AI shopping assistant.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="Run many queries and stream results as JSON lines.")
+    batch.add_argument("input", nargs="?", default="-", help="JSONL/CSV file of queries, or '-' for stdin (default).")
+    batch.add_argument("-o", "--output", default="-", help="Where to write JSONL results, or '-' for stdout (default).")
+    batch.add_argument("-c", "--concurrency", type=int, default=8, help="Maximum number of runs in flight.")
+    batch.add_argument("--format", choices=["jsonl", "csv"], help="Input format (detected from the extension by default).")
+    batch.add_argument("--metrics", help="Write collected metrics to this file (JSON, or Prometheus text for a .prom path).")
+
+    resume = subparsers.add_parser("resume", help="Continue a failed checkpointed run from its last completed step.")
+    resume.add_argument("run_id", help="The run ID (trace ID) reported when the run failed.")
+
+    worker = subparsers.add_parser("worker", help="Run queued jobs in a pool of worker processes.")
+    worker.add_argument("-p", "--processes", type=int, default=0, help="Worker processes (default WORKER_PROCESSES, or one per core).")
+    worker.add_argument("-c", "--concurrency", type=int, default=0, help="Runs in flight per worker (default WORKER_CONCURRENCY).")
+
+    submit = subparsers.add_parser("submit", help="Queue queries for the worker pool and print their job IDs.")
+    submit.add_argument("queries", nargs="+", help="Queries to run, one job each.")
+    submit.add_argument("--email", default="", help="Where to send each result.")
+    submit.add_argument("--wait", action="store_true", help="Wait for the jobs to finish and print their results.")
+
+    status = subparsers.add_parser("status", help="Print the status of a queued job, or job counts if none is given.")
+    status.add_argument("job_id", nargs="?")
+
+    result = subparsers.add_parser("result", help="Print the result of a finished job.")
+    result.add_argument("job_id")
+
+    server = subparsers.add_parser("serve", help="Serve ShopyAgent.run as a JSON HTTP API.")
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=8000)
+    server.add_argument("--max-concurrency", type=int, default=16, help="Maximum number of runs executing at once.")
+    server.add_argument("--max-queue", type=int, default=64, help="Runs allowed to wait for a slot before answering 503.")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    args = parse_args()
+    # Each command imports only what it needs, so `run.py --help` and the other
+    # subcommands don't pay for modules they never use.
+    if args.command == "batch":
+        from shopy.batch import batch_main
+        asyncio.run(batch_main(args.input, args.output, args.format, args.concurrency, args.metrics))
+    elif args.command == "resume":
+        from shopy.main import resume_main
+        asyncio.run(resume_main(args.run_id))
+    elif args.command == "worker":
+        from shopy.jobs import worker_main
+        asyncio.run(worker_main(args.processes, args.concurrency))
+    elif args.command in ("submit", "status", "result"):
+        from shopy.jobs import jobs_main
+        asyncio.run(jobs_main(args))
+    elif args.command == "serve":
+        from shopy.server import serve
+        asyncio.run(serve(args.host, args.port, args.max_concurrency, args.max_queue))
+    else:
+        from shopy.main import main
+        asyncio.run(main())
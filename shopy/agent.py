@@ -1,23 +1,30 @@
 # shopy/agent.py
-from typing import List, Dict, Optional, Any
-from langgraph.graph import StateGraph, START, END
+from typing import TYPE_CHECKING, List, Dict, Optional, Any, AsyncIterable, AsyncIterator, Iterable, Set, Tuple, Union
 import asyncio
+import copy
+import functools
+import itertools
 import logging
-import os
+import time
+import uuid
 
 # Absolute imports
-from shopy.llm import GeminiLLM, MockLLM
-from shopy.models import State
-from shopy.prompts import email_template_prompt
-from shopy.config import Config
-from shopy.tools import (
-    TavilyTool,
-    DataStructuringTool,
-    YouTubeTool,
-    ProductComparisonTool,
-    EmailTool,
-     DisplayTool,
+from shopy.cache import make_cache_key
+from shopy.log import Abbrev, trace_id_var
+from shopy.metrics import NODE_CACHE, NODE_ERRORS, NODE_SECONDS, RUN_SECONDS
+from shopy.ratelimit import BATCH, INTERACTIVE, priority_var
+from shopy.resilience import deadline_var, degraded_var, mark_degraded
+from shopy.models import (
+    AnalysisResult,
+    CombinedAnalysisResult,
+    RunState,
+    State,
+    SummaryAndEmail,
+    any_true,
+    expand_product_refs,
+    merge_dicts,
 )
+from shopy.prompts import email_template_prompt, summary_and_email_prompt, summary_prompt
 from shopy.exceptions import (
     TavilySearchError,
     DataStructuringError,
@@ -25,207 +32,481 @@ from shopy.exceptions import (
     YouTubeReviewError,
     LLMError,
     EmailError,
+    RunFailedError,
 )
-from rich.console import Console
-from rich.theme import Theme
-from rich.markdown import Markdown
-from rich.panel import Panel
-from rich.table import Table
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# LangGraph, LangChain and rich are imported where they are first needed so that
+# importing this module stays cheap. Annotations naming their types are strings.
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.checkpoint.base import BaseCheckpointSaver
+    from langgraph.graph import StateGraph
+    from langgraph.types import StreamWriter
+    from shopy.runtime import Toolset
+
+logger = logging.getLogger(__name__)
 
 
 # Define a custom theme
-custom_theme = Theme({
+custom_theme = {
     "info": "dim cyan",
     "warning": "bold yellow",
     "error": "bold red",
     "success": "bold green",
     "header": "bold magenta",
     "best_product": "bold green",
-})
-
-
-# Initialize configuration
-config = Config()
-
-# Initialize LLM
-if config.google_api_key:
-    os.environ['GOOGLE_API_KEY'] = config.google_api_key
-    llm = GeminiLLM()
-elif config.gmail_user and config.gmail_pass and config.youtube_api_key and config.tavily_api_key:
-    llm = MockLLM()
-else:
-    llm = MockLLM()
-    logging.warning("No valid API keys provided, using MockLLM.")
-
-# Initialize Tools
-tavily_tool = TavilyTool(api_key=config.tavily_api_key)
-data_structuring_tool = DataStructuringTool()
-youtube_tool = YouTubeTool()
-product_comparison_tool = ProductComparisonTool()
-email_tool = EmailTool(gmail_user=config.gmail_user, gmail_pass=config.gmail_pass)
-display_tool = DisplayTool()
+}
+
 
 # Node functions
-async def tavily_search_node(state: State) -> State:
+#
+# Nodes return only the fields they produce. Branches of the graph run concurrently,
+# so returning the whole State would make parallel nodes overwrite each other.
+# The LLM and tools come from the Toolset passed in the run config by ShopyAgent.run.
+def _tools(config: "RunnableConfig") -> "Toolset":
+    """Returns the Toolset the current run was started with."""
+    return config["configurable"]["tools"]
+
+
+def _final_state(values: Dict[str, Any]) -> State:
+    """
+    Validates a run's final channel values as State, the one place a run's result is
+    checked, with the comparison's product references expanded, and fills in
+    `display_data` from the fields it shows.
+    """
+    state = State(**expand_product_refs(values))
+    state.display_data = state.display_view()
+    return state
+
+
+def _public_products(update: Dict[str, Any], values: Dict[str, Any]) -> Dict[str, Any]:
+    """The `comparison` and `best_product` in a node's update, expanded against the run's `values`."""
+    expanded = expand_product_refs(values)
+    return {key: expanded[key] for key in ("comparison", "best_product") if key in update}
+
+
+def _flag_degraded(output: Dict[str, Any]) -> Dict[str, Any]:
+    """Marks the run as degraded in a node's output if the node or a tool it called fell back after a failure."""
+    return {**(output or {}), "degraded": True} if degraded_var.get() else output
+
+
+def _node_failed(config: "RunnableConfig", node: str, error: Exception) -> None:
+    """
+    Counts an error caught in a node. In checkpointed runs the error is re-raised, so
+    the run stops with the node unfinished and resuming it runs the node again instead
+    of keeping the empty result the node would otherwise return.
+    """
+    NODE_ERRORS.inc(node=node)
+    mark_degraded()
+    if config["configurable"].get("checkpoint"):
+        raise error
+
+
+# Part of every node cache key; bump it when a memoized node's output changes for the same inputs.
+NODE_CACHE_VERSION = 4
+
+
+def _node_cache_key(name: str, state: State, reads: Tuple[str, ...]) -> str:
+    return make_cache_key("node", NODE_CACHE_VERSION, name, {field: getattr(state, field) for field in reads})
+
+
+# The tasks of the nodes each run is executing, by trace ID. When a failing node ends a
+# run, LangGraph cancels the analysis subgraph but not the nodes running inside it, so
+# those are cancelled here instead of finishing (and e.g. sending email) after the run
+# has already been reported as failed.
+_running_nodes: Dict[str, Set[asyncio.Task]] = {}
+
+
+async def _cancel_nodes(run_id: str) -> None:
+    """Cancels and waits for any node of run `run_id` that is still executing."""
+    tasks = _running_nodes.pop(run_id, set()) - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def timed_node(name: str, reads: Optional[Tuple[str, ...]] = None):
+    """
+    Records a node's wall time, tags the log records it emits with the run's trace ID
+    and gives the external calls it makes the run's deadline and priority.
+
+    A node declaring the State fields it `reads` (and that uses no others) is
+    memoized when the run's toolset has a `node_cache`: its output is cached under a
+    hash of those fields and returned without running the node to any run whose
+    fields are equal. Runs that differ only in, say, the email reuse every analysis
+    step, and when an upstream node's output changes, only the nodes downstream of
+    it recompute. When the node or a tool it called handled an error (see
+    `shopy.resilience.mark_degraded`), its output is not cached and sets the run's
+    `degraded` flag. A cached node emits no custom stream events.
+    """
+    def decorator(fn):
+        # functools.wraps keeps the signature LangGraph inspects to inject `config` and `writer`.
+        @functools.wraps(fn)
+        async def wrapper(state: State, **kwargs: Any) -> Dict[str, Any]:
+            configurable = (kwargs.get("config") or {}).get("configurable", {})
+            token = trace_id_var.set(configurable.get("trace_id", ""))
+            deadline_token = deadline_var.set(configurable.get("deadline"))
+            priority_token = priority_var.set(configurable.get("priority", INTERACTIVE))
+            run_id = configurable.get("trace_id", "")
+            task = asyncio.current_task()
+            _running_nodes.setdefault(run_id, set()).add(task)
+            start = time.perf_counter()
+            degraded_token = degraded_var.set(False)
+            try:
+                cache = getattr(configurable.get("tools"), "node_cache", None) if reads is not None else None
+                if cache is None:
+                    return _flag_degraded(await fn(state, **kwargs))
+                key = _node_cache_key(name, state, reads)
+                cached = cache.get(key)
+                if cached is not None:
+                    NODE_CACHE.inc(node=name, result="hit")
+                    logger.debug("Reusing the cached output of %s", name, extra={"node": name})
+                    # Copied, so nothing a run does to its State can change the cached output.
+                    return copy.deepcopy(cached)
+                NODE_CACHE.inc(node=name, result="miss")
+                output = await fn(state, **kwargs)
+                if degraded_var.get():
+                    return _flag_degraded(output)
+                cache.set(key, copy.deepcopy(output))
+                return output
+            finally:
+                degraded_var.reset(degraded_token)
+                NODE_SECONDS.observe(time.perf_counter() - start, node=name)
+                running = _running_nodes.get(run_id)
+                if running is not None:
+                    running.discard(task)
+                    if not running:
+                        del _running_nodes[run_id]
+                priority_var.reset(priority_token)
+                deadline_var.reset(deadline_token)
+                trace_id_var.reset(token)
+        return wrapper
+    return decorator
+
+
+@timed_node("tavily_search")
+async def tavily_search_node(state: State, config: "RunnableConfig") -> Dict[str, Any]:
     """Perform a search using the Tavily API."""
     try:
-        state.products = await tavily_tool.search(state.query)
-        logging.debug(f"Tavily search products: {state.products}, query: {state.query}")
-        return state
+        products = await _tools(config).tavily.search(state.query)
+        logger.debug("Tavily search products: %s, query: %s", Abbrev(products), state.query, extra={"node": "tavily_search"})
     except TavilySearchError as e:
-        logging.error(f"Tavily search error: {e}, query: {state.query}")
-        state.products = []
-        return state
+        logger.error("Tavily search error: %s, query: %s", e, state.query, extra={"node": "tavily_search"})
+        _node_failed(config, "tavily_search", e)
+        products = []
+    except Exception as e:
+        logger.error("Unexpected error in tavily_search_node: %s, query: %s", e, state.query, extra={"node": "tavily_search"})
+        _node_failed(config, "tavily_search", e)
+        products = []
+    return {"products": products}
+
+
+@timed_node("dedupe")
+async def dedupe_node(state: State, config: "RunnableConfig") -> Dict[str, Any]:
+    """Keep one search result per product, so duplicates are not fetched, compared or summarized."""
+    try:
+        products = _tools(config).dedupe.dedupe(state.products)
+        logger.debug("Deduplicated products: %s", Abbrev(products), extra={"node": "dedupe"})
     except Exception as e:
-        logging.error(f"Unexpected error in tavily_search_node: {e}, query: {state.query}")
-        state.products = []
-        return state
+        logger.error("Unexpected error in dedupe_node: %s, products: %s", e, Abbrev(state.products), extra={"node": "dedupe"})
+        _node_failed(config, "dedupe", e)
+        products = state.products
+    return {"products": products}
 
 
-async def schema_mapping_node(state: State) -> State:
-    """Map the search results to a schema."""
+@timed_node("schema_mapping", reads=("products",))
+async def schema_mapping_node(state: State, config: "RunnableConfig", writer: "StreamWriter") -> Dict[str, Any]:
+    """Map the search results to a schema, streaming each product as soon as its page is parsed."""
     try:
-        state.product_schema = await data_structuring_tool.map_schema(state.products)
-        logging.debug(f"product_schema: {state.product_schema}, products:{state.products}")
-        return state
+        product_schema: List[Optional[Dict[str, Any]]] = [None] * len(state.products)
+        async for index, record in _tools(config).data_structuring.iter_schema(state.products):
+            product_schema[index] = record
+            writer({"node": "schema_mapping", "product": record})
+        logger.debug("product_schema: %s, products: %s", Abbrev(product_schema), Abbrev(state.products), extra={"node": "schema_mapping"})
     except DataStructuringError as e:
-        logging.error(f"Data structuring error: {e}, products:{state.products}")
-        state.product_schema = []
-        return state
+        logger.error("Data structuring error: %s, products: %s", e, Abbrev(state.products), extra={"node": "schema_mapping"})
+        _node_failed(config, "schema_mapping", e)
+        product_schema = []
     except Exception as e:
-        logging.error(f"Unexpected error in schema_mapping_node: {e}, products:{state.products}")
-        state.product_schema = []
-        return state
+        logger.error("Unexpected error in schema_mapping_node: %s, products: %s", e, Abbrev(state.products), extra={"node": "schema_mapping"})
+        _node_failed(config, "schema_mapping", e)
+        product_schema = []
+    return {"product_schema": product_schema}
 
 
-async def product_comparison_node(state: State) -> State:
+@timed_node("product_comparison", reads=("query", "products", "product_schema"))
+async def product_comparison_node(state: State, config: "RunnableConfig") -> Dict[str, Any]:
     """Compare products based on their specs and reviews."""
     try:
-        logging.debug(f"product_comparison_node - Input: product_schema: {state.product_schema}, products: {state.products}")
-        comparison_data = await product_comparison_tool.compare_products(state)
-        state.comparison = comparison_data.get("comparison", [])
-        state.best_product = comparison_data.get("best_product", {})
-        logging.debug(f"product_comparison_node - Output: comparison: {state.comparison}, best_product: {state.best_product}")
-        return state
+        logger.debug("product_comparison_node - Input: product_schema: %s", Abbrev(state.product_schema), extra={"node": "product_comparison"})
+        comparison_data = await _tools(config).product_comparison.compare_products(state)
+        comparison = comparison_data.get("comparison", [])
+        best_product = comparison_data.get("best_product", {})
+        logger.debug("product_comparison_node - Output: comparison: %s, best_product: %s", Abbrev(comparison), Abbrev(best_product), extra={"node": "product_comparison"})
     except ProductComparisonError as e:
-        logging.error(f"Product comparison error: {e}, products: {state.products}, product_schema:{state.product_schema}")
-        state.comparison = []
-        state.best_product = {}
-        return state
+        logger.error("Product comparison error: %s, product_schema: %s", e, Abbrev(state.product_schema), extra={"node": "product_comparison"})
+        _node_failed(config, "product_comparison", e)
+        comparison = []
+        best_product = {}
     except Exception as e:
-        logging.error(f"Unexpected error in product_comparison_node: {e}, products: {state.products}, product_schema:{state.product_schema}")
-        state.comparison = []
-        state.best_product = {}
-        return state
+        logger.error("Unexpected error in product_comparison_node: %s, product_schema: %s", e, Abbrev(state.product_schema), extra={"node": "product_comparison"})
+        _node_failed(config, "product_comparison", e)
+        comparison = []
+        best_product = {}
+    return {"comparison": comparison, "best_product": best_product}
 
 
-async def youtube_review_node(state: State) -> State:
-    """Fetch a YouTube review link for the best product."""
+@timed_node("youtube_review", reads=("products", "product_schema", "best_product", "comparison"))
+async def youtube_review_node(state: State, config: "RunnableConfig") -> Dict[str, Any]:
+    """Fetch YouTube review links for every compared product in one batch."""
+    review_links: Dict[str, str] = {}
     try:
-       logging.debug(f"youtube_review_node - Input: best_product: {state.best_product}")
-       state.youtube_link = await youtube_tool.fetch_review_link(state.best_product)
-       logging.debug(f"youtube_review_node - Output: youtube_link: {state.youtube_link}")
-       return state
+        logger.debug("youtube_review_node - Input: best_product: %s, comparison: %s", Abbrev(state.best_product), Abbrev(state.comparison), extra={"node": "youtube_review"})
+        # The best product normally heads the comparison; repeated names are looked up once.
+        best_product = state.best_product_view()
+        review_links = await _tools(config).youtube.fetch_review_links([*state.comparison_view(), best_product])
+        youtube_link = review_links.get((best_product or {}).get("product_name"), "")
+        logger.debug("youtube_review_node - Output: youtube_link: %s, review_links: %s", youtube_link, Abbrev(review_links), extra={"node": "youtube_review"})
     except YouTubeReviewError as e:
-        logging.error(f"YouTube review error: {e}, best_product: {state.best_product}")
-        state.youtube_link = ""
-        return state
+        logger.error("YouTube review error: %s, best_product: %s", e, Abbrev(state.best_product), extra={"node": "youtube_review"})
+        _node_failed(config, "youtube_review", e)
+        youtube_link = ""
     except Exception as e:
-        logging.error(f"Unexpected error in youtube_review_node: {e}, best_product: {state.best_product}")
-        state.youtube_link = ""
-        return state
+        logger.error("Unexpected error in youtube_review_node: %s, best_product: %s", e, Abbrev(state.best_product), extra={"node": "youtube_review"})
+        _node_failed(config, "youtube_review", e)
+        youtube_link = ""
+    return {"youtube_link": youtube_link, "review_links": review_links}
 
 
-async def generate_summary_node(state: State) -> State:
-    """Generate a summary of the products using the LLM."""
+@timed_node("generate_summary")
+async def generate_summary_node(state: State, config: "RunnableConfig", writer: "StreamWriter") -> Dict[str, Any]:
+    """Generate a summary of the products using the LLM, streaming tokens when the run asks for them."""
     if not state.products:
-        logging.warning("No products to summarize.")
-        return state
-    
+        logger.warning("No products to summarize.", extra={"node": "generate_summary"})
+        return {}
+
     try:
         product_names = [product.get("name") for product in state.products if product.get("name")]
         if not product_names:
-            logging.warning(f"No valid product names to summarize.: {state.products}")
-            return state
-
-        prompt = f"""
-          You are a product expert.
-          Your goal is to analyze a list of products and generate a concise summary that contains a single paragraph with the key features and unique benefits for each product.
-          The products to analyze are: {', '.join(product_names)}.
-          Provide the output in the following format:
-          ```
-          * **Product Name 1**: Explanation
-          * **Product Name 2**: Explanation
-          ```
-          """
+            logger.warning("No valid product names to summarize: %s", Abbrev(state.products), extra={"node": "generate_summary"})
+            return {}
+
+        prompt = summary_prompt.render(product_names=product_names)
         messages = [{"role": "user", "content": prompt}]
-        logging.debug(f"generate_summary_node - LLM Input: products: {state.products}, prompt: {prompt}")
-        summary = await llm.agenerate(messages=messages)
-        state.summary = summary
-        logging.info(f"Summary generated: {summary}")
-        return state
+        logger.debug("generate_summary_node - LLM Input: prompt: %s", Abbrev(prompt), extra={"node": "generate_summary"})
+        llm = _tools(config).llm
+        if config["configurable"].get("stream_tokens"):
+            chunks = []
+            async for chunk in llm.astream(messages=messages):
+                chunks.append(chunk)
+                writer({"node": "generate_summary", "token": chunk})
+            summary = "".join(chunks)
+        else:
+            summary = await llm.agenerate(messages=messages)
+        logger.info("Summary generated (%d chars)", len(summary), extra={"node": "generate_summary"})
+        logger.debug("Summary: %s", Abbrev(summary), extra={"node": "generate_summary"})
     except LLMError as e:
-        logging.error(f"LLM error: {e}, products: {state.products}")
-        state.summary = ""
-        return state
+        logger.error("LLM error: %s, products: %s", e, Abbrev(state.products), extra={"node": "generate_summary"})
+        _node_failed(config, "generate_summary", e)
+        summary = ""
     except Exception as e:
-        logging.error(f"Unexpected error in generate_summary_node: {e}, products: {state.products}")
-        state.summary = ""
-        return state
+        logger.error("Unexpected error in generate_summary_node: %s, products: %s", e, Abbrev(state.products), extra={"node": "generate_summary"})
+        _node_failed(config, "generate_summary", e)
+        summary = ""
+    return {"summary": summary}
 
 
-async def display_node(state: State) -> State:
+@timed_node("display")
+async def display_node(state: State, config: "RunnableConfig") -> Dict[str, Any]:
     """Display the results to the user."""
-    await display_tool.display_data(state.display_data)
-    return state
+    if config["configurable"].get("display", True):
+        await _tools(config).display.display_data(state.display_view())
+    return {}
 
-async def send_email_node(state: State) -> State:
+@timed_node("send_email")
+async def send_email_node(state: State, config: "RunnableConfig") -> Dict[str, Any]:
     """Send an email recommendation to the user."""
     try:
-        logging.debug(f"send_email_node - email inputs: email: {state.email}, product: {state.best_product}")
-        await email_tool.send_email(state=state, email_template_prompt=email_template_prompt, llm=llm)
-        return state
+        logger.debug("send_email_node - email inputs: email: %s, product: %s", state.email, Abbrev(state.best_product), extra={"node": "send_email"})
+        tools = _tools(config)
+        # A checkpointed run only counts the email as sent once it is delivered, not when it is queued.
+        await tools.email.send_email(
+            state=state, email_template_prompt=email_template_prompt, llm=tools.llm,
+            wait=bool(config["configurable"].get("checkpoint")),
+        )
     except EmailError as e:
-        logging.error(f"Email error: {e}, email: {state.email}, product: {state.best_product}")
-        return state
+        logger.error("Email error: %s, email: %s, product: %s", e, state.email, Abbrev(state.best_product), extra={"node": "send_email"})
+        _node_failed(config, "send_email", e)
     except Exception as e:
-        logging.error(f"Unexpected error in send_email_node: {e}, email: {state.email}, product: {state.best_product}")
-        return state
+        logger.error("Unexpected error in send_email_node: %s, email: %s, product: %s", e, state.email, Abbrev(state.best_product), extra={"node": "send_email"})
+        _node_failed(config, "send_email", e)
+    return {}
+
+@timed_node("summarize_and_email")
+async def summarize_and_email_node(state: State, config: "RunnableConfig") -> Dict[str, Any]:
+    """
+    Generate the summary and the email text in a single structured LLM call.
+
+    Used instead of generate_summary and send_email when the agent combines LLM
+    calls. Without a recipient or a best product only the summary is generated.
+    """
+    tools = _tools(config)
+    product_names = [product.get("name") for product in state.products if product.get("name")]
+    if not product_names:
+        logger.warning("No valid product names to summarize: %s", Abbrev(state.products), extra={"node": "summarize_and_email"})
+        return {}
+
+    best_product = state.best_product_view()
+    wants_email = bool(state.email and best_product and tools.email.configured)
+    if wants_email and state.degraded:
+        logger.warning("Run is degraded, email will not be sent. query: %s", state.query, extra={"node": "summarize_and_email"})
+        wants_email = False
+    try:
+        if wants_email:
+            prompt = summary_and_email_prompt.render(
+                product_names=product_names,
+                product_name=best_product.get("product_name", ""),
+                justification_line=best_product.get("justification", ""),
+                user_query=state.query,
+            )
+            result = await tools.llm.agenerate_structured([{"role": "user", "content": prompt}], SummaryAndEmail)
+            summary = result.summary_markdown()
+            if degraded_var.get():
+                # The reply came from the fallback LLM: keep it as the summary, but don't mail it.
+                logger.warning("Email text came from the fallback LLM, email will not be sent. query: %s", state.query, extra={"node": "summarize_and_email"})
+            elif config["configurable"].get("checkpoint"):
+                await tools.email.deliver_content(state.email, result.email, run_id=state.trace_id)
+            else:
+                tools.email.send_content(state.email, result.email)
+        else:
+            summary = await tools.llm.agenerate([{"role": "user", "content": summary_prompt.render(product_names=product_names)}])
+        logger.info("Summary generated (%d chars)", len(summary), extra={"node": "summarize_and_email"})
+    except (LLMError, EmailError) as e:
+        logger.error("Error in summarize_and_email_node: %s, products: %s", e, Abbrev(state.products), extra={"node": "summarize_and_email"})
+        _node_failed(config, "summarize_and_email", e)
+        summary = ""
+    except Exception as e:
+        logger.error("Unexpected error in summarize_and_email_node: %s, products: %s", e, Abbrev(state.products), extra={"node": "summarize_and_email"})
+        _node_failed(config, "summarize_and_email", e)
+        summary = ""
+    return {"summary": summary}
+
 
 class ShopyAgent:
     """A class to orchestrate multiple tools using LangGraph."""
 
-    def __init__(self):
-        """Initialize ShopyAgent with necessary components."""
+    def __init__(
+        self,
+        tools: Optional["Toolset"] = None,
+        combine_llm_calls: bool = False,
+        run_budget: Optional[float] = None,
+        checkpointer: Optional["BaseCheckpointSaver"] = None,
+    ):
+        """
+        Initialize ShopyAgent with necessary components.
+
+        `tools` defaults to the toolset of the process-wide runtime. With
+        `combine_llm_calls`, the summary and the email text come from one structured
+        LLM call made after the comparison, instead of two calls; the summary is then
+        not streamed token by token. With a `run_budget` in seconds, guarded external
+        calls (see `shopy.resilience`) get no more time than is left of it, so a run
+        falls back rather than overrunning it.
+
+        With a `checkpointer` (e.g. `shopy.checkpoint.SQLiteCheckpointer`), the State
+        is saved after every step of a run under its run ID. A node that fails then
+        stops the run with RunFailedError instead of leaving its part of the result
+        empty, and `resume(run_id)` continues from the last completed step, so the
+        search, page fetches and LLM calls that already succeeded are not repeated.
+        Checkpointed runs also wait for their email to be delivered.
+        """
+        if tools is None:
+            from shopy.runtime import get_runtime
+            tools = get_runtime().tools
+        self.tools = tools
+        self.combine_llm_calls = combine_llm_calls
+        self.run_budget = run_budget
+        self.checkpointer = checkpointer
         self.workflow = self.create_graph()
-        self.console = Console(theme=custom_theme) # Added console as an instance variable
+        self._console = None
+
+    @property
+    def console(self):
+        """A rich console using the Shopy theme, created on first use."""
+        if self._console is None:
+            from rich.console import Console
+            from rich.theme import Theme
+            self._console = Console(theme=Theme(custom_theme))
+        return self._console
+
+    def create_graph(self) -> "StateGraph":
+        """
+        Create a LangGraph state graph workflow.
+
+        Nodes fan out wherever their inputs allow:
+
+            tavily_search -> dedupe -+-> analysis ---------------+-> display
+                                     +-> generate_summary -------+
+
+        where `dedupe` keeps one search result per product and `analysis` is a
+        subgraph running schema_mapping -> product_comparison -> (youtube_review | send_email).
+        LangGraph executes a graph in supersteps, so the dependent chain lives in its
+        own subgraph; that way the summary LLM call never holds back the comparison,
+        and end-to-end latency follows the slower of the two branches. `display`
+        waits for both. The graph carries RunState, which passes products between
+        nodes without revalidating or copying them.
 
-    def create_graph(self) -> StateGraph:
-        """Create a LangGraph state graph workflow."""
-        builder = StateGraph(State)
+        With `combine_llm_calls` the one LLM call needs the best product, so it runs
+        inside the analysis subgraph in place of send_email and there is no separate
+        generate_summary branch:
+
+            tavily_search -> dedupe -> analysis -> display
+
+        Only this graph is compiled with the checkpointer; the analysis subgraph
+        inherits it, so steps inside it are checkpointed as well.
+        """
+        from langgraph.graph import StateGraph, START, END
+
+        builder = StateGraph(RunState)
         builder.add_node("tavily_search", tavily_search_node)
+        builder.add_node("dedupe", dedupe_node)
+        builder.add_node("analysis", self.create_analysis_graph())
+        builder.add_node("display", display_node)
+        builder.add_edge(START, "tavily_search")
+        builder.add_edge("tavily_search", "dedupe")
+        builder.add_edge("dedupe", "analysis")
+        if self.combine_llm_calls:
+            builder.add_edge("analysis", "display")
+        else:
+            builder.add_node("generate_summary", generate_summary_node)
+            builder.add_edge("dedupe", "generate_summary")
+            builder.add_edge(["analysis", "generate_summary"], "display")
+        builder.add_edge("display", END)
+
+        return builder.compile(checkpointer=self.checkpointer)
+
+    def create_analysis_graph(self) -> "StateGraph":
+        """Create the subgraph that structures, compares and follows up on the search results."""
+        from langgraph.graph import StateGraph, START, END
+
+        # The output schema limits what the subgraph hands back, so it never writes a
+        # `summary` that would collide with the parallel generate_summary branch.
+        follow_up = "summarize_and_email" if self.combine_llm_calls else "send_email"
+        builder = StateGraph(RunState, output_schema=CombinedAnalysisResult if self.combine_llm_calls else AnalysisResult)
         builder.add_node("schema_mapping", schema_mapping_node)
         builder.add_node("product_comparison", product_comparison_node)
         builder.add_node("youtube_review", youtube_review_node)
-        builder.add_node("generate_summary", generate_summary_node)
-        builder.add_node("display", display_node)
-        builder.add_node("send_email", send_email_node)
-        builder.add_edge(START, "tavily_search")
-        builder.add_edge("tavily_search", "schema_mapping")
+        builder.add_node(follow_up, summarize_and_email_node if self.combine_llm_calls else send_email_node)
+        builder.add_edge(START, "schema_mapping")
         builder.add_edge("schema_mapping", "product_comparison")
         builder.add_edge("product_comparison", "youtube_review")
-        builder.add_edge("youtube_review", "generate_summary")
-        builder.add_edge("generate_summary", "display") # Reverted to the correct order
-        builder.add_edge("display", "send_email")  # Reverted to the correct order
-        builder.add_edge("send_email", END)
+        builder.add_edge("product_comparison", follow_up)
+        builder.add_edge("youtube_review", END)
+        builder.add_edge(follow_up, END)
 
         return builder.compile()
 
-    async def run(self, query: str, email: str) -> State:
-        """Execute the ShopyAgent workflow with the given query and email."""
-        state = State(
+    def _initial_state(self, query: str, email: str, run_id: Optional[str] = None) -> State:
+        return State(
             query=query,
             email=email,
             products=[],
@@ -236,6 +517,203 @@ class ShopyAgent:
             youtube_link="",
             display_data={},
             summary = "",
+            trace_id=run_id or uuid.uuid4().hex,
         )
-        final_state = await self.workflow.ainvoke(state)
-        return final_state
\ No newline at end of file
+
+    def _run_config(self, run_id: str, **options: Any) -> Dict[str, Any]:
+        """
+        The run config passed to every node: the toolset, the trace ID, the deadline and
+        `options` (e.g. priority). A run's trace ID doubles as its run ID, under which
+        its checkpoints are kept.
+        """
+        deadline = time.monotonic() + self.run_budget if self.run_budget else None
+        configurable = {"tools": self.tools, "trace_id": run_id, "deadline": deadline, **options}
+        if self.checkpointer is not None:
+            configurable.update(thread_id=run_id, checkpoint=True)
+        return {"configurable": configurable}
+
+    async def _invoke(self, state: Optional[State], config: Dict[str, Any], mode: str) -> State:
+        run_id = config["configurable"]["trace_id"]
+        try:
+            with RUN_SECONDS.time(mode=mode):
+                final_state = await self.workflow.ainvoke(state, config=config)
+        except Exception as e:
+            await _cancel_nodes(run_id)
+            if self.checkpointer is None:
+                raise
+            logger.error("Run %s stopped: %s; resume it to continue from the last completed step", run_id, e)
+            raise RunFailedError(f"Run {run_id} failed: {e}", run_id) from e
+        return _final_state(final_state)
+
+    async def run(
+        self, query: str, email: str, display: bool = True, priority: str = INTERACTIVE, run_id: Optional[str] = None
+    ) -> State:
+        """
+        Execute the ShopyAgent workflow with the given query and email.
+
+        `priority` ("interactive" or "batch") orders this run's external calls
+        against other runs' when they wait for a rate limiter. `run_id` defaults to
+        a new random ID; with a checkpointer, a failed run raises RunFailedError
+        carrying it.
+        """
+        state = self._initial_state(query, email, run_id)
+        return await self._invoke(state, self._run_config(state.trace_id, display=display, priority=priority), "run")
+
+    async def resume(self, run_id: str, display: bool = False, priority: str = INTERACTIVE) -> State:
+        """
+        Continue a checkpointed run from its last completed step and return its final State.
+
+        Nodes that finished before the run stopped are not run again; a run that
+        already completed returns its saved result. Raises KeyError if no checkpoint
+        of `run_id` exists, and RunFailedError if the run fails again.
+        """
+        if self.checkpointer is None:
+            raise RuntimeError("Runs can only be resumed by an agent with a checkpointer")
+        config = self._run_config(run_id, display=display, priority=priority)
+        snapshot = await self.workflow.aget_state(config)
+        if not snapshot.values:
+            raise KeyError(f"No checkpoint for run {run_id}")
+        if not snapshot.next:
+            return _final_state(snapshot.values)
+        logger.info("Resuming run %s at %s", run_id, ", ".join(snapshot.next))
+        return await self._invoke(None, config, "resume")
+
+    async def astream(self, query: str, email: str, display: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Execute the workflow, yielding events as soon as results exist.
+
+        Events are dicts with an `event` key:
+            {"event": "update", "node": <node name>, "data": <fields the node produced>}
+            {"event": "token", "node": "generate_summary", "text": <summary chunk>}
+            {"event": "product", "node": "schema_mapping", "data": <one structured product>}
+            {"event": "done", "state": <final State>}
+
+        Updates from nodes inside the analysis subgraph are reported under their own
+        node names, so the comparison and review link arrive before the summary ends.
+        Product events arrive in the order their pages finish; the final
+        `product_schema` keeps the order of the search results.
+        """
+        state = self._initial_state(query, email)
+        final_values = state.dict()
+        # Every field produced so far, subgraph updates included, to expand product references in update events.
+        seen = dict(final_values)
+        config = self._run_config(state.trace_id, display=display, stream_tokens=True)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            async for namespace, mode, chunk in self.workflow.astream(
+                state, config=config, stream_mode=["updates", "custom"], subgraphs=True
+            ):
+                if mode == "custom":
+                    if "product" in chunk:
+                        yield {"event": "product", "node": chunk.get("node"), "data": chunk["product"]}
+                    else:
+                        yield {"event": "token", "node": chunk.get("node"), "text": chunk.get("token", "")}
+                    continue
+                for node, update in chunk.items():
+                    seen.update(update or {})
+                    if not namespace:
+                        # Top-level updates (including the analysis subgraph's output) build the final state.
+                        for key, value in (update or {}).items():
+                            if key == "display_data":
+                                value = merge_dicts(final_values[key], value)
+                            elif key == "degraded":
+                                value = any_true(final_values[key], value)
+                            final_values[key] = value
+                        if node == "analysis":
+                            continue
+                    if update:
+                        if "comparison" in update or "best_product" in update:
+                            update = {**update, **_public_products(update, seen)}
+                        yield {"event": "update", "node": node, "data": update}
+            outcome = "ok"
+        except GeneratorExit:
+            # The consumer stopped listening before the run finished.
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            await _cancel_nodes(state.trace_id)
+            if self.checkpointer is None:
+                raise
+            raise RunFailedError(f"Run {state.trace_id} failed: {e}", state.trace_id) from e
+        finally:
+            RUN_SECONDS.observe(time.perf_counter() - start, mode="stream", outcome=outcome)
+        yield {"event": "done", "state": _final_state(final_values)}
+
+    async def run_many(
+        self,
+        requests: Union[Iterable[Union[Dict[str, str], str]], AsyncIterable[Union[Dict[str, str], str]]],
+        concurrency: int = 8,
+        priority: str = BATCH,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run many queries on the current event loop and yield each result as soon as it finishes.
+
+        `requests` yields dicts with a `query` and an optional `email`, or bare query
+        strings. At most
+        `concurrency` runs are in flight at once, and inputs are pulled lazily, so
+        arbitrarily large batches are streamed rather than materialized. A failing
+        run is reported as a result with `ok=False` and does not stop the batch; with
+        a checkpointer the result carries the `run_id` to resume it with.
+        Runs have batch `priority` by default, so interactive runs sharing the
+        process get rate-limited calls first.
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        async def iterate():
+            if isinstance(requests, AsyncIterable):
+                async for item in requests:
+                    yield item
+            else:
+                for item in requests:
+                    yield item
+
+        source = iterate()
+        source_lock = asyncio.Lock()
+        results: asyncio.Queue = asyncio.Queue()
+        counter = itertools.count()
+
+        async def worker():
+            while True:
+                async with source_lock:
+                    try:
+                        request = await source.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    index = next(counter)
+                if isinstance(request, str):
+                    request = {"query": request}
+                query = request.get("query", "")
+                email = request.get("email") or ""
+                start = time.perf_counter()
+                try:
+                    state = await self.run(query, email, display=False, priority=priority)
+                    result = {"index": index, "query": query, "email": email, "ok": True, "state": state.dict()}
+                except Exception as e:
+                    logger.error("Batch run %d failed: %s, query: %s", index, e, query)
+                    result = {"index": index, "query": query, "email": email, "ok": False, "error": str(e)}
+                    if isinstance(e, RunFailedError):
+                        result["run_id"] = e.run_id
+                result["latency"] = time.perf_counter() - start
+                await results.put(result)
+
+        async def supervise(workers):
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                await results.put(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        supervisor = asyncio.create_task(supervise(workers))
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield result
+            await supervisor
+        finally:
+            for task in workers:
+                task.cancel()
+            supervisor.cancel()
@@ -0,0 +1,144 @@
+# shopy/batch.py
+import asyncio
+import csv
+import json
+import logging
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, TextIO
+
+from shopy.log import Abbrev
+from shopy.utils import percentile
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_jsonl(stream: TextIO) -> Iterator[Dict[str, str]]:
+    """Yields requests from JSON lines holding either an object with a `query` or a bare string."""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            # Treat non-JSON lines as plain queries so a simple text file also works.
+            item = line
+        if isinstance(item, str):
+            item = {"query": item}
+        if not isinstance(item, dict) or not item.get("query"):
+            logger.warning("Skipping input line %d without a query: %s", line_number, Abbrev(line))
+            continue
+        yield item
+
+
+def _parse_csv(stream: TextIO) -> Iterator[Dict[str, str]]:
+    """Yields requests from a CSV file with a `query` column and an optional `email` column."""
+    for row_number, row in enumerate(csv.DictReader(stream), start=2):
+        if not row.get("query"):
+            logger.warning("Skipping CSV row %d without a query: %s", row_number, Abbrev(row))
+            continue
+        yield {"query": row["query"], "email": row.get("email") or ""}
+
+
+async def read_requests(stream: TextIO, fmt: str = "jsonl") -> AsyncIterator[Dict[str, str]]:
+    """Reads batch requests without blocking the event loop, one line at a time."""
+    parser = _parse_csv(stream) if fmt == "csv" else _parse_jsonl(stream)
+    while True:
+        item = await asyncio.to_thread(next, parser, None)
+        if item is None:
+            return
+        yield item
+
+
+async def run_batch(
+    agent,
+    stream: TextIO,
+    output: TextIO,
+    fmt: str = "jsonl",
+    concurrency: int = 8,
+) -> Dict[str, Any]:
+    """
+    Runs every request in `stream` through `agent.run_many`, writing one JSON line to
+    `output` as each run finishes, and returns throughput and latency statistics.
+    """
+    latencies = []
+    succeeded = failed = 0
+    start = time.perf_counter()
+    async for result in agent.run_many(read_requests(stream, fmt), concurrency=concurrency):
+        output.write(json.dumps(result, default=str) + "\n")
+        output.flush()
+        latencies.append(result["latency"])
+        if result["ok"]:
+            succeeded += 1
+        else:
+            failed += 1
+    wall = time.perf_counter() - start
+    return {
+        "total": succeeded + failed,
+        "succeeded": succeeded,
+        "failed": failed,
+        "concurrency": concurrency,
+        "wall_seconds": wall,
+        "throughput_per_second": (succeeded + failed) / wall if wall else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies, default=0.0),
+    }
+
+
+def detect_format(path: Optional[str], fmt: Optional[str]) -> str:
+    """Picks the input format from an explicit flag or the file extension."""
+    if fmt:
+        return fmt
+    if path and path.lower().endswith(".csv"):
+        return "csv"
+    return "jsonl"
+
+
+async def batch_main(
+    input_path: Optional[str],
+    output_path: Optional[str],
+    fmt: Optional[str],
+    concurrency: int,
+    metrics_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Entry point for `run.py batch`: runs the batch and prints a summary to stderr.
+
+    If `metrics_path` is set, the collected metrics are written there as JSON, or in
+    the Prometheus text format when the path ends in `.prom`.
+    """
+    from rich.console import Console
+    from shopy.runtime import get_runtime
+
+    fmt = detect_format(input_path, fmt)
+    stream = sys.stdin if input_path in (None, "-") else open(input_path, newline="", encoding="utf-8")
+    output = sys.stdout if output_path in (None, "-") else open(output_path, "w", encoding="utf-8")
+    try:
+        runtime = get_runtime()
+        stats = await run_batch(runtime.agent, stream, output, fmt=fmt, concurrency=concurrency)
+        await runtime.aclose()
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if output is not sys.stdout:
+            output.close()
+
+    console = Console(stderr=True)
+    console.print(
+        f"[bold]Batch finished:[/bold] {stats['succeeded']}/{stats['total']} succeeded, "
+        f"{stats['failed']} failed in {stats['wall_seconds']:.2f}s "
+        f"({stats['throughput_per_second']:.2f} runs/s at concurrency {concurrency})"
+    )
+    console.print(
+        f"Latency p50 {stats['latency_p50']:.3f}s, p95 {stats['latency_p95']:.3f}s, "
+        f"p99 {stats['latency_p99']:.3f}s, max {stats['latency_max']:.3f}s"
+    )
+    if metrics_path:
+        from shopy.metrics import REGISTRY
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            f.write(REGISTRY.to_prometheus() if metrics_path.endswith(".prom") else REGISTRY.to_json())
+        console.print(f"Metrics written to {metrics_path}")
+    return stats
@@ -0,0 +1,227 @@
+# shopy/cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from shopy.metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a free-text query so trivially different spellings share a cache entry."""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Builds a stable content-addressed key from JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """
+    A two-tier cache with per-entry TTLs.
+
+    The first tier is an in-memory LRU bounded by `max_entries`. The optional second
+    tier is a SQLite table at `path` that survives restarts and is bounded by
+    `max_disk_entries`; disk hits are promoted back into memory. Values must be
+    JSON-serializable.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "default",
+        max_entries: int = 1024,
+        default_ttl: float = 3600.0,
+        path: Optional[str] = None,
+        max_disk_entries: int = 10000,
+    ):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed_at)")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value for `key`, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    CACHE_LOOKUPS.inc(cache=self.namespace, result="hit", tier="memory")
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        value = json.loads(row[0])
+                        self._db.execute(
+                            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                            (now, self.namespace, key),
+                        )
+                        self._store_memory(key, row[1], value)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        CACHE_LOOKUPS.inc(cache=self.namespace, result="hit", tier="disk")
+                        return value
+                    self._db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+            self.misses += 1
+            CACHE_LOOKUPS.inc(cache=self.namespace, result="miss", tier="none")
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Stores `value` under `key` for `ttl` seconds (defaults to `default_ttl`)."""
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            self._store_memory(key, expires_at, value)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                        (self.namespace, key, json.dumps(value), expires_at, now),
+                    )
+                except (TypeError, ValueError) as e:
+                    logger.warning("Value for cache key %s is not JSON-serializable, keeping it in memory only: %s", key, e)
+                    return
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= max(1, self.max_disk_entries // 10):
+                    self._prune_disk(now)
+
+    def clear(self) -> None:
+        """Removes every entry in this cache's namespace from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters and current tier sizes."""
+        with self._lock:
+            disk_entries = 0
+            if self._db is not None:
+                disk_entries = self._db.execute(
+                    "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+                ).fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "namespace": self.namespace,
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
+
+    def close(self) -> None:
+        """Closes the SQLite tier."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _store_memory(self, key: str, expires_at: float, value: Any) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_disk(self, now: float) -> None:
+        """Drops expired rows, then the least recently used rows beyond `max_disk_entries`."""
+        self._writes_since_prune = 0
+        self._db.execute("DELETE FROM cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+        cursor = self._db.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            " SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_disk_entries),
+        )
+        self.evictions += max(cursor.rowcount, 0)
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls so that callers sharing a key await one in-flight coroutine.
+
+    The call runs in a task of its own that no caller owns: a cancelled caller stops
+    waiting, but the others still get the result. The task is cancelled only once
+    every caller waiting on it has left.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, Tuple[asyncio.Task, List[int]]] = {}
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs `fn()` unless a call for `key` is already in flight, in which case its result is shared."""
+        entry = self._in_flight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(fn())
+            entry = self._in_flight[key] = (task, [0])
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.shared += 1
+        task, waiters = entry
+        waiters[0] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            waiters[0] -= 1
+            if not waiters[0] and not task.done():
+                # The last caller left: nobody wants the result any more.
+                self._in_flight.pop(key, None)
+                task.cancel()
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        entry = self._in_flight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when nobody else is waiting on it.
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
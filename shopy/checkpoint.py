@@ -0,0 +1,248 @@
+# shopy/checkpoint.py
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteCheckpointer(BaseCheckpointSaver[str]):
+    """
+    A LangGraph checkpointer that keeps run state in a local SQLite file.
+
+    LangGraph saves a checkpoint after every superstep of a graph compiled with it,
+    plus the writes of each task that finished within a superstep, keyed by the
+    run's `thread_id`. A run that stopped part way can then be continued from its
+    latest checkpoint, and tasks that had already finished are not run again.
+
+    Checkpoints are stored whole (the serialized State is a few KB), in the same
+    WAL-mode, one-connection style as `shopy.cache.TTLCache`. Runs not written to
+    for `ttl` seconds are deleted now and then; `ttl=None` keeps them forever.
+    Async methods run the SQLite calls in a worker thread.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = 7 * 24 * 3600, prune_every: int = 1000):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._writes_since_prune = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL DEFAULT '', checkpoint_id TEXT NOT NULL,"
+            " parent_checkpoint_id TEXT, type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint_writes ("
+            " thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL DEFAULT '', checkpoint_id TEXT NOT NULL,"
+            " task_id TEXT NOT NULL, idx INTEGER NOT NULL, channel TEXT NOT NULL, type TEXT, value BLOB,"
+            " task_path TEXT NOT NULL DEFAULT '',"
+            " PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS checkpoints_created ON checkpoints (created_at)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, row: Tuple[Any, ...]) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self._db.execute(
+            "SELECT task_id, channel, type, value FROM checkpoint_writes"
+            " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+
+        def config_for(checkpoint_id: str) -> RunnableConfig:
+            return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+        return CheckpointTuple(
+            config=config_for(checkpoint_id),
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=config_for(parent_checkpoint_id) if parent_checkpoint_id else None,
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Returns the checkpoint `config` names, or the thread's latest one if it names none."""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            checkpoint_id = get_checkpoint_id(config)
+            if checkpoint_id:
+                row = self._db.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                # Checkpoint IDs are time-ordered UUIDs, so the largest is the latest.
+                row = self._db.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+                    " ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self._tuple(thread_id, checkpoint_ns, row) if row else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """Yields matching checkpoints, latest first."""
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(get_checkpoint_id(config))
+        if before and get_checkpoint_id(before):
+            where.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+            " FROM checkpoints" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY checkpoint_id DESC"
+        )
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        for thread_id, checkpoint_ns, *row in rows:
+            with self._lock:
+                item = self._tuple(thread_id, checkpoint_ns, tuple(row))
+            if filter and not all(item.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                if limit <= 0:
+                    return
+                limit -= 1
+            yield item
+
+    def put(
+        self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        """Saves `checkpoint` as the child of the one `config` names."""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                    type_, serialized, metadata_type, serialized_metadata, time.time(),
+                ),
+            )
+            self._maybe_prune()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        """Saves the writes a task made within the superstep that follows the checkpoint `config` names."""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # Special writes (errors, interrupts) replace earlier ones; regular writes are only stored once.
+        verb = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "INSERT OR IGNORE"
+        rows: List[Tuple[Any, ...]] = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized = self.serde.dumps_typed(value)
+            rows.append((
+                thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx),
+                channel, type_, serialized, task_path,
+            ))
+        with self._lock:
+            self._db.executemany(f"{verb} INTO checkpoint_writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Deletes every checkpoint and write of a run."""
+        with self._lock:
+            self._db.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._db.execute("DELETE FROM checkpoint_writes WHERE thread_id = ?", (thread_id,))
+
+    def _maybe_prune(self) -> None:
+        self._writes_since_prune += 1
+        if self.ttl is None or self._writes_since_prune < self.prune_every:
+            return
+        self._writes_since_prune = 0
+        # A run is only dropped once its latest checkpoint is older than the TTL, never part of it.
+        stale = [
+            thread_id for (thread_id,) in self._db.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) < ?", (time.time() - self.ttl,)
+            ).fetchall()
+        ]
+        for thread_id in stale:
+            self._db.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._db.execute("DELETE FROM checkpoint_writes WHERE thread_id = ?", (thread_id,))
+        if stale:
+            logger.debug("Pruned checkpoints of %d runs older than %.0fs", len(stale), self.ttl)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+        self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = ""
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # Zero-padded so versions compare correctly as strings; the random part keeps versions
+        # written by two forks of the same checkpoint distinct, as in LangGraph's own savers.
+        if current is None:
+            version = 0
+        elif isinstance(current, int):
+            version = current
+        else:
+            version = int(current.split(".")[0])
+        return f"{version + 1:032}.{random.random():016}"
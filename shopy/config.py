@@ -4,7 +4,7 @@ import os
 import logging
 from pathlib import Path
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 class Config:
     """A class to load and manage configuration settings from environment variables."""
@@ -22,10 +22,10 @@ class Config:
                         config_vars[key.strip()] = value.strip()
                         #logging.debug(f"Loaded {key.strip()}={value.strip()} from .env")
         except FileNotFoundError:
-            logging.error(f"Error: .env file not found at {env_path}")
+            logger.error("Error: .env file not found at %s", env_path)
             raise
         except Exception as e:
-            logging.error(f"Error loading .env file: {e}")
+            logger.error("Error loading .env file: %s", e)
             raise
 
         self.gmail_user = config_vars.get("GMAIL_USER")
@@ -34,6 +34,117 @@ class Config:
         self.tavily_api_key = config_vars.get("TAVILY_API_KEY")
         self.google_api_key = config_vars.get("GOOGLE_API_KEY")
 
+        # Tavily HTTP client settings
+        self.tavily_base_url = config_vars.get("TAVILY_BASE_URL", "https://api.tavily.com")
+        self.tavily_timeout = float(config_vars.get("TAVILY_TIMEOUT", 10.0))
+        self.tavily_max_connections = int(config_vars.get("TAVILY_MAX_CONNECTIONS", 20))
+
+        # YouTube review lookups: each product's review link is cached for YOUTUBE_CACHE_TTL seconds
+        # alongside the search results (SEARCH_CACHE_ENABLED/SEARCH_CACHE_PATH)
+        self.youtube_base_url = config_vars.get("YOUTUBE_BASE_URL", "https://www.googleapis.com")
+        self.youtube_timeout = float(config_vars.get("YOUTUBE_TIMEOUT", 10.0))
+        self.youtube_max_concurrency = int(config_vars.get("YOUTUBE_MAX_CONCURRENCY", 8))
+        self.youtube_cache_ttl = float(config_vars.get("YOUTUBE_CACHE_TTL", 7 * 24 * 3600))
+
+        # Search results whose titles are at least this similar (estimated Jaccard of title
+        # shingles) and name the same model are treated as one product; above 1 only identical URLs merge
+        self.search_dedupe_threshold = float(config_vars.get("SEARCH_DEDUPE_THRESHOLD", 0.5))
+
+        # Tail-latency controls for Tavily and Gemini calls: each call gets at most its timeout and never
+        # more than is left of RUN_BUDGET; transient failures are retried with jittered backoff, calls
+        # slower than the recent p95 are hedged, and after CIRCUIT_BREAKER_FAILURES failures in a row a
+        # backend is skipped for CIRCUIT_BREAKER_RESET seconds. With FALLBACK_TO_MOCK, failed calls are
+        # answered by the mock search results and MockLLM instead of leaving that part of the result empty;
+        # such runs come back with State.degraded set and send no email.
+        self.run_budget = float(config_vars.get("RUN_BUDGET", 60))
+        self.llm_timeout = float(config_vars.get("LLM_TIMEOUT", 30))
+        self.external_retries = int(config_vars.get("EXTERNAL_RETRIES", 2))
+        self.hedge_requests = config_vars.get("HEDGE_REQUESTS", "true").lower() == "true"
+        self.circuit_breaker_failures = int(config_vars.get("CIRCUIT_BREAKER_FAILURES", 5))
+        self.circuit_breaker_reset = float(config_vars.get("CIRCUIT_BREAKER_RESET", 30))
+        self.fallback_to_mock = config_vars.get("FALLBACK_TO_MOCK", "false").lower() == "true"
+
+        # Rate limits per backend, shared by every run in the process (0 means no limit). Each backend's
+        # concurrency starts at its *_MAX_CONCURRENCY; with ADAPTIVE_CONCURRENCY it is halved when the
+        # backend answers 429 or latency climbs and grows back one call at a time (AIMD). Calls waiting for
+        # a slot are served to interactive runs (CLI, HTTP service) before batch runs.
+        self.adaptive_concurrency = config_vars.get("ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+        self.gemini_requests_per_second = float(config_vars.get("GEMINI_REQUESTS_PER_SECOND", 0))
+        self.gemini_tokens_per_minute = float(config_vars.get("GEMINI_TOKENS_PER_MINUTE", 0))
+        self.gemini_max_concurrency = int(config_vars.get("GEMINI_MAX_CONCURRENCY", 16))
+        self.tavily_requests_per_second = float(config_vars.get("TAVILY_REQUESTS_PER_SECOND", 0))
+        self.tavily_max_concurrency = int(config_vars.get("TAVILY_MAX_CONCURRENCY", self.tavily_max_connections))
+        self.youtube_requests_per_second = float(config_vars.get("YOUTUBE_REQUESTS_PER_SECOND", 0))
+        self.email_messages_per_second = float(config_vars.get("EMAIL_MESSAGES_PER_SECOND", 0))
+
+        # Product page fetching and parsing (PAGE_PARSE_WORKERS=0 parses in a thread instead of worker processes)
+        self.page_fetch_timeout = float(config_vars.get("PAGE_FETCH_TIMEOUT", 10))
+        self.page_fetch_max_connections = int(config_vars.get("PAGE_FETCH_MAX_CONNECTIONS", 20))
+        self.page_fetch_max_per_host = int(config_vars.get("PAGE_FETCH_MAX_PER_HOST", 4))
+        self.page_max_bytes = int(config_vars.get("PAGE_MAX_BYTES", 2_000_000))
+        self.page_parse_workers = int(config_vars.get("PAGE_PARSE_WORKERS", 2))
+
+        # Search result cache settings (an empty SEARCH_CACHE_PATH keeps the cache in memory only)
+        self.search_cache_enabled = config_vars.get("SEARCH_CACHE_ENABLED", "true").lower() == "true"
+        self.search_cache_path = config_vars.get("SEARCH_CACHE_PATH", str(env_path.parent / ".cache" / "shopy_cache.sqlite"))
+        self.search_cache_ttl = float(config_vars.get("SEARCH_CACHE_TTL", 6 * 3600))
+        self.search_cache_size = int(config_vars.get("SEARCH_CACHE_SIZE", 1024))
+        self.search_cache_disk_size = int(config_vars.get("SEARCH_CACHE_DISK_SIZE", 100000))
+
+        # LLM response cache settings (opt-in; shares the SQLite file with the search cache by default)
+        self.llm_cache_enabled = config_vars.get("LLM_CACHE_ENABLED", "false").lower() == "true"
+        self.llm_cache_path = config_vars.get("LLM_CACHE_PATH", self.search_cache_path)
+        self.llm_cache_ttl = float(config_vars.get("LLM_CACHE_TTL", 24 * 3600))
+        self.llm_cache_size = int(config_vars.get("LLM_CACHE_SIZE", 512))
+        self.llm_cache_disk_size = int(config_vars.get("LLM_CACHE_DISK_SIZE", 20000))
+
+        # Memoized graph nodes (schema mapping, comparison, YouTube lookup): outputs are reused by runs whose
+        # inputs to the node are equal. Shares the SQLite file with the search cache by default; an empty
+        # NODE_CACHE_PATH keeps it in memory only.
+        self.node_cache_enabled = config_vars.get("NODE_CACHE_ENABLED", "true").lower() == "true"
+        self.node_cache_path = config_vars.get("NODE_CACHE_PATH", self.search_cache_path)
+        self.node_cache_ttl = float(config_vars.get("NODE_CACHE_TTL", 3600))
+        self.node_cache_size = int(config_vars.get("NODE_CACHE_SIZE", 256))
+        self.node_cache_disk_size = int(config_vars.get("NODE_CACHE_DISK_SIZE", 10000))
+
+        # Outgoing mail settings
+        self.smtp_server = config_vars.get("SMTP_SERVER", "smtp.gmail.com")
+        self.smtp_port = int(config_vars.get("SMTP_PORT", 465))
+        self.smtp_use_ssl = config_vars.get("SMTP_USE_SSL", "true").lower() == "true"
+        self.email_batch_size = int(config_vars.get("EMAIL_BATCH_SIZE", 20))
+        self.email_max_retries = int(config_vars.get("EMAIL_MAX_RETRIES", 5))
+
+        # Checkpointed runs (opt-in): each run's State is saved to SQLite after every step under its run ID,
+        # so a run that fails part way can be resumed (`run.py resume <run_id>`) without repeating the steps
+        # that succeeded. Runs not written to for CHECKPOINT_TTL seconds are deleted.
+        self.checkpoint_enabled = config_vars.get("CHECKPOINT_ENABLED", "false").lower() == "true"
+        self.checkpoint_path = config_vars.get("CHECKPOINT_PATH", str(env_path.parent / ".cache" / "shopy_checkpoints.sqlite"))
+        self.checkpoint_ttl = float(config_vars.get("CHECKPOINT_TTL", 7 * 24 * 3600))
+
+        # Durable job queue and worker pool (`run.py submit` / `run.py worker`): jobs live in SQLite at JOB_QUEUE_PATH.
+        # A worker holds a job for JOB_LEASE_SECONDS at a time, renewed while it runs; a job whose worker dies is
+        # picked up again when its lease runs out. Failed jobs are retried until JOB_MAX_ATTEMPTS, and finished
+        # jobs are kept for JOB_RESULT_TTL seconds. WORKER_PROCESSES=0 starts one worker per CPU core.
+        self.job_queue_path = config_vars.get("JOB_QUEUE_PATH", str(env_path.parent / ".cache" / "shopy_jobs.sqlite"))
+        self.job_lease_seconds = float(config_vars.get("JOB_LEASE_SECONDS", 60))
+        self.job_max_attempts = int(config_vars.get("JOB_MAX_ATTEMPTS", 3))
+        self.job_result_ttl = float(config_vars.get("JOB_RESULT_TTL", 7 * 24 * 3600))
+        self.worker_processes = int(config_vars.get("WORKER_PROCESSES", 0))
+        self.worker_concurrency = int(config_vars.get("WORKER_CONCURRENCY", 8))
+
+        # How long a successful LLM authentication check is trusted before it is repeated
+        self.auth_check_ttl = float(config_vars.get("AUTH_CHECK_TTL", 3600))
+
+        # Generate the summary and the email text in one structured LLM call instead of two
+        self.combine_llm_calls = config_vars.get("COMBINE_LLM_CALLS", "false").lower() == "true"
+
+        # Per-prompt token budgets overriding the defaults in shopy/prompts.py, e.g. "summary=300,email=200"
+        self.prompt_token_budgets = config_vars.get("PROMPT_TOKEN_BUDGETS", "")
+
+        # Logging settings (LOG_FORMAT is "text" or "json"; large logged values are cut to LOG_MAX_FIELD_CHARS)
+        self.log_level = config_vars.get("LOG_LEVEL", "INFO").upper()
+        self.log_format = config_vars.get("LOG_FORMAT", "text").lower()
+        self.log_max_field_chars = int(config_vars.get("LOG_MAX_FIELD_CHARS", 500))
 
         self._validate_config()
 
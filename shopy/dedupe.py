@@ -0,0 +1,284 @@
+# shopy/dedupe.py
+import functools
+import itertools
+import re
+import unicodedata
+import zlib
+from typing import Any, Dict, FrozenSet, List, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+# Query parameters that only track where a click came from. Dropping them makes
+# the same page reached through different campaigns compare equal.
+TRACKING_PARAMS = frozenset({
+    "gclid", "gclsrc", "dclid", "fbclid", "msclkid", "yclid", "twclid", "igshid", "srsltid",
+    "ref", "ref_", "referrer", "tag", "affid", "affiliate", "aff_id", "cmp", "cmpid", "campaign",
+    "mc_cid", "mc_eid", "_ga", "_gl", "spm", "scm", "clickid",
+})
+TRACKING_PREFIXES = ("utm_", "pk_", "hsa_", "_hs", "pd_rd_", "pf_rd_", "sc_", "mkt_")
+_HOST_PREFIXES = ("www.", "m.", "mobile.", "amp.")
+_DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+_AMAZON_ITEM = re.compile(r"/(?:dp|gp/product|gp/aw/d)/([A-Z0-9]{10})(?:[/?]|$)", re.IGNORECASE)
+
+# Words that say what kind of page a result is, not which product it is about.
+NOISE_WORDS = frozenset({
+    "review", "reviews", "reviewed", "hands", "unboxing", "tested", "test", "vs", "versus", "comparison",
+    "buy", "price", "prices", "deal", "deals", "sale", "offer", "offers", "official", "shop", "store",
+    "online", "new", "best", "cheap", "specs", "specifications", "the", "a", "an", "and", "for", "with", "of", "in",
+    "at", "on", "from", "by",
+})
+REVIEW_WORDS = frozenset({"review", "reviews", "reviewed", "hands", "unboxing", "tested", "vs", "versus", "comparison"})
+# Colour and capacity words tell variants of one product apart, not different products.
+COLOUR_WORDS = frozenset({
+    "black", "white", "silver", "gold", "grey", "gray", "blue", "red", "green", "purple", "pink", "yellow",
+    "orange", "midnight", "starlight", "graphite", "space", "obsidian", "porcelain", "cream", "natural",
+})
+# Words naming a different model of the same line ("Pixel 8" vs "Pixel 8 Pro").
+VARIANT_WORDS = frozenset({"pro", "max", "ultra", "plus", "mini", "lite", "air", "fe", "se", "xl", "neo", "fold", "flip"})
+
+_UNIT = r"(?:gb|tb|mb|mah|mp|hz|wh|w|mm|cm|inch|in|g|kg|oz|lbs?)"
+_UNIT_VALUE = re.compile(r"^\d+(?:\.\d+)?" + _UNIT + r"$")
+_JOIN_UNITS = re.compile(r"(\d)\s+(" + _UNIT + r")\b")
+_PLUS = re.compile(r"\+(?=\s|$)")
+# "Galaxy S 24" -> "galaxy s24"; "a" and "i" are left alone as they are usually words.
+_JOIN_MODEL = re.compile(r"\b([b-hj-z])\s+(\d)")
+_YEAR = re.compile(r"^(?:19|20)\d\d$")
+_SEGMENTS = re.compile(r"\s+[|–—-]\s+|\s*[|:]\s+")
+_TOKENS = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_DOMAIN_LIKE = re.compile(r"\b[a-z0-9-]+\.(?:com|net|org|co|in|de|uk|fr|it|es|ca|au|jp|io|shop|store)\b")
+
+
+@functools.lru_cache(maxsize=4096)
+def canonicalize_url(url: str) -> str:
+    """
+    Returns the form of `url` that duplicates of the same page share.
+
+    The scheme and host are lower-cased, "www."/"m." prefixes, default ports,
+    fragments, trailing slashes and tracking parameters are dropped, the remaining
+    query parameters are sorted, and Amazon item URLs are reduced to /dp/<ASIN>.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    scheme = (parts.scheme or "https").lower()
+    host = (parts.hostname or "").lower()
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    try:
+        port = f":{parts.port}" if parts.port else ""
+    except ValueError:
+        port = ""
+    if port == _DEFAULT_PORTS.get(scheme):
+        port = ""
+    path = re.sub(r"/{2,}", "/", parts.path or "/")
+    if "amazon." in host:
+        item = _AMAZON_ITEM.search(path)
+        if item:
+            return urlunsplit((scheme, host + port, f"/dp/{item.group(1).upper()}", "", ""))
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    return urlunsplit((scheme, host + port, path, urlencode(query), ""))
+
+
+def _site_names(url: str) -> FrozenSet[str]:
+    """The spellings a shop's name takes in its own titles: "bestbuy" for www.bestbuy.com."""
+    host = (urlsplit(url).hostname or "").lower() if url else ""
+    labels = [label for label in host.split(".") if label not in ("www", "m", "com", "co", "net", "org", "shop", "store")]
+    return frozenset(labels[:1])
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_title(title: str, url: str = "") -> str:
+    """
+    Reduces a result title to the words that identify the product.
+
+    Shop names ("| Best Buy", "Amazon.com:") and segments without a model number
+    (a colour, "great camera") are dropped when another segment has one; then the
+    title is lower-cased, a trailing "+" becomes "plus", numbers are joined to
+    their units ("128 GB" -> "128gb") and to a one-letter series ("S 24" -> "s24"),
+    and words like "review", "buy" or "best price" are removed. Colour and capacity
+    words are kept here; `shingle_text` leaves them out of the similarity sketch.
+    """
+    text = unicodedata.normalize("NFKC", title or "").replace("&", " and ")
+    text = re.sub(r"[™®©]", "", text)
+    sites = _site_names(url)
+    segments = []
+    for segment in _SEGMENTS.split(text):
+        plain = segment.strip().lower()
+        letters = re.sub(r"[^a-z0-9]", "", plain)
+        if not letters or _DOMAIN_LIKE.search(plain) or letters in sites:
+            continue
+        segments.append(segment)
+    with_numbers = [segment for segment in segments if any(c.isdigit() for c in segment)]
+    text = " ".join(with_numbers or segments).lower()
+    text = text.replace("hands-on", "hands")
+    text = _PLUS.sub(" plus", text)
+    text = _JOIN_MODEL.sub(r"\1\2", text)
+    text = _JOIN_UNITS.sub(r"\1\2", text)
+    return " ".join(token for token in _TOKENS.findall(text) if token not in NOISE_WORDS)
+
+
+def model_tokens(normalized: str) -> FrozenSet[str]:
+    """The tokens that name a model: model numbers and words like "pro" or "ultra", but not capacities or years."""
+    return frozenset(
+        token for token in normalized.split()
+        if token in VARIANT_WORDS
+        or (any(c.isdigit() for c in token) and not _UNIT_VALUE.match(token) and not _YEAR.match(token))
+    )
+
+
+def shingle_text(normalized: str) -> str:
+    """The text whose shingles are sketched: the normalized title without colour and capacity words."""
+    return " ".join(
+        token for token in normalized.split() if token not in COLOUR_WORDS and not _UNIT_VALUE.match(token)
+    )
+
+
+def shingles(text: str, size: int = 3) -> List[str]:
+    """The character `size`-grams of `text` (the whole text if it is shorter)."""
+    if len(text) <= size:
+        return [text]
+    return [text[i:i + size] for i in range(len(text) - size + 1)]
+
+
+class MinHasher:
+    """
+    MinHash signatures over character shingles.
+
+    Each of the `num_perm` hash functions is h(x) = (a * x + b) mod p over the
+    CRC32 of a shingle, with p = 2**31 - 1, so the products fit in uint64 and all
+    titles of a batch are hashed in one NumPy expression. The share of equal
+    positions in two signatures estimates the Jaccard similarity of the shingle sets.
+    """
+
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, self.PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, self.PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+    def signatures(self, shingle_sets: Sequence[Sequence[str]]) -> np.ndarray:
+        """Returns an (n, num_perm) array with the signature of each shingle set; empty sets hash like ""."""
+        hashes: List[int] = []
+        starts: List[int] = []
+        for items in shingle_sets:
+            starts.append(len(hashes))
+            hashes.extend({zlib.crc32(item.encode()) % self.PRIME for item in (items or [""])})
+        if not starts:
+            return np.empty((0, self.num_perm), dtype=np.uint64)
+        values = (self.a * np.asarray(hashes, dtype=np.uint64)[None, :] + self.b) % np.uint64(self.PRIME)
+        return np.minimum.reduceat(values, starts, axis=1).T
+
+
+class _DisjointSet:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            # The earlier result becomes the root, so clusters keep search order.
+            self.parent[max(i, j)] = min(i, j)
+
+
+_HASHERS: Dict[int, MinHasher] = {}
+
+
+def cluster(titles: Sequence[str], urls: Sequence[str], threshold: float = 0.5, num_perm: int = 64, bands: int = 32) -> List[List[int]]:
+    """
+    Groups result indexes that point at the same page or name the same product.
+
+    Results with the same canonical URL always share a group. Otherwise two results
+    are grouped when their normalized titles name the same model (`model_tokens`)
+    and their estimated shingle Jaccard similarity is at least `threshold`.
+    Identical titles are sketched once, and only titles naming the same model that
+    agree on all rows of at least one of `bands` signature bands are compared
+    (locality-sensitive hashing), so the cost grows about linearly with the number
+    of results. Groups are ordered by their first index.
+    """
+    count = len(titles)
+    groups = _DisjointSet(count)
+    first_with_url: Dict[str, int] = {}
+    for i, url in enumerate(urls):
+        if url:
+            groups.union(first_with_url.setdefault(canonicalize_url(url), i), i)
+
+    # One sketch per distinct (shingle text, model tokens); results sharing one are the same product.
+    first_with_key: Dict[Tuple[str, FrozenSet[str]], int] = {}
+    for i, (title, url) in enumerate(zip(titles, urls)):
+        normalized = normalize_title(title, url)
+        text = shingle_text(normalized)
+        if text:
+            groups.union(first_with_key.setdefault((text, model_tokens(normalized)), i), i)
+    keys = list(first_with_key)
+    if len(keys) > 1:
+        hasher = _HASHERS.get(num_perm) or _HASHERS.setdefault(num_perm, MinHasher(num_perm))
+        signatures = hasher.signatures([shingles(text) for text, _ in keys])
+        rows = max(1, num_perm // bands)
+        candidates = set()
+        for start in range(0, num_perm - rows + 1, rows):
+            buckets: Dict[Tuple[FrozenSet[str], bytes], List[int]] = {}
+            for k, (_, models) in enumerate(keys):
+                buckets.setdefault((models, signatures[k, start:start + rows].tobytes()), []).append(k)
+            for members in buckets.values():
+                candidates.update(itertools.combinations(members, 2))
+        if candidates:
+            pairs = np.array(sorted(candidates))
+            similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+            for a, b in pairs[similarity >= threshold]:
+                groups.union(first_with_key[keys[a]], first_with_key[keys[b]])
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(count):
+        clusters.setdefault(groups.find(i), []).append(i)
+    return sorted(clusters.values(), key=lambda members: members[0])
+
+
+def _is_review(title: str) -> bool:
+    return any(token in REVIEW_WORDS for token in _TOKENS.findall((title or "").lower()))
+
+
+def dedupe_products(
+    products: List[Dict[str, Any]], threshold: float = 0.5, num_perm: int = 64, bands: int = 32
+) -> List[Dict[str, Any]]:
+    """
+    Returns one search result per product, in search order.
+
+    The representative of each group is its first result that is not a review
+    (a shop page is more likely to have a price and specs), else its first result.
+    When a group has other pages, their URLs are listed under "alternate_urls", most
+    relevant first and without repeats of the same canonical URL.
+    """
+    titles = [str(product.get("name") or "") for product in products]
+    urls = [str(product.get("url") or "") for product in products]
+    kept = []
+    for members in cluster(titles, urls, threshold=threshold, num_perm=num_perm, bands=bands):
+        chosen = next((i for i in members if not _is_review(titles[i])), members[0])
+        representative = dict(products[chosen])
+        seen = {canonicalize_url(urls[chosen])} if urls[chosen] else set()
+        alternates = []
+        for i in members:
+            canonical = canonicalize_url(urls[i]) if urls[i] else ""
+            if canonical and canonical not in seen:
+                seen.add(canonical)
+                alternates.append(urls[i])
+        if alternates:
+            representative["alternate_urls"] = alternates
+        kept.append(representative)
+    return kept
@@ -28,4 +28,20 @@ class LLMError(Exception):
 class EmailError(Exception):
     """Custom exception for email sending errors."""
     def __init__(self, message: str):
-        super().__init__(message)
\ No newline at end of file
+        super().__init__(message)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open."""
+    def __init__(self, message: str):
+        super().__init__(message)
+
+class DeadlineExceededError(Exception):
+    """Raised when a run has no time left for another call to a backend."""
+    def __init__(self, message: str):
+        super().__init__(message)
+
+class RunFailedError(Exception):
+    """Raised when a checkpointed run stops at a failing node; `ShopyAgent.resume(run_id)` continues it."""
+    def __init__(self, message: str, run_id: str):
+        super().__init__(message)
+        self.run_id = run_id
@@ -0,0 +1,281 @@
+# shopy/extract.py
+import json
+import re
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# This module runs in the page-parsing worker processes, so it only imports the
+# standard library and starts up quickly.
+
+CHUNK_CHARS = 64 * 1024
+
+_PRICE_TEXT = re.compile(r"(?P<symbol>[$€£¥₹])\s?(?P<amount>\d{1,3}(?:[,.\s]\d{3})*(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)")
+_SYMBOL_CURRENCIES = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY", "₹": "INR"}
+_NAME_META = ("og:title", "twitter:title")
+_PRICE_META = ("product:price:amount", "og:price:amount")
+_CURRENCY_META = ("product:price:currency", "og:price:currency")
+_SKIP_TEXT = {"script", "style", "noscript", "template", "svg"}
+_VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+def parse_price(value: Any) -> Optional[float]:
+    """Parses "1,299.99", "1.299,99", "$199" or 199 into a float; None if there is no number."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = re.sub(r"[^\d.,]", "", str(value or ""))
+    if not text or not any(c.isdigit() for c in text):
+        return None
+    if "," in text and "." in text:
+        # Whichever separator comes last is the decimal point.
+        thousands = "," if text.rindex(",") < text.rindex(".") else "."
+        text = text.replace(thousands, "").replace(",", ".")
+    elif "," in text:
+        head, _, tail = text.rpartition(",")
+        text = f"{head.replace(',', '')}.{tail}" if len(tail) in (1, 2) else text.replace(",", "")
+    elif text.count(".") > 1 or (text.count(".") == 1 and len(text.rpartition(".")[2]) == 3):
+        text = text.replace(".", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _clean(text: str) -> str:
+    return " ".join(text.split())
+
+
+class ProductPageParser(HTMLParser):
+    """
+    A streaming extractor for product pages that never builds a DOM.
+
+    Feed it the page in chunks and read `result()`. It collects the candidates a
+    shop page commonly exposes for the product name and price (JSON-LD, OpenGraph
+    and schema.org microdata, then <h1>/<title> and a price found in the text)
+    and key/value specs from two-column table rows and <dl> lists.
+    """
+
+    def __init__(self, max_specs: int = 50, max_key_chars: int = 60, max_value_chars: int = 200):
+        super().__init__(convert_charrefs=True)
+        self.max_specs = max_specs
+        self.max_key_chars = max_key_chars
+        self.max_value_chars = max_value_chars
+        self.meta: Dict[str, str] = {}
+        self.itemprops: Dict[str, str] = {}
+        self.json_ld: List[str] = []
+        self.title = ""
+        self.h1 = ""
+        # The best price seen in the page text so far, as (rank, symbol, amount): prices in an
+        # element whose class or id mentions "price" rank 2, ones right after a "price" label 1.
+        self.text_price: Optional[Tuple[int, str, str]] = None
+        self._recent_text = ""
+        self.specs: Dict[str, str] = {}
+        # Text being collected for an element: (purpose, tag, nesting depth, parts).
+        self._captures: List[Tuple[str, str, List[int], List[str]]] = []
+        self._skip_depth = 0
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+        self._dt: Optional[str] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attributes = {key: value or "" for key, value in attrs}
+        for _, capture_tag, depth, _ in self._captures:
+            if capture_tag == tag:
+                depth[0] += 1
+
+        if tag == "meta":
+            key = attributes.get("property") or attributes.get("name") or attributes.get("itemprop")
+            if key and "content" in attributes:
+                self.meta.setdefault(key.lower(), attributes["content"])
+            itemprop = attributes.get("itemprop")
+            if itemprop and "content" in attributes:
+                self.itemprops.setdefault(itemprop, attributes["content"])
+            return
+        if tag == "script":
+            if attributes.get("type", "").lower() == "application/ld+json":
+                self._start_capture("json_ld", tag)
+            else:
+                self._skip_depth += 1
+            return
+        if tag in _SKIP_TEXT:
+            self._skip_depth += 1
+            return
+        if tag in _VOID:
+            return
+
+        if "price" in f"{attributes.get('class', '')} {attributes.get('id', '')}".lower():
+            self._start_capture("price", tag)
+        itemprop = attributes.get("itemprop")
+        if itemprop in ("name", "price", "priceCurrency") and itemprop not in self.itemprops:
+            if "content" in attributes:
+                self.itemprops[itemprop] = attributes["content"]
+            else:
+                self._start_capture(f"itemprop:{itemprop}", tag)
+        if tag == "title" and not self.title:
+            self._start_capture("title", tag)
+        elif tag == "h1" and not self.h1:
+            self._start_capture("h1", tag)
+        elif tag == "tr":
+            self._row = []
+        elif tag in ("th", "td") and self._row is not None:
+            self._cell = []
+        elif tag in ("dt", "dd"):
+            self._start_capture(tag, tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in _SKIP_TEXT and tag != "script" or (tag == "script" and self._skip_depth):
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        for capture in list(self._captures):
+            purpose, capture_tag, depth, parts = capture
+            if capture_tag != tag:
+                continue
+            depth[0] -= 1
+            if depth[0] == 0:
+                self._captures.remove(capture)
+                self._finish_capture(purpose, "".join(parts))
+
+        if tag in ("th", "td") and self._cell is not None and self._row is not None:
+            self._row.append(_clean("".join(self._cell)))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if len(self._row) == 2:
+                self._add_spec(*self._row)
+            self._row = None
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth:
+            return
+        for _, _, _, parts in self._captures:
+            parts.append(data)
+        if self._cell is not None:
+            self._cell.append(data)
+        if any(purpose == "json_ld" for purpose, _, _, _ in self._captures):
+            return
+        match = _PRICE_TEXT.search(data)
+        if match:
+            labelled = "price" in (self._recent_text + data[:match.start()])[-40:].lower()
+            self._offer_price(1 if labelled else 0, match)
+        if data.strip():
+            self._recent_text = (self._recent_text + data)[-40:]
+
+    def _offer_price(self, rank: int, match: "re.Match") -> None:
+        if self.text_price is None or rank > self.text_price[0]:
+            self.text_price = (rank, match.group("symbol"), match.group("amount"))
+
+    def _start_capture(self, purpose: str, tag: str) -> None:
+        self._captures.append((purpose, tag, [1], []))
+
+    def _finish_capture(self, purpose: str, text: str) -> None:
+        if purpose == "json_ld":
+            self.json_ld.append(text)
+        elif purpose == "price":
+            match = _PRICE_TEXT.search(text)
+            if match:
+                self._offer_price(2, match)
+        elif purpose == "title":
+            self.title = _clean(text)
+        elif purpose == "h1":
+            self.h1 = _clean(text)
+        elif purpose.startswith("itemprop:"):
+            self.itemprops.setdefault(purpose.partition(":")[2], _clean(text))
+        elif purpose == "dt":
+            self._dt = _clean(text)
+        elif purpose == "dd" and self._dt:
+            self._add_spec(self._dt, _clean(text))
+            self._dt = None
+
+    def _add_spec(self, key: str, value: str) -> None:
+        key = key.rstrip(":").strip()
+        if not key or not value or len(key) > self.max_key_chars or len(self.specs) >= self.max_specs:
+            return
+        self.specs.setdefault(key, value[:self.max_value_chars])
+
+    def result(self) -> Dict[str, Any]:
+        """Returns {"name", "price", "currency", "specs"} from the best source found for each."""
+        product = _json_ld_product(self.json_ld)
+        name = (
+            product.get("name")
+            or next((self.meta[key] for key in _NAME_META if self.meta.get(key)), None)
+            or self.itemprops.get("name")
+            or self.h1
+            or self.title
+            or None
+        )
+        price, currency = product.get("price"), product.get("currency")
+        if price is None:
+            price = next((parse_price(self.meta[key]) for key in _PRICE_META if self.meta.get(key)), None)
+            currency = currency or next((self.meta[key] for key in _CURRENCY_META if self.meta.get(key)), None)
+        if price is None and self.itemprops.get("price"):
+            price = parse_price(self.itemprops["price"])
+        currency = currency or self.itemprops.get("priceCurrency")
+        if price is None and self.text_price is not None:
+            _, symbol, amount = self.text_price
+            price = parse_price(amount)
+            currency = currency or _SYMBOL_CURRENCIES.get(symbol)
+        specs = {**product.get("specs", {}), **self.specs}
+        return {
+            "name": _clean(name) if name else None,
+            "price": price,
+            "currency": currency or None,
+            "specs": dict(list(specs.items())[:self.max_specs]),
+        }
+
+
+def _json_ld_nodes(data: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(data, list):
+        for item in data:
+            yield from _json_ld_nodes(item)
+    elif isinstance(data, dict):
+        yield data
+        yield from _json_ld_nodes(data.get("@graph", []))
+
+
+def _json_ld_product(blocks: List[str]) -> Dict[str, Any]:
+    """Returns the name, price, currency and properties of the first schema.org Product in the JSON-LD blocks."""
+    for block in blocks:
+        try:
+            data = json.loads(block)
+        except ValueError:
+            continue
+        for node in _json_ld_nodes(data):
+            types = node.get("@type")
+            if "Product" not in (types if isinstance(types, list) else [types]):
+                continue
+            offers = node.get("offers") or {}
+            offer = offers[0] if isinstance(offers, list) and offers else offers
+            offer = offer if isinstance(offer, dict) else {}
+            specs = {}
+            for prop in node.get("additionalProperty") or []:
+                if isinstance(prop, dict) and prop.get("name") and prop.get("value") is not None:
+                    specs[_clean(str(prop["name"]))] = _clean(str(prop["value"]))
+            return {
+                "name": node.get("name") if isinstance(node.get("name"), str) else None,
+                "price": parse_price(offer.get("price", offer.get("lowPrice"))),
+                "currency": offer.get("priceCurrency"),
+                "specs": specs,
+            }
+    return {}
+
+
+def extract_product(body: bytes, url: str = "", charset: Optional[str] = None, max_specs: int = 50) -> Dict[str, Any]:
+    """
+    Extracts the product name, price, currency and specs from an HTML page.
+
+    The page is decoded and fed to the parser in chunks, so memory use does not
+    depend on how the page is laid out. Runs in a worker process; it only takes
+    and returns plain data. Markup the standard library parser gives up on ends the
+    parse, and whatever was found before it is returned.
+    """
+    try:
+        text = body.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        text = body.decode("utf-8", errors="replace")
+    parser = ProductPageParser(max_specs=max_specs)
+    try:
+        for start in range(0, len(text), CHUNK_CHARS):
+            parser.feed(text[start:start + CHUNK_CHARS])
+        parser.close()
+    except (AssertionError, ValueError):
+        # html.parser raises these on malformed declarations such as "<![ foo".
+        pass
+    return {"url": url, **parser.result()}
@@ -0,0 +1,508 @@
+# shopy/jobs.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Union
+
+from shopy.metrics import JOBS
+
+if TYPE_CHECKING:
+    from shopy.agent import ShopyAgent
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue:
+    """
+    A durable queue of Shopy runs in a local SQLite file, shared by every process on the box.
+
+    `submit` stores a query and returns its job ID. A worker `claim`s the oldest job
+    that is due and holds a lease on it for `lease_seconds`, extended by `heartbeat`
+    while the run lasts. A job whose lease runs out (its worker crashed or hung) is
+    claimed again by another worker. A failed job is retried with exponential
+    backoff until it has been attempted `max_attempts` times. Results are kept for
+    `result_ttl` seconds after a job finishes.
+
+    Claims take SQLite's write lock, so each job is handed to one worker at a time.
+    Uses the same WAL-mode, one-connection style as `shopy.cache.TTLCache`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 3,
+        backoff: float = 1.0,
+        result_ttl: Optional[float] = 7 * 24 * 3600,
+        prune_every: int = 1000,
+    ):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.result_ttl = result_ttl
+        self.prune_every = prune_every
+        self._writes_since_prune = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, query TEXT NOT NULL, email TEXT NOT NULL DEFAULT '', status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_expires_at REAL, available_at REAL NOT NULL,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, result TEXT, error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, available_at)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def submit(self, query: str, email: str = "") -> str:
+        """Queues a run of `query` and returns its job ID."""
+        return self.submit_many([{"query": query, "email": email}])[0]
+
+    def submit_many(self, requests: Iterable[Union[Dict[str, str], str]]) -> List[str]:
+        """Queues one run per request (a dict with a `query` and an optional `email`, or a bare query) in one transaction."""
+        now = time.time()
+        rows = []
+        for request in requests:
+            if isinstance(request, str):
+                request = {"query": request}
+            rows.append((uuid.uuid4().hex, request["query"], request.get("email") or "", QUEUED, now, now, now))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT INTO jobs (id, query, email, status, available_at, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._writes_since_prune += len(rows)
+                if self.result_ttl is not None and self._writes_since_prune >= self.prune_every:
+                    self._prune(now)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        JOBS.inc(len(rows), event="submitted")
+        return [row[0] for row in rows]
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Leases the oldest due job to `worker` and returns it (`id`, `query`, `email`, `attempts`), or None.
+
+        `attempts` includes this one, so a value above 1 means an earlier attempt
+        failed or its worker was lost.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose worker was lost on their last allowed attempt are not handed out again.
+                lost = self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_expires_at = NULL, updated_at = ?"
+                    " WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                    (FAILED, "Worker lost on the last attempt", now, RUNNING, now, self.max_attempts),
+                ).rowcount
+                row = self._db.execute(
+                    "SELECT id, query, email, attempts, status FROM jobs"
+                    " WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires_at < ?)"
+                    " ORDER BY available_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, lease_expires_at = ?, updated_at = ?"
+                        " WHERE id = ?",
+                        (RUNNING, worker, now + self.lease_seconds, now, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if lost:
+            JOBS.inc(lost, event="failed")
+        if row is None:
+            return None
+        job_id, query, email, attempts, status = row
+        if status == RUNNING:
+            JOBS.inc(event="lease_expired")
+            logger.warning("Job %s lost its worker, running it again (attempt %d)", job_id, attempts + 1)
+        return {"id": job_id, "query": query, "email": email, "attempts": attempts + 1}
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Extends `worker`'s lease on a job; False if the lease was lost to another worker."""
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+            (now + self.lease_seconds, now, job_id, worker, RUNNING),
+        )
+
+    def complete(self, job_id: str, worker: str, result: Dict[str, Any]) -> bool:
+        """Stores a job's result; False (and nothing stored) if `worker` no longer holds its lease."""
+        done = self._update(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_expires_at = NULL, updated_at = ?"
+            " WHERE id = ? AND worker = ? AND status = ?",
+            (DONE, json.dumps(result, default=str), time.time(), job_id, worker, RUNNING),
+        )
+        if done:
+            JOBS.inc(event="done")
+        else:
+            logger.warning("Result of job %s dropped: its lease passed to another worker", job_id)
+        return done
+
+    def fail(self, job_id: str, worker: str, error: str) -> bool:
+        """Records a failed attempt; the job is queued again after a backoff unless it is out of attempts."""
+        now = time.time()
+        # In one write transaction, so no other worker can reclaim the job's lease between the read and the update.
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND status = ?", (job_id, worker, RUNNING)
+                ).fetchone()
+                if row is not None:
+                    attempts = row[0]
+                    if attempts >= self.max_attempts:
+                        self._db.execute(
+                            "UPDATE jobs SET status = ?, error = ?, lease_expires_at = NULL, updated_at = ?"
+                            " WHERE id = ? AND worker = ? AND status = ?",
+                            (FAILED, error, now, job_id, worker, RUNNING),
+                        )
+                    else:
+                        self._db.execute(
+                            "UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_expires_at = NULL, available_at = ?,"
+                            " updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                            (QUEUED, error, now + self.backoff * 2 ** (attempts - 1), now, job_id, worker, RUNNING),
+                        )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            logger.warning("Failure of job %s dropped: its lease passed to another worker", job_id)
+            return False
+        JOBS.inc(event="failed" if attempts >= self.max_attempts else "retried")
+        return True
+
+    def _update(self, sql: str, params: tuple) -> bool:
+        with self._lock:
+            return self._db.execute(sql, params).rowcount > 0
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns a job's status, attempts, last error and timestamps, or None if there is no such job."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, query, email, status, attempts, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "query", "email", "status", "attempts", "error", "created_at", "updated_at")
+        return dict(zip(keys, row))
+
+    def result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the final State (as a dict) of a finished job, or None if it has not finished."""
+        with self._lock:
+            row = self._db.execute("SELECT result FROM jobs WHERE id = ? AND status = ?", (job_id, DONE)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None, poll_interval: float = 0.5) -> Dict[str, Any]:
+        """Polls until a job is done or failed and returns its status; raises asyncio.TimeoutError after `timeout`."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            status = await asyncio.to_thread(self.status, job_id)
+            if status is None:
+                raise KeyError(f"No job {job_id}")
+            if status["status"] in (DONE, FAILED):
+                return status
+            if deadline is not None and time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(f"Job {job_id} is still {status['status']}")
+            await asyncio.sleep(poll_interval)
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of jobs in each status."""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def _prune(self, now: float) -> None:
+        self._writes_since_prune = 0
+        pruned = self._db.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, now - self.result_ttl)
+        ).rowcount
+        if pruned:
+            logger.debug("Pruned %d finished jobs older than %.0fs", pruned, self.result_ttl)
+
+
+AgentFactory = Callable[[], "ShopyAgent"]
+
+
+async def work(
+    queue: JobQueue,
+    worker: str,
+    concurrency: int = 8,
+    stop: Optional[Callable[[], bool]] = None,
+    agent_factory: Optional[AgentFactory] = None,
+    poll_interval: float = 0.2,
+) -> None:
+    """
+    Runs jobs from `queue` on one event loop, `concurrency` at a time, until `stop()` is true.
+
+    The agent comes from `agent_factory`, or is the process-wide runtime's warm
+    agent. Jobs run at batch priority with the job ID as run ID, so with
+    checkpointing enabled a job retried after a failure or a lost worker resumes
+    its run instead of starting over. When stopping, runs in flight are finished first.
+    """
+    from shopy.exceptions import RunFailedError
+    from shopy.ratelimit import BATCH
+
+    runtime = None
+    if agent_factory is not None:
+        agent = agent_factory()
+    else:
+        from shopy.runtime import get_runtime
+        runtime = get_runtime()
+        agent = runtime.agent
+    slots = asyncio.Semaphore(concurrency)
+    running: Set[asyncio.Task] = set()
+
+    async def keep_lease(job_id: str) -> None:
+        while True:
+            await asyncio.sleep(queue.lease_seconds / 3)
+            if not await asyncio.to_thread(queue.heartbeat, job_id, worker):
+                return
+
+    async def process(job: Dict[str, Any]) -> None:
+        lease = asyncio.create_task(keep_lease(job["id"]))
+        try:
+            state = None
+            if job["attempts"] > 1 and getattr(agent, "checkpointer", None) is not None:
+                try:
+                    state = await agent.resume(job["id"], priority=BATCH)
+                except KeyError:
+                    pass
+            if state is None:
+                state = await agent.run(job["query"], job["email"], display=False, priority=BATCH, run_id=job["id"])
+            lease.cancel()
+            await asyncio.to_thread(queue.complete, job["id"], worker, state.dict())
+        except Exception as e:
+            lease.cancel()
+            level = logging.WARNING if isinstance(e, RunFailedError) else logging.ERROR
+            logger.log(level, "Job %s failed on attempt %d: %s", job["id"], job["attempts"], e)
+            await asyncio.to_thread(queue.fail, job["id"], worker, str(e))
+        finally:
+            slots.release()
+
+    try:
+        while not (stop and stop()):
+            await slots.acquire()
+            job = await asyncio.to_thread(queue.claim, worker)
+            if job is None:
+                slots.release()
+                await asyncio.sleep(poll_interval)
+                continue
+            task = asyncio.create_task(process(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    finally:
+        if runtime is not None:
+            await runtime.aclose()
+        else:
+            await agent.tools.aclose()
+
+
+def _worker_process(
+    path: str,
+    worker: str,
+    concurrency: int,
+    lease_seconds: float,
+    max_attempts: int,
+    result_ttl: Optional[float],
+    stop_event: Any,
+    agent_factory: Optional[AgentFactory],
+) -> None:
+    """Entry point of a worker process: builds its own queue connection and agent, then works until stopped."""
+    queue = JobQueue(path, lease_seconds=lease_seconds, max_attempts=max_attempts, result_ttl=result_ttl)
+    try:
+        asyncio.run(work(queue, worker, concurrency, stop=stop_event.is_set, agent_factory=agent_factory))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
+
+
+class WorkerPool:
+    """
+    Runs jobs from a JobQueue in `processes` worker processes, each with its own warm graph.
+
+    One process is bound to one core by JSON handling, State validation and logging,
+    so the pool is how a box's cores are put to work. Each worker runs `concurrency`
+    jobs at once on its event loop. The pool restarts workers that die; their jobs
+    are picked up again when their leases run out, so queued queries survive crashes.
+    Processes are spawned, as for the page parsing pool in `shopy.tools`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        processes: int = 0,
+        concurrency: int = 8,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 3,
+        result_ttl: Optional[float] = 7 * 24 * 3600,
+        agent_factory: Optional[AgentFactory] = None,
+    ):
+        import multiprocessing
+
+        self.path = path
+        self.processes = processes or os.cpu_count() or 1
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.agent_factory = agent_factory
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        self._workers: Dict[str, Any] = {}
+
+    def _spawn(self, name: str) -> None:
+        process = self._context.Process(
+            target=_worker_process,
+            args=(
+                self.path, name, self.concurrency, self.lease_seconds, self.max_attempts, self.result_ttl,
+                self._stop, self.agent_factory,
+            ),
+            name=name,
+            daemon=True,
+        )
+        process.start()
+        self._workers[name] = process
+
+    def start(self) -> None:
+        """Starts the worker processes."""
+        host = os.uname().nodename if hasattr(os, "uname") else "local"
+        for index in range(self.processes):
+            self._spawn(f"{host}-{os.getpid()}-worker-{index}")
+        logger.info("Started %d workers, %d jobs each", self.processes, self.concurrency)
+
+    async def supervise(self, until_idle: bool = False, check_interval: float = 1.0) -> None:
+        """
+        Restarts workers that exit unexpectedly until `stop` is called.
+
+        With `until_idle`, returns once the queue has no queued or running jobs.
+        """
+        queue = (
+            JobQueue(self.path, lease_seconds=self.lease_seconds, max_attempts=self.max_attempts, result_ttl=self.result_ttl)
+            if until_idle else None
+        )
+        try:
+            while not self._stop.is_set():
+                for name, process in list(self._workers.items()):
+                    if not process.is_alive():
+                        self.restarts += 1
+                        logger.warning("Worker %s exited with code %s, restarting it", name, process.exitcode)
+                        self._spawn(name)
+                if queue is not None:
+                    counts = await asyncio.to_thread(queue.counts)
+                    if not counts[QUEUED] and not counts[RUNNING]:
+                        return
+                await asyncio.sleep(check_interval)
+        finally:
+            if queue is not None:
+                queue.close()
+
+    def kill(self, name: str) -> None:
+        """Kills one worker at once, as a crash would (used to test recovery)."""
+        self._workers[name].kill()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._workers)
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Asks workers to finish the jobs they hold and exit, and terminates any still running after `timeout`."""
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for process in self._workers.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+        for process in self._workers.values():
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processes": self.processes,
+            "alive": sum(1 for process in self._workers.values() if process.is_alive()),
+            "restarts": self.restarts,
+        }
+
+
+async def worker_main(processes: int, concurrency: int) -> None:
+    """Entry point for `run.py worker`: runs a pool on the configured queue until interrupted."""
+    from shopy.config import Config
+    from shopy.log import configure_logging
+
+    config = Config()
+    configure_logging(config.log_level, config.log_format, config.log_max_field_chars)
+    pool = WorkerPool(
+        config.job_queue_path,
+        processes=processes or config.worker_processes,
+        concurrency=concurrency or config.worker_concurrency,
+        lease_seconds=config.job_lease_seconds,
+        max_attempts=config.job_max_attempts,
+        result_ttl=config.job_result_ttl,
+    )
+    pool.start()
+    try:
+        await pool.supervise()
+    finally:
+        pool.stop()
+
+
+def open_queue() -> JobQueue:
+    """Returns a connection to the job queue configured in `.env`."""
+    from shopy.config import Config
+
+    config = Config()
+    return JobQueue(
+        config.job_queue_path,
+        lease_seconds=config.job_lease_seconds,
+        max_attempts=config.job_max_attempts,
+        result_ttl=config.job_result_ttl,
+    )
+
+
+async def jobs_main(args: Any) -> None:
+    """Entry point for `run.py submit`, `status` and `result`; prints JSON to stdout."""
+    queue = open_queue()
+    try:
+        if args.command == "submit":
+            job_ids = queue.submit_many([{"query": query, "email": args.email} for query in args.queries])
+            if not args.wait:
+                print(json.dumps({"job_ids": job_ids}))
+                return
+            for job_id in job_ids:
+                status = await queue.wait(job_id)
+                print(json.dumps({**status, "result": queue.result(job_id)}, default=str))
+        elif args.command == "status":
+            print(json.dumps(queue.status(args.job_id) if args.job_id else queue.counts()))
+        else:
+            print(json.dumps(queue.result(args.job_id), default=str))
+    finally:
+        queue.close()
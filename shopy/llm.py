@@ -1,13 +1,50 @@
 # llm.py
 
-from typing import List, Dict, Optional, Any
+from typing import TYPE_CHECKING, AsyncIterator, List, Dict, Optional, Any, Type, TypeVar, get_args, get_origin
 import os
-from dotenv import load_dotenv
 import logging
-import google.generativeai as genai
+import time
+from pydantic import BaseModel, ValidationError
+from .cache import SingleFlight, TTLCache, make_cache_key
 from .exceptions import LLMError
+from .log import Abbrev
+from .metrics import EXTERNAL_SECONDS, FALLBACKS, LLM_PROMPT_CHARS, LLM_RESPONSE_CHARS, LLM_TOKENS, estimate_tokens
+from .resilience import mark_degraded
+
+if TYPE_CHECKING:
+    from .resilience import BackendGuard
+
+logger = logging.getLogger(__name__)
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def _record_usage(llm: str, prompt: str, response: str, usage: Any = None) -> None:
+    """Records prompt and response sizes and token counts for one LLM call."""
+    LLM_PROMPT_CHARS.observe(len(prompt), llm=llm)
+    LLM_RESPONSE_CHARS.observe(len(response), llm=llm)
+    LLM_TOKENS.inc(getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt), llm=llm, kind="prompt")
+    LLM_TOKENS.inc(getattr(usage, "candidates_token_count", None) or estimate_tokens(response), llm=llm, kind="response")
+
+
+def _parse_structured(schema: Type[ModelT], text: str) -> ModelT:
+    """Validates a JSON reply against `schema`, raising LLMError if it doesn't conform."""
+    try:
+        return schema.model_validate_json(text)
+    except ValidationError as e:
+        raise LLMError(f"LLM reply does not match {schema.__name__}: {e}")
+
+
+def mock_structured(schema: Type[ModelT], filler: str = "Mock") -> ModelT:
+    """Builds a schema-valid instance of `schema` with placeholder text, for mock and fake LLMs."""
+    def value_for(name: str, annotation: Any) -> Any:
+        if get_origin(annotation) in (list, List):
+            return [value_for(name, get_args(annotation)[0])]
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            return {field: value_for(field, info.annotation) for field, info in annotation.model_fields.items()}
+        return f"{filler} {name.replace('_', ' ')}"
+    return schema.model_validate(value_for(schema.__name__, schema))
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class GeminiLLM:
     """
@@ -15,58 +52,237 @@ class GeminiLLM:
     This implementation uses google-generativeai client for asynchronous operations.
     """
 
-    def __init__(self):
-        """Initialize GeminiLLM with API key from config."""
-        load_dotenv()
-        api_key = os.getenv('GOOGLE_API_KEY')
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model_name: str = 'gemini-pro',
+        max_output_tokens: int = 1024,
+        cache: Optional[TTLCache] = None,
+        guard: Optional["BackendGuard"] = None,
+        fallback: Optional["MockLLM"] = None,
+    ):
+        """
+        Initialize GeminiLLM with API key from config, falling back to GOOGLE_API_KEY in the environment.
+
+        When a `cache` is given, responses are stored under a hash of the model name,
+        prompt and generation settings, and concurrent identical prompts share a
+        single in-flight request. With a `guard`, API calls run under its deadline,
+        retry, hedging and circuit breaker policy, and its rate limiter if it has
+        one; when they still fail, a `fallback` LLM answers instead (its replies are
+        never cached).
+        """
+        # google.generativeai is slow to import, so it is only loaded when a Gemini client is built.
+        import google.generativeai as genai
+
+        if not api_key:
+            from dotenv import load_dotenv
+            load_dotenv()
+            api_key = os.getenv('GOOGLE_API_KEY')
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self._genai = genai
+        self.model_name = model_name
+        self.max_output_tokens = max_output_tokens
+        self.model = genai.GenerativeModel(model_name)
+        self.cache = cache
+        self.guard = guard
+        self.fallback = fallback
+        self._single_flight = SingleFlight()
         self._is_authenticated = False
 
     async def check_auth(self) -> bool:
         """Verify API authentication with a test request."""
         try:
-            response = await self.agenerate([{"role": "user", "content": "test"}])
+            # Straight to the API: neither a cached reply nor the fallback proves the key works.
+            response = await self._generate("test\n", 0.5)
             if response:
                 self._is_authenticated = True
-                logging.info("Gemini API authentication successful.")
+                logger.info("Gemini API authentication successful.")
                 return True
             else:
-                logging.error("Gemini API authentication failed.")
+                logger.error("Gemini API authentication failed.")
                 return False
         except Exception as e:
-            logging.error(f"❌ Authentication failed: {str(e)}")
+            logger.error("❌ Authentication failed: %s", e)
             return False
 
-    async def agenerate(self, messages: List[Dict], temperature: Optional[float] = None) -> str:
-        """Generate text using the Gemini API."""
+    def _build_prompt(self, messages: List[Dict]) -> str:
+        """Flatten chat-style messages into a single prompt, skipping malformed entries."""
+        # Ensure messages are a list of dictionaries with 'role' and 'content' keys
+        formatted_messages = []
+        for msg in messages:
+            if isinstance(msg, dict) and 'role' in msg and 'content' in msg:
+                formatted_messages.append(msg)
+            else:
+                logger.warning("Invalid message format: %s. Skipping.", Abbrev(msg))
+        if not formatted_messages:
+             logger.error("No valid messages provided to Gemini API.")
+             return ""
+        prompt = ""
+        for msg in formatted_messages:
+            prompt += f"{msg['content']}\n"
+        return prompt
+
+    def _generation_config(self, temperature: float, response_schema: Optional[Type[BaseModel]] = None):
+        if response_schema is not None:
+            # Constrained decoding: the model can only produce JSON matching the schema.
+            return self._genai.types.GenerationConfig(
+                temperature=temperature,
+                max_output_tokens=self.max_output_tokens,
+                response_mime_type="application/json",
+                response_schema=response_schema,
+            )
+        return self._genai.types.GenerationConfig(
+            temperature=temperature,
+            max_output_tokens=self.max_output_tokens
+        )
+
+    async def agenerate(
+        self,
+        messages: List[Dict],
+        temperature: Optional[float] = None,
+        response_schema: Optional[Type[BaseModel]] = None,
+    ) -> str:
+        """Generate text using the Gemini API, or JSON conforming to `response_schema` if one is given."""
         try:
-            # Ensure messages are a list of dictionaries with 'role' and 'content' keys
-            formatted_messages = []
-            for msg in messages:
-                if isinstance(msg, dict) and 'role' in msg and 'content' in msg:
-                    formatted_messages.append(msg)
-                else:
-                    logging.warning(f"Invalid message format: {msg}. Skipping.")
-            if not formatted_messages:
-                 logging.error("No valid messages provided to Gemini API.")
-                 return ""
-            prompt = ""
-            for msg in formatted_messages:
-                prompt += f"{msg['content']}\n"
+            prompt = self._build_prompt(messages)
+            if not prompt:
+                return ""
+            temperature = temperature if temperature else 0.5
+
+            if self.cache is None:
+                return await self._generate(prompt, temperature, response_schema)
 
+            cache_key = self._cache_key(prompt, temperature, response_schema.__name__ if response_schema is not None else None)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Gemini response served from cache.")
+                return cached
+            return await self._single_flight.do(
+                cache_key, lambda: self._generate_and_cache(cache_key, prompt, temperature, response_schema)
+            )
+        except Exception as e:
+            if self.fallback is not None:
+                return await self._degraded(messages, response_schema, e)
+            if isinstance(e, LLMError):
+                raise
+            logger.error("Error generating text with Gemini API: %s", e)
+            raise LLMError(f"Error generating text with Gemini API: {e}")
+
+    async def _degraded(self, messages: List[Dict], response_schema: Optional[Type[BaseModel]], error: Exception) -> str:
+        """Answers from the fallback LLM after the Gemini call failed."""
+        FALLBACKS.inc(service="gemini")
+        mark_degraded()
+        logger.warning("Gemini call failed, answering from %s: %s", type(self.fallback).__name__, error)
+        if response_schema is not None:
+            return (await self.fallback.agenerate_structured(messages, response_schema)).model_dump_json()
+        return await self.fallback.agenerate(messages)
+
+    async def agenerate_structured(
+        self, messages: List[Dict], schema: Type[ModelT], temperature: Optional[float] = None
+    ) -> ModelT:
+        """Generate a reply constrained to `schema` and return it as a validated model instance."""
+        return _parse_structured(schema, await self.agenerate(messages, temperature, response_schema=schema))
+
+    async def _request(self, prompt: str, temperature: float, response_schema: Optional[Type[BaseModel]] = None) -> str:
+        """Makes one Gemini API call."""
+        with EXTERNAL_SECONDS.time(service="gemini"):
             response = await self.model.generate_content_async(
               prompt,
-              generation_config=genai.types.GenerationConfig(
-                  temperature=temperature if temperature else 0.5,
-                  max_output_tokens=1024
-              )
+              generation_config=self._generation_config(temperature, response_schema)
             )
-            return response.text
+            text = response.text
+        _record_usage("gemini", prompt, text, getattr(response, "usage_metadata", None))
+        self._charge_response(text, getattr(response, "usage_metadata", None))
+        return text
+
+    def _charge_response(self, text: str, usage: Any = None) -> None:
+        """Charges the response's tokens to the rate limiter; the prompt's were reserved before the call."""
+        limiter = self.guard.limiter if self.guard is not None else None
+        if limiter is not None:
+            limiter.debit(getattr(usage, "candidates_token_count", None) or estimate_tokens(text))
+
+    async def _generate(self, prompt: str, temperature: float, response_schema: Optional[Type[BaseModel]] = None) -> str:
+        """Send a single prompt to the Gemini API, under the guard if there is one."""
+        try:
+            if self.guard is not None:
+                # Generation has no side effects, so a slow call may be hedged.
+                return await self.guard.call(
+                    lambda timeout: self._request(prompt, temperature, response_schema), tokens=estimate_tokens(prompt)
+                )
+            return await self._request(prompt, temperature, response_schema)
         except Exception as e:
-            logging.error(f"Error generating text with Gemini API: {e}")
+            logger.error("Error generating text with Gemini API: %s", e)
             raise LLMError(f"Error generating text with Gemini API: {e}")
 
+    def _cache_key(self, prompt: str, temperature: float, schema_name: Optional[str] = None) -> str:
+        """The response cache key; plain-text replies (`schema_name` None) share it whether generated or streamed."""
+        return make_cache_key(self.model_name, prompt, temperature, self.max_output_tokens, schema_name)
+
+    async def _generate_and_cache(
+        self, cache_key: str, prompt: str, temperature: float, response_schema: Optional[Type[BaseModel]] = None
+    ) -> str:
+        """Generate a response and store it in the cache if it is non-empty."""
+        response = await self._generate(prompt, temperature, response_schema)
+        if response:
+            self.cache.set(cache_key, response)
+        return response
+
+    async def astream(self, messages: List[Dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Generate text using the Gemini API, yielding chunks as the model produces them.
+
+        A cached response is yielded in one piece; a streamed response is cached
+        once it completes.
+        """
+        prompt = self._build_prompt(messages)
+        if not prompt:
+            return
+        temperature = temperature if temperature else 0.5
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self._cache_key(prompt, temperature)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        chunks: List[str] = []
+        responses = []
+
+        async def open_stream() -> AsyncIterator[str]:
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config=self._generation_config(temperature),
+                stream=True,
+            )
+            responses.append(response)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+        start = time.perf_counter()
+        try:
+            stream = self.guard.stream(open_stream, estimate_tokens(prompt)) if self.guard is not None else open_stream()
+            async for text in stream:
+                chunks.append(text)
+                yield text
+        except Exception as e:
+            EXTERNAL_SECONDS.observe(time.perf_counter() - start, service="gemini", outcome="error")
+            if self.fallback is not None and not chunks:
+                FALLBACKS.inc(service="gemini")
+                mark_degraded()
+                logger.warning("Gemini stream failed, answering from %s: %s", type(self.fallback).__name__, e)
+                async for text in self.fallback.astream(messages, temperature):
+                    yield text
+                return
+            logger.error("Error streaming text from Gemini API: %s", e)
+            raise LLMError(f"Error streaming text from Gemini API: {e}")
+        EXTERNAL_SECONDS.observe(time.perf_counter() - start, service="gemini", outcome="ok")
+        usage = getattr(responses[-1], "usage_metadata", None) if responses else None
+        _record_usage("gemini", prompt, "".join(chunks), usage)
+        self._charge_response("".join(chunks), usage)
+        if cache_key is not None and chunks:
+            self.cache.set(cache_key, "".join(chunks))
+
 class MockLLM:
     """A mock LLM class for testing purposes."""
 
@@ -84,17 +300,37 @@ class MockLLM:
     async def agenerate(self, messages: List[Dict], temperature: Optional[float] = None) -> str:
         """A mock response from LLM, will respond based on the input message."""
         try:
-            if not messages:
-                return "Mock LLM: No message provided."
-
-            for msg in messages:
-                if "Plan" in msg["content"]:
-                    return self.responses.get("plan", "Mock LLM response: Plan not found.")
-                if "materials" in msg["content"].lower():
-                    return self.responses.get("materials", "Mock LLM response: Materials not found.")
-                if "strategies" in msg["content"].lower():
-                    return self.responses.get("strategies", "Mock LLM response: Strategies not found.")
-            return "Mock LLM response: No matching message found."
+            response = self._respond(messages)
+            _record_usage("mock", "".join(msg.get("content", "") for msg in messages or []), response)
+            return response
         except Exception as e:
-            logging.error(f"Error in mock LLM: {e}")
-            raise LLMError(f"Error in mock LLM: {e}")
\ No newline at end of file
+            logger.error("Error in mock LLM: %s", e)
+            raise LLMError(f"Error in mock LLM: {e}")
+
+    async def agenerate_structured(
+        self, messages: List[Dict], schema: Type[ModelT], temperature: Optional[float] = None
+    ) -> ModelT:
+        """Returns a placeholder instance of `schema`."""
+        result = mock_structured(schema)
+        _record_usage("mock", "".join(msg.get("content", "") for msg in messages or []), result.model_dump_json())
+        return result
+
+    def _respond(self, messages: List[Dict]) -> str:
+        if not messages:
+            return "Mock LLM: No message provided."
+
+        for msg in messages:
+            if "Plan" in msg["content"]:
+                return self.responses.get("plan", "Mock LLM response: Plan not found.")
+            if "materials" in msg["content"].lower():
+                return self.responses.get("materials", "Mock LLM response: Materials not found.")
+            if "strategies" in msg["content"].lower():
+                return self.responses.get("strategies", "Mock LLM response: Strategies not found.")
+        return "Mock LLM response: No matching message found."
+
+    async def astream(self, messages: List[Dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        """Streams the mock response word by word."""
+        response = await self.agenerate(messages, temperature)
+        words = response.split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
\ No newline at end of file
@@ -0,0 +1,128 @@
+# shopy/log.py
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from contextvars import ContextVar
+from typing import Any, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# The trace ID of the graph run the current task belongs to, if any.
+trace_id_var: ContextVar[str] = ContextVar("shopy_trace_id", default="")
+
+
+class Abbrev:
+    """
+    A log argument that renders a possibly large value in bounded space.
+
+    Nothing is formatted unless the record is actually emitted. Sequences and dicts
+    show their first `max_items` entries and a count of the rest; the result is
+    cut at `max_chars` characters.
+    """
+
+    __slots__ = ("value", "max_items", "max_chars")
+
+    max_chars_default = 500
+
+    def __init__(self, value: Any, max_items: int = 3, max_chars: Optional[int] = None):
+        self.value = value
+        self.max_items = max_items
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, str):
+            text = value
+        elif isinstance(value, dict):
+            items = [f"{k!r}: {v!r}" for k, v in list(value.items())[:self.max_items]]
+            more = len(value) - len(items)
+            text = "{" + ", ".join(items) + (f", ... (+{more} more)" if more > 0 else "") + "}"
+        elif isinstance(value, (list, tuple)):
+            items = [repr(v) for v in value[:self.max_items]]
+            more = len(value) - len(items)
+            text = "[" + ", ".join(items) + (f", ... (+{more} more)" if more > 0 else "") + "]"
+        else:
+            text = repr(value)
+        limit = self.max_chars if self.max_chars is not None else Abbrev.max_chars_default
+        if len(text) > limit:
+            text = f"{text[:limit]}... ({len(text)} chars)"
+        return text
+
+    __repr__ = __str__
+
+
+class TraceIdFilter(logging.Filter):
+    """Tags records logged during a graph run with that run's `trace_id`."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace_id = trace_id_var.get()
+        if trace_id:
+            record.trace_id = trace_id
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as one JSON object, including any fields passed via `extra=`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(level: str = "INFO", fmt: str = "text", max_field_chars: int = 500, force: bool = False) -> None:
+    """
+    Routes all records through a QueueHandler to a background listener thread.
+
+    Callers only pay for the level check, interpolating the (abbreviated) message
+    and enqueueing the record; formatting and writing to the stream happen on the
+    listener thread. Does nothing if logging is already configured, unless `force`
+    is set.
+    """
+    global _listener
+    root = logging.getLogger()
+    if root.handlers and not force:
+        return
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    Abbrev.max_chars_default = max_field_chars
+    output = logging.StreamHandler()
+    output.setFormatter(JSONFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    # Handler filters run in the caller before the record is queued, so the run's context is still visible.
+    handler.addFilter(TraceIdFilter())
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
+
+
+def _stop_listener() -> None:
+    """Flushes records still queued when the process exits."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
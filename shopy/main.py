@@ -1,93 +1,100 @@
 # main.py
 import asyncio
 import os
-from typing import List, Dict, Optional, Any
-from rich.console import Console
-from rich.markdown import Markdown
-from rich.panel import Panel
-from rich.table import Table
-from rich.theme import Theme
+from typing import Optional
 import logging
 
 # Absolute imports
-from shopy.llm import GeminiLLM, MockLLM
+from shopy.exceptions import RunFailedError
 from shopy.models import State
-from shopy.config import Config
-from shopy.agent import ShopyAgent
-from shopy.utils import clean_llm_output
-
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Define a custom theme
-custom_theme = Theme({
-    "info": "dim cyan",
-    "warning": "bold yellow",
-    "error": "bold red",
-    "success": "bold green",
-    "header": "bold magenta",
-    "best_product": "bold green",
-})
-
-console = Console(theme=custom_theme)
+from shopy.runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
+
+async def render_stream(events, display_tool) -> Optional[State]:
+    """Renders each part of the result as soon as its node finishes, and returns the final State."""
+    streaming_summary = False
+    final_state = None
+    async for event in events:
+        if event["event"] == "token":
+            if not streaming_summary:
+                display_tool.show_summary_header()
+                streaming_summary = True
+            display_tool.show_summary_token(event["text"])
+        elif event["event"] == "update":
+            node, data = event["node"], event["data"]
+            if streaming_summary and node != "generate_summary":
+                # Finish the partial summary line before rendering another section;
+                # the header is printed again when the summary resumes.
+                display_tool.end_line()
+                streaming_summary = False
+            if node == "dedupe":
+                display_tool.show_products(data.get("products"))
+            elif node == "product_comparison":
+                display_tool.show_best_product(data.get("best_product"))
+                display_tool.show_comparison(data.get("comparison"))
+            elif node == "youtube_review":
+                display_tool.show_youtube_link(data.get("youtube_link"))
+            elif node == "summarize_and_email":
+                display_tool.show_summary(data.get("summary"))
+            elif node == "generate_summary":
+                if streaming_summary:
+                    display_tool.end_line()
+                else:
+                    display_tool.show_summary(data.get("summary"))
+                streaming_summary = False
+        elif event["event"] == "done":
+            final_state = event["state"]
+    return final_state
 
 
 async def main(query:str = None, email:str = None):
     """Run the ShopyAgent workflow with the given query and email."""
-    logging.info("ShopyAgent is starting...")
+    logger.info("ShopyAgent is starting...")
 
     try:
-        config = Config()
-        if config.google_api_key:
-            llm = GeminiLLM()
-        elif config.gmail_user and config.gmail_pass and config.youtube_api_key and config.tavily_api_key:
-            llm = MockLLM()  # Fall back to MockLLM if Groq API key is not available
-        else:
-            llm = MockLLM()
-            logging.warning("No valid API keys provided, using MockLLM.")
-
-        if not await llm.check_auth():
-             logging.error("LLM authentication failed. Please check your API key.")
+        # The runtime (config, LLM, tools and compiled graph) is built once per process
+        # and the authentication check is cached, so repeated calls go straight to the run.
+        runtime = get_runtime()
+        if not await runtime.ensure_authenticated():
+             logger.error("LLM authentication failed. Please check your API key.")
              return None
 
-        agent = ShopyAgent()  # Initialize the ShopyAgent
-        
         if not query:
             query = input("Enter your product query: ")
         if not email:
              email = input("Enter your email: ")
-        final_state = await agent.run(query, email)  # Run the workflow
-        
+        final_state = await render_stream(runtime.agent.astream(query, email), runtime.tools.display)
+        # Email is delivered in the background; make sure it goes out before the loop ends.
+        await runtime.tools.email.flush()
 
         if isinstance(final_state, State):
-            display_data = final_state.display_data
-            if display_data:
-                if display_data["products"] and display_data["best_product"]:
-                    console.print(f"\n[bold]Here is what ShopyAgent suggests: [/bold] {display_data['best_product']['product_name']}")
-
-                    md = Markdown(f"Justification:\n {display_data['best_product']['justification']}")
-                    panel = Panel(md, title="Best Product", border_style="blue")
-                    console.print(panel)
-
-                    md = Markdown(f"See the review here: {display_data['youtube_link']}")
-                    panel = Panel(md, title="YouTube Review Link", border_style="blue")
-                    console.print(panel)
-
-                    # Create a table for product comparison
-                    table = Table(title="Product Comparisons",show_lines=True)
-                    table.add_column("Product Name", style="cyan")
-                    table.add_column("Rating", style="magenta")
-
-                    for item in display_data['comparison']:
-                        table.add_row(item.get('product_name', ''), str(item.get('rating', '')))
-                    console.print(table)
+            return final_state.dict()
+        return {}
+    except RunFailedError as e:
+        logger.error("%s. Continue it with: python run.py resume %s", e, e.run_id)
+        return None
+    except Exception as e:
+        logger.exception("Main function error: %s", e)
+        return None
 
-                    console.print(f"\n[info]Summary:[/info]")
-                    clean_llm_output(display_data['summary'], console)
 
-                return final_state.dict()
-        return {}
+async def resume_main(run_id: str):
+    """Continue a checkpointed run from its last completed step and display its result."""
+    try:
+        runtime = get_runtime()
+        final_state = await runtime.resume(run_id, display=False)
+        await runtime.tools.display.display_data(final_state.display_data)
+        await runtime.tools.email.flush()
+        return final_state.dict()
+    except (KeyError, RuntimeError) as e:
+        # No checkpoint under that ID, or checkpointing is off (CHECKPOINT_ENABLED).
+        logger.error("Cannot resume run %s: %s", run_id, e.args[0])
+        return None
+    except RunFailedError as e:
+        logger.error("%s. Resume it again once the failing service recovers.", e)
+        return None
     except Exception as e:
-        logging.error(f"Main function error: {e}")
-        import traceback
-        logging.error(traceback.format_exc())
+        logger.exception("Resume error: %s", e)
         return None
\ No newline at end of file
@@ -0,0 +1,269 @@
+# shopy/metrics.py
+import asyncio
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 65536, 262144)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, lock: threading.Lock):
+        self.name = name
+        self.help = help
+        self._lock = lock
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def _reset(self) -> None:
+        self._values.clear()
+
+    def _prometheus(self) -> List[str]:
+        return [f"{self.name}{_format_labels(key)} {value:g}" for key, value in sorted(self._values.items())]
+
+    def _json(self) -> List[Dict[str, Any]]:
+        return [{"labels": dict(key), "value": value} for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """A value per label set that can go down as well as up."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+
+class Histogram:
+    """
+    Observations counted into fixed buckets per label set.
+
+    Quantiles are estimated by interpolating within the bucket that holds them, as
+    Prometheus' `histogram_quantile` does, so they are only as precise as the buckets
+    (though never above the largest value observed).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, lock: threading.Lock, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._lock = lock
+        self._series: Dict[LabelKey, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets) + 1)
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+            if value > series.max:
+                series.max = value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observes the wall time of the block, labelled with outcome="ok", "error" or "cancelled"."""
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        except asyncio.CancelledError:
+            # E.g. the slower of two hedged requests; not a failure of the service.
+            outcome = "cancelled"
+            raise
+        finally:
+            self.observe(time.perf_counter() - start, outcome=outcome, **labels)
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(_label_key(labels))
+        return series.count if series else 0
+
+    def quantile(self, q: float, **labels: Any) -> Optional[float]:
+        series = self._series.get(_label_key(labels))
+        if series is None or not series.count:
+            return None
+        return self._quantile(series, q)
+
+    def _quantile(self, series: _HistogramSeries, q: float) -> float:
+        rank = q * series.count
+        seen = 0
+        for i, bucket_count in enumerate(series.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else series.max
+                return min(series.max, lower + (upper - lower) * (rank - seen) / bucket_count)
+            seen += bucket_count
+        return series.max
+
+    def _reset(self) -> None:
+        self._series.clear()
+
+    def _prometheus(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series.counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series.count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series.sum:g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series.count}")
+        return lines
+
+    def _json(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "labels": dict(key),
+                "count": series.count,
+                "sum": series.sum,
+                "mean": series.sum / series.count if series.count else 0.0,
+                "max": series.max,
+                "p50": self._quantile(series, 0.5),
+                "p95": self._quantile(series, 0.95),
+                "p99": self._quantile(series, 0.99),
+                "buckets": dict(zip([f"{b:g}" for b in self.buckets] + ["+Inf"], series.counts)),
+            }
+            for key, series in sorted(self._series.items())
+        ]
+
+
+class MetricsRegistry:
+    """A set of in-process counters, gauges and histograms that can be exported as Prometheus text or JSON."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help, self._lock))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._register(Gauge(name, help, self._lock))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, self._lock, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def reset(self) -> None:
+        """Clears every recorded value, e.g. between benchmark runs."""
+        with self._lock:
+            for metric in self._metrics.values():
+                metric._reset()
+
+    def to_prometheus(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric._prometheus())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns all metrics as plain data, with estimated p50/p95/p99 for histograms."""
+        with self._lock:
+            return {
+                name: {"type": metric.kind, "help": metric.help, "series": metric._json()}
+                for name, metric in self._metrics.items()
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+
+REGISTRY = MetricsRegistry()
+
+RUN_SECONDS = REGISTRY.histogram("shopy_run_duration_seconds", "End-to-end wall time of one graph run.")
+NODE_SECONDS = REGISTRY.histogram("shopy_node_duration_seconds", "Wall time of each graph node.")
+NODE_ERRORS = REGISTRY.counter("shopy_node_errors_total", "Errors caught inside graph nodes.")
+NODE_CACHE = REGISTRY.counter("shopy_node_cache_total", "Memoized node executions by node and result (hit or miss).")
+EXTERNAL_SECONDS = REGISTRY.histogram(
+    "shopy_external_call_duration_seconds", "Wall time of calls to external services, by service and outcome."
+)
+CACHE_LOOKUPS = REGISTRY.counter("shopy_cache_lookups_total", "Cache lookups by cache and result (hit or miss).")
+RETRIES = REGISTRY.counter("shopy_retries_total", "Retried external operations, by service.")
+HEDGED_REQUESTS = REGISTRY.counter(
+    "shopy_hedged_requests_total", "Duplicate requests sent after the p95 latency, by service and result (sent or won)."
+)
+CIRCUIT_TRANSITIONS = REGISTRY.counter("shopy_circuit_transitions_total", "Circuit breaker state changes, by service and new state.")
+FALLBACKS = REGISTRY.counter("shopy_fallbacks_total", "Calls answered by a degraded fallback instead of the backend, by service.")
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "shopy_rate_limit_wait_seconds", "Time calls waited for a rate limiter slot, by service and priority."
+)
+THROTTLED = REGISTRY.counter("shopy_throttled_total", "Calls rejected by a backend for exceeding its quota, by service.")
+CONCURRENCY_LIMIT = REGISTRY.gauge("shopy_concurrency_limit", "Current adaptive concurrency limit, by service.")
+LLM_PROMPT_CHARS = REGISTRY.histogram("shopy_llm_prompt_chars", "Size of prompts sent to the LLM.", SIZE_BUCKETS)
+LLM_RESPONSE_CHARS = REGISTRY.histogram("shopy_llm_response_chars", "Size of LLM responses.", SIZE_BUCKETS)
+LLM_TOKENS = REGISTRY.counter(
+    "shopy_llm_tokens_total",
+    "LLM tokens by kind (prompt or response); estimated at 4 characters per token when the API reports no usage.",
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "shopy_prompt_tokens", "Estimated tokens of each rendered prompt, by prompt template.", SIZE_BUCKETS
+)
+PROMPT_TRIMS = REGISTRY.counter("shopy_prompt_trims_total", "Prompts trimmed to fit their token budget, by prompt template.")
+SEARCH_DUPLICATES = REGISTRY.counter(
+    "shopy_search_duplicates_total", "Search results dropped because another result names the same product."
+)
+EMAILS = REGISTRY.counter("shopy_emails_total", "Emails handled by the outbox, by result (sent or failed).")
+JOBS = REGISTRY.counter(
+    "shopy_jobs_total", "Queued jobs by event (submitted, done, retried, lease_expired or failed)."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """A rough token count for when the LLM API does not report usage."""
+    return (len(text) + 3) // 4
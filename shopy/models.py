@@ -1,7 +1,66 @@
 # shopy/models.py
 
-from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional, Dict, Any
+from pydantic import BaseModel, Field, SkipValidation
+
+
+def merge_dicts(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """Reducer that merges partial dict updates coming from parallel graph branches."""
+    return {**(left or {}), **(right or {})}
+
+
+def any_true(left: bool, right: bool) -> bool:
+    """Reducer for flags that, once set by any graph branch, stay set."""
+    return bool(left) or bool(right)
+
+
+def comparison_entry(ref: Dict[str, Any], products: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    A comparison row as State shows it, from its reference into `products`.
+
+    Inside the graph a row only holds what the comparison adds to a product,
+    {"id", "rating", "score"}, where `id` is the product's index in `products`
+    (a run's `product_schema`, or its search results if no page was structured).
+    Rows without an `id` are already in their public form and returned as they are.
+    """
+    if "id" not in ref:
+        return ref
+    product = products[ref["id"]]
+    return {
+        "product_name": product["name"],
+        "rating": ref["rating"],
+        "score": ref["score"],
+        "price": product.get("price"),
+        "url": product.get("url"),
+    }
+
+
+def best_product_entry(ref: Optional[Dict[str, Any]], products: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The best product as State shows it, from its {"id", "justification", "score"} reference into `products`."""
+    if not ref or "id" not in ref:
+        return ref
+    product = products[ref["id"]]
+    return {
+        "product_name": product["name"],
+        "justification": ref["justification"],
+        "url": product.get("url"),
+        "price": product.get("price"),
+        "currency": product.get("currency"),
+        "score": ref["score"],
+    }
+
+
+def expand_product_refs(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns `values` with `comparison` and `best_product` turned from references into their public form."""
+    if not values.get("comparison") and not values.get("best_product"):
+        return values
+    products = values.get("product_schema") or values.get("products") or []
+    return {
+        **values,
+        "comparison": [comparison_entry(ref, products) for ref in values.get("comparison") or []],
+        "best_product": best_product_entry(values.get("best_product"), products),
+    }
+
 
 class State(BaseModel):
     query: str = Field(..., description="The user's query.")
@@ -12,6 +71,96 @@ class State(BaseModel):
     best_product: Optional[Dict[str, Any]] = Field(None, description="The best product selected after comparison.")
     comparison: List[Dict[str, Any]] = Field(default_factory=list, description="Comparison data between products.")
     youtube_link: str = Field("", description="Link to a YouTube review of the best product.")
-    display_data: Dict[str, Any] = Field(default_factory=dict, description="Data to be displayed to the user.")
+    review_links: Dict[str, str] = Field(default_factory=dict, description="YouTube review links of the compared products, by product name.")
+    display_data: Annotated[Dict[str, Any], merge_dicts] = Field(default_factory=dict, description="Data to be displayed to the user, assembled from the fields above when the run finishes.")
     summary: str = Field("", description="Summary of the products.")
-    # Include any other fields as necessary
\ No newline at end of file
+    trace_id: str = Field("", description="Identifies this run in logs and metrics.")
+    degraded: Annotated[bool, any_true] = Field(False, description="True if part of the result is fallback data (mock search results or MockLLM text) or missing after a failure; no email is sent for such runs.")
+    # Include any other fields as necessary
+
+    def comparison_view(self) -> List[Dict[str, Any]]:
+        """`comparison` in its public form, also while the graph holds it as references (see RunState)."""
+        products = self.product_schema or self.products
+        return [comparison_entry(ref, products) for ref in self.comparison]
+
+    def best_product_view(self) -> Optional[Dict[str, Any]]:
+        """`best_product` in its public form, also while the graph holds it as a reference (see RunState)."""
+        return best_product_entry(self.best_product, self.product_schema or self.products)
+
+    def display_view(self) -> Dict[str, Any]:
+        """The fields shown to the user, by reference rather than copied."""
+        return {
+            "products": self.products,
+            "best_product": self.best_product_view(),
+            "comparison": self.comparison_view(),
+            "youtube_link": self.youtube_link,
+            "review_links": self.review_links,
+            "summary": self.summary,
+        }
+
+
+class RunState(State):
+    """
+    State as the graph carries it between nodes.
+
+    LangGraph builds a new state object from the channel values for every node it
+    runs. Validating the product lists and dicts each time would copy every product
+    on every step, so here they are taken as they are: nodes only ever store the
+    values other nodes produced. Runs are validated as State once, where their
+    result leaves the agent.
+
+    A compared product's record is kept once, in `product_schema` (or `products`
+    when no page was structured). `comparison` and `best_product` refer to it by
+    its index there (see `comparison_entry` and `best_product_entry`) instead of
+    carrying copies of its name, price and URL into every checkpoint; nodes read
+    them through `comparison_view` and `best_product_view`, and
+    `expand_product_refs` restores the public form.
+    """
+    products: SkipValidation[List[Dict[str, Any]]] = Field(default_factory=list)
+    product_schema: SkipValidation[List[Dict[str, Any]]] = Field(default_factory=list)
+    blogs_content: SkipValidation[List[str]] = Field(default_factory=list)
+    best_product: SkipValidation[Optional[Dict[str, Any]]] = None
+    comparison: SkipValidation[List[Dict[str, Any]]] = Field(default_factory=list)
+    review_links: SkipValidation[Dict[str, str]] = Field(default_factory=dict)
+
+
+class AnalysisResult(BaseModel):
+    """The State fields produced by the structuring/comparison branch of the graph."""
+    product_schema: List[Dict[str, Any]] = Field(default_factory=list)
+    best_product: Optional[Dict[str, Any]] = None
+    comparison: List[Dict[str, Any]] = Field(default_factory=list)
+    youtube_link: str = ""
+    review_links: Dict[str, str] = Field(default_factory=dict)
+    display_data: Annotated[Dict[str, Any], merge_dicts] = Field(default_factory=dict)
+    degraded: Annotated[bool, any_true] = False
+
+
+class CombinedAnalysisResult(AnalysisResult):
+    """AnalysisResult plus the summary, for graphs where the summary is written inside the analysis branch."""
+    summary: str = ""
+
+
+# Schemas for structured LLM replies. Fields have no defaults because Gemini's
+# response_schema does not accept them; every field is required in the reply.
+
+class EmailContent(BaseModel):
+    """The recommendation email, as written by the LLM."""
+    subject: str = Field(..., description="Email subject line.")
+    heading: str = Field(..., description="Heading shown at the top of the email.")
+    justification_line: str = Field(..., description="One engaging sentence on why the product fits the user's needs.")
+    call_to_action: str = Field(..., description="A short call to action, such as 'Check it out now!'.")
+
+
+class ProductSummary(BaseModel):
+    product_name: str = Field(..., description="Name of the product.")
+    explanation: str = Field(..., description="Key features and unique benefits of the product.")
+
+
+class SummaryAndEmail(BaseModel):
+    """One LLM reply carrying both the per-product summary and the recommendation email."""
+    products: List[ProductSummary] = Field(..., description="One entry per product, in the order given.")
+    email: EmailContent
+
+    def summary_markdown(self) -> str:
+        """Renders the summary in the same bullet format the plain summary prompt asks for."""
+        return "\n".join(f"* **{p.product_name}**: {p.explanation}" for p in self.products)
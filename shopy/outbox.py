@@ -0,0 +1,284 @@
+# shopy/outbox.py
+import asyncio
+import logging
+import random
+import time
+from typing import TYPE_CHECKING, Awaitable, Dict, List, Optional, Set, Tuple
+
+from shopy.exceptions import EmailError
+from shopy.metrics import EMAILS, EXTERNAL_SECONDS, RETRIES
+from shopy.ratelimit import is_throttled
+
+logger = logging.getLogger(__name__)
+
+# smtplib and ssl are only needed once mail is actually delivered.
+if TYPE_CHECKING:
+    import smtplib
+    from email.message import EmailMessage
+
+    from shopy.ratelimit import AdaptiveLimiter
+
+
+class EmailOutbox:
+    """
+    A background outbox that delivers email over one persistent SMTP connection.
+
+    Callers hand over messages (or coroutines that compose them) and return
+    immediately. A single worker task drains the queue in batches, reusing an
+    authenticated connection across messages, reconnecting when the server drops
+    it and retrying failed deliveries with jittered exponential backoff. Blocking
+    smtplib calls run in a worker thread so the event loop is never blocked.
+    With a `limiter`, each message takes one request from its rate, and replies
+    asking the sender to slow down (421/450/454) throttle it. Callers that need to
+    know a message went out use `deliver`, which waits for its outcome.
+    """
+
+    def __init__(
+        self,
+        smtp_server: str,
+        port: int,
+        user: Optional[str],
+        password: Optional[str],
+        use_ssl: bool = True,
+        batch_size: int = 20,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        idle_timeout: float = 60.0,
+        max_queue: int = 1000,
+        timeout: float = 30.0,
+        limiter: Optional["AdaptiveLimiter"] = None,
+    ):
+        self.smtp_server = smtp_server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.limiter = limiter
+        self._smtp: Optional["smtplib.SMTP"] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._composing: Set[asyncio.Task] = set()
+        # Futures of messages whose sender waits for the outcome, and why refused messages were refused, by id().
+        self._receipts: Dict[int, asyncio.Future] = {}
+        self._refused: Dict[int, str] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.connections = 0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        """Starts the delivery worker on the running loop if it is not already running there."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._queue is not None and self._queue.qsize():
+                logger.warning("Dropping %d queued emails left on a closed event loop.", self._queue.qsize())
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = None
+            self._loop = loop
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+        return self._queue
+
+    def enqueue(self, message: "EmailMessage") -> None:
+        """Queues a composed message for delivery without waiting for it to be sent."""
+        try:
+            self._ensure_worker().put_nowait(message)
+        except asyncio.QueueFull:
+            self.failed += 1
+            EMAILS.inc(result="failed")
+            raise RuntimeError(f"Email outbox is full ({self.max_queue} messages queued)")
+
+    async def deliver(self, message: "EmailMessage") -> None:
+        """Queues `message` and waits until it is sent; raises EmailError if it is refused or given up on."""
+        future = asyncio.get_running_loop().create_future()
+        self._receipts[id(message)] = future
+        try:
+            self.enqueue(message)
+        except RuntimeError as e:
+            self._receipts.pop(id(message), None)
+            raise EmailError(str(e))
+        await future
+
+    def _settle(self, message: "EmailMessage", undelivered: bool) -> None:
+        """Resolves the receipt of a message that left the queue, if its sender is waiting for it."""
+        error = self._refused.pop(id(message), None) or ("not delivered" if undelivered else None)
+        future = self._receipts.pop(id(message), None)
+        if future is not None and not future.done():
+            if error:
+                future.set_exception(EmailError(f"Email to {message['To']} was not delivered: {error}"))
+            else:
+                future.set_result(None)
+
+    def submit(self, compose: Awaitable[Optional["EmailMessage"]]) -> None:
+        """Composes a message in the background and queues it once ready; None results are dropped."""
+        self._ensure_worker()
+        task = asyncio.get_running_loop().create_task(self._compose_and_enqueue(compose))
+        self._composing.add(task)
+        task.add_done_callback(self._composing.discard)
+
+    async def _compose_and_enqueue(self, compose: Awaitable[Optional["EmailMessage"]]) -> None:
+        try:
+            message = await compose
+        except Exception as e:
+            self.failed += 1
+            EMAILS.inc(result="failed")
+            logger.error("Error composing email: %s", e)
+            return
+        if message is not None:
+            try:
+                self.enqueue(message)
+            except RuntimeError as e:
+                logger.error("%s, to: %s", e, message['To'])
+
+    async def flush(self) -> None:
+        """Waits until every submitted message has been composed and delivered (or given up on)."""
+        while self._composing:
+            await asyncio.gather(*list(self._composing), return_exceptions=True)
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    async def aclose(self) -> None:
+        """Flushes pending mail, stops the worker and closes the SMTP connection."""
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._worker = None
+        await asyncio.to_thread(self._disconnect)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "composing": len(self._composing),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "connections": self.connections,
+        }
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            try:
+                first = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                # Don't hold an idle connection open indefinitely.
+                await asyncio.to_thread(self._disconnect)
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            pending = batch
+            attempt = 0
+            try:
+                while pending:
+                    pending = await self._deliver_batch(pending)
+                    if not pending:
+                        break
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        self.failed += len(pending)
+                        EMAILS.inc(len(pending), result="failed")
+                        logger.error("Giving up on %d emails after %d retries.", len(pending), self.max_retries)
+                        break
+                    self.retries += len(pending)
+                    RETRIES.inc(len(pending), service="smtp")
+                    delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            finally:
+                for message in batch:
+                    self._settle(message, any(message is left for left in pending))
+                    queue.task_done()
+
+    async def _deliver_batch(self, messages: List["EmailMessage"]) -> List["EmailMessage"]:
+        """Delivers `messages` in a worker thread, within the limiter's rate if there is one."""
+        if self.limiter is None:
+            return (await asyncio.to_thread(self._deliver, messages))[0]
+        await self.limiter.acquire(requests=len(messages))
+        start = time.perf_counter()
+        throttled = False
+        try:
+            retry, throttled = await asyncio.to_thread(self._deliver, messages)
+        finally:
+            # Per message, so batches of different sizes are comparable.
+            self.limiter.release(None if throttled else (time.perf_counter() - start) / len(messages), throttled)
+        return retry
+
+    def _connect(self) -> "smtplib.SMTP":
+        import smtplib
+        import ssl
+
+        if self._smtp is None:
+            if self.use_ssl:
+                smtp = smtplib.SMTP_SSL(self.smtp_server, self.port, context=ssl.create_default_context(), timeout=self.timeout)
+            else:
+                smtp = smtplib.SMTP(self.smtp_server, self.port, timeout=self.timeout)
+            if self.user and self.password:
+                smtp.login(self.user, self.password)
+            self._smtp = smtp
+            self.connections += 1
+        return self._smtp
+
+    def _disconnect(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _deliver(self, messages: List["EmailMessage"]) -> Tuple[List["EmailMessage"], bool]:
+        """Sends `messages` over the shared connection; returns the ones to retry and whether the server throttled us."""
+        import smtplib
+
+        retry = []
+        throttled = False
+        for message in messages:
+            try:
+                with EXTERNAL_SECONDS.time(service="smtp"):
+                    self._send_one(message)
+                self.sent += 1
+                EMAILS.inc(result="sent")
+                logger.info("Email sent successfully to %s", message['To'])
+            except smtplib.SMTPRecipientsRefused as e:
+                self.failed += 1
+                EMAILS.inc(result="failed")
+                self._refused[id(message)] = str(e)
+                logger.error("Email recipient refused, not retrying: %s, to: %s", e, message['To'])
+            except Exception as e:
+                logger.warning("Email delivery failed, will retry: %s, to: %s", e, message['To'])
+                throttled = throttled or is_throttled(e)
+                self._disconnect()
+                retry.append(message)
+        return retry, throttled
+
+    def _send_one(self, message: "EmailMessage") -> None:
+        import smtplib
+
+        # A pooled connection may have been closed by the server while idle, so a
+        # disconnect on first use gets one immediate reconnect before counting as a failure.
+        for attempt in range(2):
+            smtp = self._connect()
+            try:
+                smtp.send_message(message)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._disconnect()
+                if attempt:
+                    raise
@@ -1,41 +1,170 @@
 # shopy/prompts.py
+import logging
+import re
+import string
+import textwrap
+from typing import Any, Dict, Mapping, Optional
+
+from shopy.metrics import PROMPT_TOKENS, PROMPT_TRIMS, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def count_tokens(text: str) -> int:
+    """The token count prompt budgets are checked against (an estimate; no API call is made)."""
+    return estimate_tokens(text)
+
+
+def _shorten(text: str, max_chars: int) -> str:
+    """Cuts `text` to at most `max_chars` characters, at a word boundary where possible."""
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(max_chars - 3, 1)]
+    if " " in cut[max_chars // 2:]:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip(" ,.;:") + "..."
+
+
+class PromptTemplate:
+    """
+    A prompt compiled once at import time and rendered within a token budget.
+
+    The template text is dedented and stripped of blank lines, and its placeholders
+    and the token cost of its fixed text are worked out up front, so rendering only
+    fills in the values. Lists are joined with ", ". Every string value and list
+    item is first cut to `max_field_chars` / `max_item_chars`. If the prompt is still
+    over `budget` tokens, items are dropped from the end of the longest list (lists
+    are passed in rank order) down to one, and then the longest string value is
+    shortened, so the same inputs always produce the same prompt.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        text: str,
+        budget: int,
+        max_field_chars: int = 300,
+        max_item_chars: int = 80,
+    ):
+        self.name = name
+        self.text = _BLANK_LINES.sub("\n", textwrap.dedent(text)).strip()
+        self.budget = budget
+        self.max_field_chars = max_field_chars
+        self.max_item_chars = max_item_chars
+        self.fields = tuple(
+            field for _, field, _, _ in string.Formatter().parse(self.text) if field is not None
+        )
+        fixed = "".join(literal for literal, _, _, _ in string.Formatter().parse(self.text))
+        self.fixed_tokens = count_tokens(fixed)
+
+    def render(self, **values: Any) -> str:
+        missing = set(self.fields) - set(values)
+        if missing:
+            raise KeyError(f"Prompt {self.name} is missing values for: {', '.join(sorted(missing))}")
+        lists: Dict[str, list] = {}
+        texts: Dict[str, str] = {}
+        for field in self.fields:
+            value = values[field]
+            if isinstance(value, (list, tuple)):
+                lists[field] = [_shorten(str(item), self.max_item_chars) for item in value]
+            else:
+                texts[field] = _shorten(str(value), self.max_field_chars)
+
+        def tokens() -> int:
+            return (
+                self.fixed_tokens
+                + sum(count_tokens(", ".join(items)) for items in lists.values())
+                + sum(count_tokens(text) for text in texts.values())
+            )
+
+        trimmed = False
+        while tokens() > self.budget:
+            field = max(lists, key=lambda f: (len(lists[f]), f), default=None)
+            if field is None or len(lists[field]) <= 1:
+                break
+            lists[field].pop()
+            trimmed = True
+        while tokens() > self.budget and texts:
+            field = max(texts, key=lambda f: (len(texts[f]), f))
+            over_chars = (tokens() - self.budget) * 4
+            if len(texts[field]) <= 40:
+                break
+            texts[field] = _shorten(texts[field], max(40, len(texts[field]) - over_chars))
+            trimmed = True
+
+        prompt = self.text.format(**texts, **{field: ", ".join(items) for field, items in lists.items()})
+        size = count_tokens(prompt)
+        PROMPT_TOKENS.observe(size, prompt=self.name)
+        if trimmed:
+            PROMPT_TRIMS.inc(prompt=self.name)
+            logger.debug("Prompt %s trimmed to %d tokens (budget %d)", self.name, size, self.budget)
+        elif size > self.budget:
+            logger.warning("Prompt %s is %d tokens, over its budget of %d", self.name, size, self.budget)
+        return prompt
+
+
+summary_prompt = PromptTemplate(
+    "summary",
+    """
+    You are a product expert. For each product, write one concise paragraph on its key features and unique benefits.
+    Products: {product_names}
+    Format:
+    * **Product Name**: Explanation
+    """,
+    budget=400,
+)
+
+# The reply is constrained to the EmailContent schema, so the prompt only needs to
+# describe the content, not the JSON format.
+email_template_prompt = PromptTemplate(
+    "email",
+    """
+    You are an expert copywriter. Write a persuasive, informative product recommendation email.
+    Product: {product_name}
+    Why it was chosen: {justification_line}
+    User query: "{user_query}"
+    """,
+    budget=250,
+)
+
+# Used when summary and email are generated in one structured call; the reply is
+# constrained to the SummaryAndEmail schema, so no output example is needed.
+summary_and_email_prompt = PromptTemplate(
+    "summary_and_email",
+    """
+    You are a product expert and an email copywriter.
+    1. For each product, write one concise explanation of its key features and unique benefits.
+    Products: {product_names}
+    2. Write a persuasive recommendation email for the best product.
+    Best product: {product_name}
+    Why it was chosen: {justification_line}
+    User query: "{user_query}"
+    """,
+    budget=500,
+)
+
+PROMPTS: Mapping[str, PromptTemplate] = {
+    template.name: template for template in (summary_prompt, email_template_prompt, summary_and_email_prompt)
+}
+
+
+def parse_budgets(spec: str) -> Dict[str, int]:
+    """Parses "summary=300,email=200" into {"summary": 300, "email": 200}."""
+    budgets = {}
+    for part in spec.split(","):
+        if part.strip():
+            name, _, value = part.partition("=")
+            budgets[name.strip()] = int(value)
+    return budgets
+
+
+def set_budgets(budgets: Optional[Mapping[str, int]]) -> None:
+    """Overrides the token budgets of the named prompts."""
+    for name, budget in (budgets or {}).items():
+        if name not in PROMPTS:
+            raise ValueError(f"Unknown prompt {name!r}; expected one of: {', '.join(PROMPTS)}")
+        PROMPTS[name].budget = budget
 
-email_template_prompt = """
-    You are an expert email content writer specializing in crafting persuasive product recommendations.
-
-    Your goal is to generate an email that is both informative and engaging to the user based on the following inputs:
-
-    - **Product Name:** {product_name} (The name of the recommended product)
-    - **Justification Line:** {justification_line} (A brief line summarizing why this product is recommended)
-    - **User Query:** "{user_query}" (A general description of the user's needs or interests, such as "a smartphone for photography" or "a premium gaming laptop")
-
-    Based on these inputs, generate an email in the following structured JSON format:
-
-    ```json
-    {{
-      "subject": "Email Subject Here",
-      "heading": "Email Heading Here",
-      "justification_line": "An engaging and informative sentence.",
-      "call_to_action": "A call to action such as 'Check it out now!' "
-    }}
-    ```
-
-    Here's a sample input and the format of the expected output:
-
-    ### Input Example:
-    Product Name: Google Pixel 8 Pro
-    Justification Line: Praised for its exceptional camera, advanced AI capabilities, and vibrant display.
-    User Query: a phone with an amazing camera
-
-    ### Example Output:
-    ```json
-    {{
-      "subject": "Capture Every Moment with Google Pixel 8 Pro",
-      "heading": "Discover the Power of the Ultimate Photography Smartphone",
-      "justification_line": "Known for its exceptional camera quality, cutting-edge AI features, and vibrant display, the Google Pixel 8 Pro is perfect for photography enthusiasts.",
-      "call_to_action": "Check it out now!"
-    }}
-    ```
-
-    Now, generate the email content based on the inputs provided.
-"""
\ No newline at end of file
@@ -0,0 +1,275 @@
+# shopy/ratelimit.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from shopy.metrics import CONCURRENCY_LIMIT, RATE_LIMIT_WAIT, THROTTLED
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BATCH = "interactive", "batch"
+# Queued calls are served in rank order, then in arrival order.
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+# The priority of the run the current task belongs to, set by timed_node from the run config.
+priority_var: ContextVar[str] = ContextVar("shopy_priority", default=INTERACTIVE)
+
+# SMTP replies providers use to say "slow down" (Gmail: 421 4.7.0, 450 4.2.1, 454 4.7.0).
+SMTP_THROTTLE_CODES = frozenset({421, 450, 454})
+_THROTTLE_NAMES = frozenset({"ResourceExhausted", "TooManyRequests"})
+
+
+def is_throttled(error: BaseException) -> bool:
+    """True for errors saying the caller went over the backend's quota: HTTP 429 and its equivalents."""
+    if getattr(error, "status", None) == 429 or getattr(error, "code", None) == 429:
+        return True
+    if getattr(error, "smtp_code", None) in SMTP_THROTTLE_CODES:
+        return True
+    return any(cls.__name__ in _THROTTLE_NAMES for cls in type(error).__mro__)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """The seconds a throttled response asked the caller to wait (its Retry-After header), if any."""
+    headers = getattr(error, "headers", None)
+    try:
+        return float(headers.get("Retry-After")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    `rate` units per second accrue up to `capacity`.
+
+    Taking more than the bucket holds leaves a debt that later takers wait out, so a
+    single large request (a long prompt) is let through rather than blocked forever.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until `amount` (at most a full bucket) can be taken."""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        """Takes `amount`, or puts it back if negative."""
+        self._refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+
+class AdaptiveLimiter:
+    """
+    A rate and concurrency limit on calls to one backend, shared by every run in the process.
+
+    A call needs a free slot out of the current concurrency limit, one request from
+    the `requests_per_second` bucket and its estimated tokens from the
+    `tokens_per_minute` bucket (either is unlimited at 0). Calls that can't start
+    yet wait in a queue that serves interactive runs before batch runs.
+
+    With `adaptive` set, the concurrency limit follows AIMD: it is halved when the
+    backend throttles a call (at most once per round trip; the queue also pauses for
+    the response's Retry-After, or else one round trip), cut by a tenth when recent latency climbs above `latency_tolerance`
+    times its long-run average, and grows by one slot per limit's worth of successful
+    calls while the limit is in use. It stays between `min_concurrency` and
+    `max_concurrency`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_second: float = 0.0,
+        tokens_per_minute: float = 0.0,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        adaptive: bool = True,
+        latency_tolerance: float = 2.0,
+    ):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second)) if requests_per_second > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute > 0 else None
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future, float, float]] = []
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._recent_latency: Optional[float] = None
+        self._baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        CONCURRENCY_LIMIT.set(self.concurrency, service=name)
+
+    @property
+    def concurrency(self) -> int:
+        """The number of calls that may run at once right now."""
+        return max(self.min_concurrency, int(self.limit))
+
+    def has_capacity(self) -> bool:
+        """True if a call could start now without queueing."""
+        return not self._waiters and self.in_flight < self.concurrency and self._delay(1.0, 0.0, time.monotonic()) <= 0
+
+    def _delay(self, requests: float, tokens: float, now: float) -> float:
+        delay = self.paused_until - now
+        if self.requests is not None:
+            delay = max(delay, self.requests.delay(requests, now))
+        if self.tokens is not None and tokens:
+            delay = max(delay, self.tokens.delay(tokens, now))
+        return delay
+
+    def _grant(self, requests: float, tokens: float, now: float) -> None:
+        self.in_flight += 1
+        if self.requests is not None:
+            self.requests.take(requests, now)
+        if self.tokens is not None and tokens:
+            self.tokens.take(tokens, now)
+
+    async def acquire(
+        self, requests: float = 1.0, tokens: float = 0.0, priority: Optional[str] = None, timeout: Optional[float] = None
+    ) -> None:
+        """
+        Waits for a slot, `requests` requests and `tokens` tokens; pair with `release`.
+
+        `priority` defaults to the current run's. Raises asyncio.TimeoutError if
+        nothing frees up within `timeout` seconds.
+        """
+        priority = priority or priority_var.get()
+        start = time.perf_counter()
+        now = time.monotonic()
+        if not self._waiters and self.in_flight < self.concurrency and self._delay(requests, tokens, now) <= 0:
+            self._grant(requests, tokens, now)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (PRIORITIES.get(priority, len(PRIORITIES)), next(self._order), future, requests, tokens))
+            self._dispatch()
+            try:
+                await asyncio.wait_for(future, timeout)
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    # Granted just as the wait was given up on.
+                    self.in_flight -= 1
+                self._dispatch()
+                raise
+        RATE_LIMIT_WAIT.observe(time.perf_counter() - start, service=self.name, priority=priority)
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        """
+        Frees a slot and feeds the call's outcome to the concurrency limit.
+
+        `latency` is the call's duration, if it completed; `throttled` says the
+        backend rejected it for exceeding the quota.
+        """
+        self.in_flight = max(0, self.in_flight - 1)
+        now = time.monotonic()
+        if throttled:
+            THROTTLED.inc(service=self.name)
+            # A 429 comes back at once and frees its slot, so without a pause the queue
+            # would send the next call straight into the same quota.
+            pause = retry_after if retry_after else (self._recent_latency or 0.0)
+            self.paused_until = max(self.paused_until, now + pause)
+            self._decrease(0.5, now)
+        elif latency is not None:
+            self._observe(latency, now)
+        self._dispatch()
+
+    def debit(self, tokens: float) -> None:
+        """Charges tokens only known once a call finished (e.g. the response), or refunds them if negative."""
+        if self.tokens is not None and tokens:
+            self.tokens.take(tokens, time.monotonic())
+
+    def _observe(self, latency: float, now: float) -> None:
+        if self._baseline_latency is None:
+            self._recent_latency = self._baseline_latency = latency
+        else:
+            self._recent_latency += 0.2 * (latency - self._recent_latency)
+            self._baseline_latency += 0.02 * (latency - self._baseline_latency)
+        if self._recent_latency > self.latency_tolerance * self._baseline_latency:
+            self._decrease(0.9, now)
+        elif self.adaptive and self.in_flight + 1 >= self.concurrency:
+            # Only grow a limit that is actually reached; idle headroom says nothing about capacity.
+            self._set_limit(self.limit + 1 / self.limit)
+
+    def _decrease(self, factor: float, now: float) -> None:
+        # Calls that were already in flight when the backend pushed back report it too,
+        # so the limit is cut at most once per round trip.
+        if not self.adaptive or now - self._last_decrease < (self._recent_latency or 0.0):
+            return
+        self._last_decrease = now
+        self._set_limit(self.limit * factor)
+
+    def _set_limit(self, limit: float) -> None:
+        before = self.concurrency
+        self.limit = min(float(self.max_concurrency), max(float(self.min_concurrency), limit))
+        if self.concurrency != before:
+            logger.debug("Concurrency limit for %s is now %d", self.name, self.concurrency)
+            CONCURRENCY_LIMIT.set(self.concurrency, service=self.name)
+
+    def _dispatch(self) -> None:
+        """Starts queued calls in priority order while there is room, or schedules a retry when buckets refill."""
+        now = time.monotonic()
+        while self._waiters:
+            _, _, future, requests, tokens = self._waiters[0]
+            if future.done() or future.get_loop().is_closed():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= self.concurrency:
+                return
+            delay = self._delay(requests, tokens, now)
+            if delay > 0:
+                self._schedule(future.get_loop(), delay)
+                return
+            heapq.heappop(self._waiters)
+            self._grant(requests, tokens, now)
+            future.set_result(None)
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop, delay: float) -> None:
+        if self._timer is not None and self._timer_loop is loop and not self._timer.cancelled():
+            if self._timer.when() <= loop.time() + delay:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, self._on_timer)
+        self._timer_loop = loop
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": sum(1 for waiter in self._waiters if not waiter[2].done()),
+        }
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+
+def shared_limiter(name: str, **settings: Any) -> AdaptiveLimiter:
+    """Returns the process-wide limiter for backend `name`, creating it with `settings` on first use."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = AdaptiveLimiter(name, **settings)
+    return limiter
+
+
+def limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns the state of every shared limiter created so far."""
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
@@ -0,0 +1,354 @@
+# shopy/resilience.py
+import asyncio
+import collections
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Deque, Optional, TypeVar
+
+from shopy.exceptions import CircuitOpenError, DeadlineExceededError
+from shopy.metrics import CIRCUIT_TRANSITIONS, HEDGED_REQUESTS, RETRIES
+from shopy.ratelimit import is_throttled, retry_after
+from shopy.utils import percentile
+
+if TYPE_CHECKING:
+    from shopy.ratelimit import AdaptiveLimiter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# The time.monotonic() by which the graph run the current task belongs to must finish, if any.
+deadline_var: ContextVar[Optional[float]] = ContextVar("shopy_deadline", default=None)
+
+# Set when a call handled a failure itself and returned partial or fallback data, so that
+# the node it ran in does not memoize the result (see shopy.agent.timed_node).
+degraded_var: ContextVar[bool] = ContextVar("shopy_degraded", default=False)
+
+# HTTP statuses worth retrying: timeouts, rate limits and server-side failures.
+TRANSIENT_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# Connection failures raised by aiohttp and google-api-core that are not OSErrors.
+_TRANSIENT_NAMES = frozenset({
+    "ServerDisconnectedError", "ClientConnectionError", "ClientPayloadError",
+    "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "ResourceExhausted", "TooManyRequests",
+})
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current run's deadline, or None if the run has no deadline."""
+    deadline = deadline_var.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def mark_degraded() -> None:
+    """Flags the current task's result as partial or fallback data, which is not memoized."""
+    degraded_var.set(True)
+
+
+def is_transient(error: BaseException) -> bool:
+    """True for errors a retry may fix: timeouts, dropped connections, 408/429/5xx responses."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError, OSError)):
+        return True
+    status = getattr(error, "status", None) or getattr(error, "code", None)
+    if isinstance(status, int) and status in TRANSIENT_STATUSES:
+        return True
+    return any(cls.__name__ in _TRANSIENT_NAMES for cls in type(error).__mro__)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a backend that keeps failing.
+
+    After `failure_threshold` transient failures in a row the circuit opens and
+    calls fail immediately with CircuitOpenError. Once `reset_after` seconds have
+    passed one probe call is let through (half-open): success closes the circuit,
+    failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def acquire(self) -> None:
+        """Raises CircuitOpenError unless a call may go through now."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+            self._transition(self.HALF_OPEN)
+        if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def release(self) -> None:
+        """Ends a call that was cancelled before it had an outcome."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self._probing = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def _transition(self, state: str) -> None:
+        logger.warning("Circuit for %s is now %s (%d failures in a row)", self.name, state, self.failures)
+        CIRCUIT_TRANSITIONS.inc(service=self.name, state=state)
+        self.state = state
+
+
+class BackendGuard:
+    """
+    Deadlines, retries, hedging and a circuit breaker for calls to one backend.
+
+    Each attempt gets at most `timeout` seconds, and never more than is left of the
+    run's deadline (`deadline_var`). Transient failures are retried up to `retries`
+    times after a full-jitter exponential backoff, unless the deadline would pass
+    first. When `hedge` is set, an idempotent attempt still running after the p95 of
+    recent attempt latencies gets one duplicate request, and whichever finishes
+    first wins; this cuts the tail that single slow responses cause. Callers fall
+    back to their degraded path on the exceptions raised here (CircuitOpenError,
+    DeadlineExceededError or the last attempt's error).
+
+    With a `limiter`, every attempt (retries and hedges included) first waits for
+    a slot from it, for no longer than the run has left. The wait does not count
+    against the attempt's timeout or its latency, hedges are only sent while the
+    limiter has spare capacity, and quota errors (429) slow the limiter down
+    instead of tripping the circuit breaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.2,
+        max_backoff: float = 2.0,
+        hedge: bool = True,
+        min_hedge_delay: float = 0.05,
+        min_hedge_samples: int = 20,
+        failure_threshold: int = 5,
+        reset_after: float = 30.0,
+        retryable: Callable[[BaseException], bool] = is_transient,
+        rng: Optional[random.Random] = None,
+        limiter: Optional["AdaptiveLimiter"] = None,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.min_hedge_samples = min_hedge_samples
+        self.retryable = retryable
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_after)
+        self.limiter = limiter
+        self.latencies: Deque[float] = collections.deque(maxlen=256)
+        self._rng = rng or random.Random()
+        self._hedge_delay: Optional[float] = None
+        self._samples_since_estimate = 0
+
+    def attempt_timeout(self) -> float:
+        """The time one attempt may take now; raises DeadlineExceededError if the run is out of time."""
+        left = remaining()
+        if left is None:
+            return self.timeout
+        if left <= 0:
+            raise DeadlineExceededError(f"No time left in the run budget for {self.name}")
+        return min(self.timeout, left)
+
+    def hedge_delay(self) -> Optional[float]:
+        """The p95 of recent attempt latencies, once there are enough of them to trust."""
+        if len(self.latencies) < self.min_hedge_samples:
+            return None
+        # Re-estimated every 16 samples rather than sorting the window on every call.
+        if self._hedge_delay is None or self._samples_since_estimate >= 16:
+            self._hedge_delay = max(self.min_hedge_delay, percentile(self.latencies, 95))
+            self._samples_since_estimate = 0
+        return self._hedge_delay
+
+    def _backoff_delay(self, attempt: int) -> float:
+        return self._rng.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def call(self, operation: Callable[[float], Awaitable[T]], idempotent: bool = True, tokens: float = 0.0) -> T:
+        """
+        Runs `operation(timeout)` under this guard and returns its result.
+
+        `operation` makes one attempt and should finish within the `timeout` it is
+        given; it is also cancelled when that time is up. Only `idempotent`
+        operations are hedged. `tokens` is the estimated quota an attempt uses,
+        taken from the limiter's tokens-per-minute budget.
+        """
+        attempt = 0
+        while True:
+            timeout = self.attempt_timeout()
+            try:
+                if idempotent and self.hedge:
+                    return await self._hedged(operation, timeout, tokens)
+                return await self._attempt(operation, timeout, tokens)
+            except (CircuitOpenError, DeadlineExceededError):
+                raise
+            except Exception as e:
+                delay = self._backoff_delay(attempt)
+                left = remaining()
+                if attempt >= self.retries or not self.retryable(e) or (left is not None and left <= delay):
+                    raise
+                attempt += 1
+                RETRIES.inc(service=self.name)
+                logger.warning("%s call failed, retry %d of %d in %.2fs: %s", self.name, attempt, self.retries, delay, e or type(e).__name__)
+                await asyncio.sleep(delay)
+
+    async def _wait_for_slot(self, timeout: float, tokens: float) -> float:
+        """Waits for a limiter slot and returns the attempt timeout left after the wait."""
+        start = time.monotonic()
+        try:
+            await self.limiter.acquire(tokens=tokens, timeout=remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError(f"Run budget ran out waiting to call {self.name}")
+        timeout -= time.monotonic() - start
+        left = remaining()
+        return timeout if left is None else min(timeout, left)
+
+    def _record_failure(self, error: BaseException, elapsed: float) -> None:
+        throttled = is_throttled(error)
+        if self.limiter is not None:
+            timed_out = isinstance(error, (asyncio.TimeoutError, TimeoutError))
+            self.limiter.release(elapsed if timed_out else None, throttled, retry_after(error))
+        if self.retryable(error) and not (throttled and self.limiter is not None):
+            self.breaker.record_failure()
+        else:
+            # A bad request says nothing about the backend's health, and a quota error
+            # says it is up; the limiter backs off from those instead.
+            self.breaker.release()
+
+    async def _attempt(self, operation: Callable[[float], Awaitable[T]], timeout: float, tokens: float = 0.0) -> T:
+        self.breaker.acquire()
+        if self.limiter is not None:
+            try:
+                timeout = await self._wait_for_slot(timeout, tokens)
+            except BaseException:
+                self.breaker.release()
+                raise
+        start = time.perf_counter()
+        try:
+            if timeout <= 0:
+                raise DeadlineExceededError(f"No time left in the run budget for {self.name}")
+            result = await asyncio.wait_for(operation(timeout), timeout)
+        except (asyncio.CancelledError, DeadlineExceededError):
+            self.breaker.release()
+            if self.limiter is not None:
+                self.limiter.release()
+            raise
+        except Exception as e:
+            self._record_failure(e, time.perf_counter() - start)
+            raise
+        latency = time.perf_counter() - start
+        self.breaker.record_success()
+        if self.limiter is not None:
+            self.limiter.release(latency)
+        self.latencies.append(latency)
+        self._samples_since_estimate += 1
+        return result
+
+    async def _hedged(self, operation: Callable[[float], Awaitable[T]], timeout: float, tokens: float = 0.0) -> T:
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return await self._attempt(operation, timeout, tokens)
+        first = asyncio.ensure_future(self._attempt(operation, timeout, tokens))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+            if self.breaker.state != CircuitBreaker.CLOSED or (self.limiter is not None and not self.limiter.has_capacity()):
+                # Duplicates would only add load to a backend that is failing or at its limit.
+                return await first
+            HEDGED_REQUESTS.inc(service=self.name, result="sent")
+            hedge = asyncio.ensure_future(self._attempt(operation, max(timeout - delay, self.min_hedge_delay), tokens))
+            tasks.add(hedge)
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda t: t.exception() is not None):
+                    if task.exception() is None:
+                        if task is hedge:
+                            HEDGED_REQUESTS.inc(service=self.name, result="won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream(self, open_stream: Callable[[], AsyncIterator[Any]], tokens: float = 0.0) -> AsyncIterator[Any]:
+        """
+        Yields the items of `open_stream()` under this guard.
+
+        The whole stream must finish within the attempt timeout. A stream that fails
+        before its first item is retried like a call; once items have been yielded a
+        failure is raised as is, since the consumer already has part of the output.
+        Streams are never hedged; a stream holds its limiter slot until it ends.
+        """
+        attempt = 0
+        loop = asyncio.get_running_loop()
+        while True:
+            timeout = self.attempt_timeout()
+            self.breaker.acquire()
+            if self.limiter is not None:
+                try:
+                    timeout = await self._wait_for_slot(timeout, tokens)
+                except BaseException:
+                    self.breaker.release()
+                    raise
+            start = loop.time()
+            end = start + timeout
+            iterator = open_stream().__aiter__()
+            first_item_after: Optional[float] = None
+            try:
+                while True:
+                    try:
+                        item = await asyncio.wait_for(iterator.__anext__(), max(0.0, end - loop.time()))
+                    except StopAsyncIteration:
+                        break
+                    if first_item_after is None:
+                        first_item_after = loop.time() - start
+                    yield item
+            except Exception as e:
+                self._record_failure(e, loop.time() - start)
+                delay = self._backoff_delay(attempt)
+                left = remaining()
+                if first_item_after is not None or attempt >= self.retries or not self.retryable(e) or (left is not None and left <= delay):
+                    raise
+                attempt += 1
+                RETRIES.inc(service=self.name)
+                logger.warning("%s stream failed, retry %d of %d in %.2fs: %s", self.name, attempt, self.retries, delay, e or type(e).__name__)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled, or the consumer stopped reading.
+                self.breaker.release()
+                if self.limiter is not None:
+                    self.limiter.release()
+                raise
+            finally:
+                aclose = getattr(iterator, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+            self.breaker.record_success()
+            if self.limiter is not None:
+                # How long a whole stream takes depends on its length; the wait for the first item doesn't.
+                self.limiter.release(first_item_after)
+            return
@@ -0,0 +1,306 @@
+# shopy/runtime.py
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from shopy.cache import SingleFlight, TTLCache
+from shopy.config import Config
+from shopy.llm import GeminiLLM, MockLLM
+from shopy.log import configure_logging
+from shopy.prompts import parse_budgets, set_budgets
+from shopy.ratelimit import AdaptiveLimiter, limiter_stats, shared_limiter
+from shopy.resilience import BackendGuard
+from shopy.tools import (
+    TavilyTool,
+    DedupeTool,
+    DataStructuringTool,
+    YouTubeTool,
+    ProductComparisonTool,
+    EmailTool,
+    DisplayTool,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Toolset:
+    """
+    The LLM and tool instances shared by every run of a compiled graph.
+
+    Tools passed in are used as-is. Any other tool is built from `config` the first
+    time it is accessed, so a runtime that never sends email never opens an outbox,
+    and the Gemini client is only imported when the LLM is first needed.
+    """
+
+    TOOLS = ("llm", "tavily", "dedupe", "data_structuring", "youtube", "product_comparison", "email", "display", "node_cache")
+
+    def __init__(self, config: Optional[Config] = None, **tools: Any):
+        unknown = set(tools) - set(self.TOOLS)
+        if unknown:
+            raise TypeError(f"Unknown tools: {', '.join(sorted(unknown))}")
+        self.config = config
+        self.__dict__.update(tools)
+
+    @classmethod
+    def from_config(cls, config: Config) -> "Toolset":
+        """Returns a toolset that builds the LLM and tools described by `config` on first use."""
+        return cls(config=config)
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes that are not set yet, i.e. tools not built so far.
+        config = self.__dict__.get("config")
+        if name not in self.TOOLS or config is None:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        tool = getattr(self, f"_build_{name}")(config)
+        setattr(self, name, tool)
+        return tool
+
+    def built(self, name: str) -> bool:
+        """Returns True if tool `name` has been constructed."""
+        return name in self.__dict__
+
+    @staticmethod
+    def _limiter(
+        config: Config, name: str, max_concurrency: int, requests_per_second: float, tokens_per_minute: float = 0.0
+    ) -> AdaptiveLimiter:
+        return shared_limiter(
+            name,
+            requests_per_second=requests_per_second,
+            tokens_per_minute=tokens_per_minute,
+            max_concurrency=max_concurrency,
+            adaptive=config.adaptive_concurrency,
+        )
+
+    @staticmethod
+    def _guard(config: Config, name: str, timeout: float, limiter: AdaptiveLimiter) -> BackendGuard:
+        return BackendGuard(
+            name,
+            timeout=timeout,
+            retries=config.external_retries,
+            hedge=config.hedge_requests,
+            failure_threshold=config.circuit_breaker_failures,
+            reset_after=config.circuit_breaker_reset,
+            limiter=limiter,
+        )
+
+    def _build_llm(self, config: Config):
+        if config.google_api_key:
+            llm_cache = None
+            if config.llm_cache_enabled:
+                llm_cache = TTLCache(
+                    namespace="gemini",
+                    max_entries=config.llm_cache_size,
+                    default_ttl=config.llm_cache_ttl,
+                    path=config.llm_cache_path or None,
+                    max_disk_entries=config.llm_cache_disk_size,
+                )
+            return GeminiLLM(
+                api_key=config.google_api_key,
+                cache=llm_cache,
+                guard=self._guard(
+                    config,
+                    "gemini",
+                    config.llm_timeout,
+                    self._limiter(
+                        config, "gemini", config.gemini_max_concurrency,
+                        config.gemini_requests_per_second, config.gemini_tokens_per_minute,
+                    ),
+                ),
+                fallback=MockLLM() if config.fallback_to_mock else None,
+            )
+        if not (config.gmail_user and config.gmail_pass and config.youtube_api_key and config.tavily_api_key):
+            logger.warning("No valid API keys provided, using MockLLM.")
+        return MockLLM()
+
+    def _build_tavily(self, config: Config) -> TavilyTool:
+        search_cache = None
+        if config.search_cache_enabled:
+            search_cache = TTLCache(
+                namespace="tavily",
+                max_entries=config.search_cache_size,
+                default_ttl=config.search_cache_ttl,
+                path=config.search_cache_path or None,
+                max_disk_entries=config.search_cache_disk_size,
+            )
+        return TavilyTool(
+            api_key=config.tavily_api_key,
+            base_url=config.tavily_base_url,
+            timeout=config.tavily_timeout,
+            max_connections=config.tavily_max_connections,
+            cache=search_cache,
+            guard=self._guard(
+                config,
+                "tavily",
+                config.tavily_timeout,
+                self._limiter(config, "tavily", config.tavily_max_concurrency, config.tavily_requests_per_second),
+            ),
+            fallback=config.fallback_to_mock,
+        )
+
+    def _build_dedupe(self, config: Config) -> DedupeTool:
+        return DedupeTool(threshold=config.search_dedupe_threshold)
+
+    def _build_data_structuring(self, config: Config) -> DataStructuringTool:
+        return DataStructuringTool(
+            timeout=config.page_fetch_timeout,
+            max_connections=config.page_fetch_max_connections,
+            max_per_host=config.page_fetch_max_per_host,
+            max_page_bytes=config.page_max_bytes,
+            parse_workers=config.page_parse_workers,
+        )
+
+    def _build_youtube(self, config: Config) -> YouTubeTool:
+        review_cache = None
+        if config.search_cache_enabled:
+            review_cache = TTLCache(
+                namespace="youtube",
+                max_entries=config.search_cache_size,
+                default_ttl=config.youtube_cache_ttl,
+                path=config.search_cache_path or None,
+                max_disk_entries=config.search_cache_disk_size,
+            )
+        return YouTubeTool(
+            api_key=config.youtube_api_key or "",
+            base_url=config.youtube_base_url,
+            timeout=config.youtube_timeout,
+            max_concurrency=config.youtube_max_concurrency,
+            cache=review_cache,
+            guard=self._guard(
+                config,
+                "youtube",
+                config.youtube_timeout,
+                self._limiter(config, "youtube", config.youtube_max_concurrency, config.youtube_requests_per_second),
+            ),
+        )
+
+    def _build_product_comparison(self, config: Config) -> ProductComparisonTool:
+        return ProductComparisonTool()
+
+    def _build_email(self, config: Config) -> EmailTool:
+        return EmailTool(
+            gmail_user=config.gmail_user,
+            gmail_pass=config.gmail_pass,
+            smtp_server=config.smtp_server,
+            port=config.smtp_port,
+            use_ssl=config.smtp_use_ssl,
+            batch_size=config.email_batch_size,
+            max_retries=config.email_max_retries,
+            # One worker delivers mail, so only the rate is limited.
+            limiter=self._limiter(config, "smtp", 1, config.email_messages_per_second),
+        )
+
+    def _build_display(self, config: Config) -> DisplayTool:
+        return DisplayTool()
+
+    def _build_node_cache(self, config: Config) -> Optional[TTLCache]:
+        # Outputs of the nodes that declare their inputs (see shopy.agent.timed_node).
+        if not config.node_cache_enabled:
+            return None
+        return TTLCache(
+            namespace="nodes",
+            max_entries=config.node_cache_size,
+            default_ttl=config.node_cache_ttl,
+            path=config.node_cache_path or None,
+            max_disk_entries=config.node_cache_disk_size,
+        )
+
+    async def aclose(self) -> None:
+        """Delivers queued email and releases pooled connections held by the tools built so far."""
+        if self.built("email"):
+            await self.email.aclose()
+        if self.built("tavily"):
+            await self.tavily.aclose()
+        if self.built("youtube"):
+            await self.youtube.aclose()
+        if self.built("data_structuring"):
+            await self.data_structuring.aclose()
+
+
+class ShopyRuntime:
+    """
+    A long-lived owner of one configuration, one toolset and one compiled graph.
+
+    Building these is expensive (parsing `.env`, configuring the Gemini client,
+    compiling the LangGraph graph, an LLM round trip to check authentication), so a
+    runtime is created once per process, on first use, and reused for every request.
+    """
+
+    def __init__(self, config: Optional[Config] = None, tools: Optional[Toolset] = None):
+        # Imported here because shopy.agent builds its default agent from the runtime.
+        from shopy.agent import ShopyAgent
+
+        self.config = config or Config()
+        configure_logging(self.config.log_level, self.config.log_format, self.config.log_max_field_chars)
+        set_budgets(parse_budgets(self.config.prompt_token_budgets))
+        self.tools = tools or Toolset.from_config(self.config)
+        self.checkpointer = None
+        if self.config.checkpoint_enabled:
+            # Imported here so that runs without checkpoints don't load LangGraph's checkpoint module.
+            from shopy.checkpoint import SQLiteCheckpointer
+            self.checkpointer = SQLiteCheckpointer(self.config.checkpoint_path, ttl=self.config.checkpoint_ttl)
+        self.agent = ShopyAgent(
+            tools=self.tools,
+            combine_llm_calls=self.config.combine_llm_calls,
+            run_budget=self.config.run_budget,
+            checkpointer=self.checkpointer,
+        )
+        self.auth_ttl = self.config.auth_check_ttl
+        self._auth_ok: Optional[bool] = None
+        self._auth_checked_at = 0.0
+        self._auth_flight = SingleFlight()
+
+    @property
+    def llm(self):
+        return self.tools.llm
+
+    async def ensure_authenticated(self) -> bool:
+        """Checks LLM authentication, reusing a successful result until `auth_ttl` expires."""
+        if self._auth_ok and time.monotonic() - self._auth_checked_at < self.auth_ttl:
+            return True
+        return await self._auth_flight.do("auth", self._check_auth)
+
+    async def _check_auth(self) -> bool:
+        ok = await self.llm.check_auth()
+        self._auth_ok = ok
+        self._auth_checked_at = time.monotonic()
+        return ok
+
+    async def run(self, query: str, email: str, **kwargs: Any):
+        """Runs one query through the warm graph."""
+        return await self.agent.run(query, email, **kwargs)
+
+    async def resume(self, run_id: str, **kwargs: Any):
+        """Continues a checkpointed run from its last completed step."""
+        return await self.agent.resume(run_id, **kwargs)
+
+    def status(self) -> Dict[str, Any]:
+        """Returns a snapshot of the runtime's warm state."""
+        return {
+            "llm": type(self.llm).__name__,
+            "authenticated": bool(self._auth_ok),
+            "auth_age_seconds": time.monotonic() - self._auth_checked_at if self._auth_checked_at else None,
+            "email_outbox": self.tools.email.outbox.stats() if self.tools.built("email") else None,
+            "circuits": {
+                guard.name: guard.breaker.state
+                for guard in (getattr(self.tools.__dict__.get(name), "guard", None) for name in ("llm", "tavily"))
+                if guard is not None
+            },
+            "rate_limits": limiter_stats(),
+            "checkpoints": self.checkpointer.path if self.checkpointer is not None else None,
+        }
+
+    async def aclose(self) -> None:
+        await self.tools.aclose()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+
+
+_runtime: Optional[ShopyRuntime] = None
+
+
+def get_runtime() -> ShopyRuntime:
+    """Returns the process-wide runtime, creating it on first use."""
+    global _runtime
+    if _runtime is None:
+        _runtime = ShopyRuntime()
+    return _runtime
@@ -0,0 +1,284 @@
+# shopy/scoring.py
+import functools
+import re
+import warnings
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from shopy.extract import parse_price
+
+
+class Feature:
+    """
+    A numeric column the comparison scores on.
+
+    `keys` are substrings matched against lower-cased spec names; `parse` turns a
+    spec value into a number in the feature's unit (None if it can't). Features
+    where `higher_is_better` is False (price, weight) are inverted when normalized.
+    """
+
+    __slots__ = ("name", "label", "keys", "parse", "higher_is_better", "weight", "keywords", "fmt")
+
+    def __init__(
+        self,
+        name: str,
+        label: str,
+        keys: Sequence[str],
+        parse: Callable[[str], Optional[float]],
+        higher_is_better: bool = True,
+        weight: float = 1.0,
+        keywords: Sequence[str] = (),
+        fmt: str = "{:g}",
+    ):
+        self.name = name
+        self.label = label
+        self.keys = tuple(keys)
+        self.parse = parse
+        self.higher_is_better = higher_is_better
+        self.weight = weight
+        self.keywords = tuple(keywords)
+        self.fmt = fmt
+
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+
+
+def _unit_parser(*units: Tuple[str, float]) -> Callable[[str], Optional[float]]:
+    """Builds a parser for "<number> <unit>" (or "<number>-<unit>") values, scaling each unit by its factor."""
+    patterns = [(re.compile(_NUMBER + r"\s*-?\s*" + re.escape(unit) + r"(?![a-z])", re.IGNORECASE), factor) for unit, factor in units]
+
+    def parse(value: str) -> Optional[float]:
+        for pattern, factor in patterns:
+            match = pattern.search(value)
+            if match:
+                return float(match.group(1).replace(",", ".")) * factor
+        return None
+
+    return parse
+
+
+# Rough performance tiers for common processor families, on a 0-100 scale: the
+# family sets the base and the generation or model number moves it within the family.
+_PROCESSORS: List[Tuple["re.Pattern", Callable[[float], float]]] = [
+    (re.compile(r"\bm(\d)\s*(pro|max|ultra)?\b", re.IGNORECASE), lambda n: 70 + 6 * n),
+    (re.compile(r"\ba(\d{1,2})\s*(bionic|pro)?\b", re.IGNORECASE), lambda n: 30 + 3 * n),
+    (re.compile(r"snapdragon\s*8\s*(?:\+\s*)?gen\s*(\d)", re.IGNORECASE), lambda n: 72 + 6 * n),
+    (re.compile(r"snapdragon\s*(\d{3})", re.IGNORECASE), lambda n: n / 12),
+    (re.compile(r"tensor\s*g(\d)", re.IGNORECASE), lambda n: 62 + 4 * n),
+    (re.compile(r"dimensity\s*(\d{3,4})", re.IGNORECASE), lambda n: n / 125),
+    (re.compile(r"exynos\s*(\d{4})", re.IGNORECASE), lambda n: n / 30),
+    (re.compile(r"core\s*ultra\s*(\d)", re.IGNORECASE), lambda n: 68 + 3 * n),
+    (re.compile(r"core\s*i(\d)", re.IGNORECASE), lambda n: 40 + 5 * n),
+    (re.compile(r"ryzen\s*(?:ai\s*)?(\d)", re.IGNORECASE), lambda n: 42 + 5 * n),
+]
+
+
+def parse_processor(value: str) -> Optional[float]:
+    """Maps a processor name such as "A15 Bionic" or "Snapdragon 888" to a rough 0-100 performance tier."""
+    for pattern, tier in _PROCESSORS:
+        match = pattern.search(value)
+        if match:
+            return float(min(100.0, tier(float(match.group(1)))))
+    return None
+
+
+FEATURES: Tuple[Feature, ...] = (
+    Feature("price", "price", ("price",), parse_price, higher_is_better=False, weight=1.0,
+            keywords=("cheap", "budget", "affordable", "value", "deal", "under", "price")),
+    Feature("processor", "processor", ("processor", "cpu", "chip", "soc"), parse_processor, weight=1.0,
+            keywords=("fast", "performance", "gaming", "powerful", "speed", "processor")),
+    Feature("ram_gb", "RAM", ("ram", "memory"), _unit_parser(("gb", 1.0), ("tb", 1024.0)), weight=0.5,
+            keywords=("gaming", "multitask", "performance", "ram", "memory"), fmt="{:g} GB"),
+    Feature("storage_gb", "storage", ("storage", "ssd", "capacity", "hard drive"), _unit_parser(("tb", 1024.0), ("gb", 1.0)),
+            weight=0.5, keywords=("storage", "space", "files"), fmt="{:g} GB"),
+    Feature("battery_mah", "battery", ("battery",), _unit_parser(("mah", 1.0)), weight=0.75,
+            keywords=("battery", "long lasting", "all day", "endurance"), fmt="{:g} mAh"),
+    Feature("battery_wh", "battery", ("battery",), _unit_parser(("wh", 1.0)), weight=0.75,
+            keywords=("battery", "long lasting", "all day", "endurance"), fmt="{:g} Wh"),
+    Feature("battery_hours", "battery life", ("battery",), _unit_parser(("hours", 1.0), ("hrs", 1.0), ("h", 1.0)),
+            weight=0.75, keywords=("battery", "long lasting", "all day", "endurance", "travel"), fmt="{:g} hours"),
+    Feature("camera_mp", "camera", ("camera",), _unit_parser(("mp", 1.0), ("megapixel", 1.0)), weight=0.5,
+            keywords=("camera", "photo", "photography", "video", "selfie"), fmt="{:g} MP"),
+    Feature("display_in", "display", ("display", "screen"), _unit_parser(('"', 1.0), ("inches", 1.0), ("inch", 1.0), ("in", 1.0)), weight=0.25,
+            keywords=("display", "screen", "big", "large"), fmt='{:g}"'),
+    Feature("refresh_hz", "refresh rate", ("display", "screen", "refresh"), _unit_parser(("hz", 1.0)), weight=0.25,
+            keywords=("gaming", "smooth", "refresh", "display"), fmt="{:g} Hz"),
+    Feature("weight_g", "weight", ("weight",), _unit_parser(("kg", 1000.0), ("g", 1.0), ("lbs", 453.6), ("lb", 453.6), ("oz", 28.35)),
+            higher_is_better=False, weight=0.5, keywords=("light", "portable", "travel", "carry", "weight"), fmt="{:g} g"),
+)
+FEATURE_INDEX = {feature.name: column for column, feature in enumerate(FEATURES)}
+
+# Normalized score given to a feature a product doesn't state: below the average,
+# so candidates aren't rewarded for missing data.
+MISSING_SCORE = 0.3
+# How much a query keyword multiplies the weight of the features it mentions.
+KEYWORD_BOOST = 3.0
+# A number followed by one of these is a spec ("up to 16GB RAM"), not a price.
+_SPEC_UNITS = r'(?:gb|tb|mb|mah|mp|megapixels?|hz|wh|w|inch(?:es)?|in|"|hours?|hrs?|h|kg|g|lbs?|oz|mm|cm)(?![a-z])'
+_BUDGET = re.compile(
+    r"(?:under|below|less than|max(?:imum)?|up to)\s*[$€£]?\s*(\d[\d,.]*)(?![\d,.])(?!\s*-?\s*" + _SPEC_UNITS + r")\s*(k\b)?",
+    re.IGNORECASE,
+)
+
+
+def query_weights(query: str) -> np.ndarray:
+    """Per-feature weights for `query`: each feature's base weight, boosted for every keyword the query mentions."""
+    words = (query or "").lower()
+    return np.array([
+        feature.weight * (KEYWORD_BOOST if any(keyword in words for keyword in feature.keywords) else 1.0)
+        for feature in FEATURES
+    ])
+
+
+def query_budget(query: str) -> Optional[float]:
+    """The price limit in queries such as "laptop under $800" or "phone below 1.5k", if any."""
+    match = _BUDGET.search(query or "")
+    if not match:
+        return None
+    amount = parse_price(match.group(1))
+    if amount is None:
+        return None
+    return amount * 1000 if match.group(2) else amount
+
+
+@functools.lru_cache(maxsize=8192)
+def _parse_cached(feature_index: int, value: str) -> Optional[float]:
+    return FEATURES[feature_index].parse(value)
+
+
+@functools.lru_cache(maxsize=4096)
+def _columns_for_key(key: str) -> Tuple[int, ...]:
+    """The FEATURES columns a spec name feeds, e.g. "Battery" -> the three battery columns."""
+    key = key.lower()
+    return tuple(column for column, feature in enumerate(FEATURES) if any(k in key for k in feature.keys))
+
+
+def _spec_values(product: Dict[str, Any], feature: Feature) -> Iterator[str]:
+    """Values of the product's specs whose name contains one of the feature's keys."""
+    for key, value in (product.get("specs") or {}).items():
+        if any(k in str(key).lower() for k in feature.keys):
+            yield str(value)
+
+
+def feature_matrix(products: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """
+    Returns an (n products x n FEATURES) float array of parsed values, NaN where unknown.
+
+    A feature is read from the first matching spec whose value parses; price comes
+    from the product's own `price` field when it has one. Spec names and values
+    recur across products, so both their column mapping and their parsed values
+    are cached, and each product's specs are walked once.
+    """
+    nan = float("nan")
+    price_column = FEATURE_INDEX["price"]
+    rows = []
+    for product in products:
+        row = [nan] * len(FEATURES)
+        price = product.get("price")
+        if price is not None:
+            parsed = float(price) if isinstance(price, (int, float)) else _parse_cached(price_column, str(price))
+            if parsed is not None:
+                row[price_column] = parsed
+        for key, value in (product.get("specs") or {}).items():
+            for column in _columns_for_key(str(key)):
+                if row[column] != row[column]:  # still NaN
+                    parsed = _parse_cached(column, str(value))
+                    if parsed is not None:
+                        row[column] = parsed
+        rows.append(row)
+    return np.array(rows, dtype=float).reshape(len(products), len(FEATURES))
+
+
+def normalize(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Min-max scales each column to 0..1 with 1 always best, and fills unknowns with MISSING_SCORE.
+
+    Returns the scaled matrix and a mask of the columns that can tell candidates
+    apart: known values that differ, or a value only some products state (which
+    then scores 1 against MISSING_SCORE for the rest).
+    """
+    known = ~np.isnan(matrix)
+    with warnings.catch_warnings():
+        # Columns no product states are all NaN; they end up uninformative.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low = np.nanmin(matrix, axis=0) if len(matrix) else np.zeros(matrix.shape[1])
+        high = np.nanmax(matrix, axis=0) if len(matrix) else np.zeros(matrix.shape[1])
+    spread = high - low
+    varies = spread > 0
+    informative = varies | (known.any(axis=0) & ~known.all(axis=0))
+    scaled = np.where(varies, (matrix - low) / np.where(varies, spread, 1.0), 1.0)
+    invert = np.array([not feature.higher_is_better for feature in FEATURES])
+    scaled = np.where(invert, 1.0 - scaled, scaled)
+    return np.where(known, scaled, MISSING_SCORE), informative
+
+
+def score(products: Sequence[Dict[str, Any]], query: str = "") -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scores every product against the query's weighted criteria.
+
+    Returns (scores in 0..1, raw feature matrix, normalized matrix, effective weights).
+    Only columns that tell candidates apart carry weight. Products over a budget
+    stated in the query lose half their score, so they only win if nothing fits.
+    """
+    raw = feature_matrix(products)
+    scaled, informative = normalize(raw)
+    weights = query_weights(query) * informative
+    total = weights.sum()
+    scores = scaled @ (weights / total) if total else np.zeros(len(products))
+    budget = query_budget(query)
+    if budget is not None:
+        over = raw[:, FEATURE_INDEX["price"]] > budget
+        scores = np.where(over, scores * 0.5, scores)
+    return scores, raw, scaled, weights
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` best scores, best first, without sorting the whole array."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=int)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    # Ties go to the earlier (higher-ranked) search result.
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def justification(
+    index: int,
+    products: Sequence[Dict[str, Any]],
+    query: str,
+    raw: np.ndarray,
+    scaled: np.ndarray,
+    weights: np.ndarray,
+    max_reasons: int = 3,
+) -> str:
+    """A one-sentence reason for choosing product `index`, naming the criteria it contributes most on."""
+    product = products[index]
+    contributions = scaled[index] * weights
+    reasons = []
+    for column in np.argsort(-contributions, kind="stable"):
+        if len(reasons) >= max_reasons or contributions[column] <= 0:
+            break
+        value = raw[index, column]
+        if np.isnan(value) or scaled[index, column] < 0.5:
+            continue
+        feature = FEATURES[column]
+        if scaled[index, column] == 1.0:
+            quality = "the best" if feature.higher_is_better else "the lowest"
+        else:
+            quality = "a strong" if feature.higher_is_better else "a competitive"
+        if feature.name == "price":
+            shown = f"{value:,.2f}".removesuffix(".00") + (f" {product['currency']}" if product.get("currency") else "")
+        elif feature.name == "processor":
+            shown = next(_spec_values(product, feature))
+        else:
+            shown = feature.fmt.format(round(float(value), 2))
+        reasons.append(f"{quality} {feature.label} ({shown})")
+    compared = f"{len(products)} compared product{'s' if len(products) != 1 else ''}"
+    if not reasons:
+        return f'Best overall match for "{query}" among {compared}.'
+    listed = reasons[0] if len(reasons) == 1 else ", ".join(reasons[:-1]) + " and " + reasons[-1]
+    return f'Best match for "{query}" among {compared}, with {listed}.'
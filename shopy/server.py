@@ -0,0 +1,316 @@
+# shopy/server.py
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from shopy.cache import SingleFlight, make_cache_key, normalize_query
+from shopy.exceptions import RunFailedError
+from shopy.jobs import DONE, JobQueue
+from shopy.metrics import REGISTRY
+from shopy.runtime import ShopyRuntime, get_runtime
+
+REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+}
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_LINES = 100
+MAX_BODY_BYTES = 64 * 1024
+
+
+class HTTPError(Exception):
+    """An error that maps directly to an HTTP response."""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ShopyServer:
+    """
+    A small asyncio HTTP/1.1 server exposing ShopyAgent.run as a JSON API.
+
+    Every request is served on one persistent event loop against a warm ShopyRuntime.
+    Identical in-flight queries are coalesced into a single run. Admission control
+    caps concurrent runs at `max_concurrency`, allows `max_queue` more to wait, and
+    answers 503 beyond that so a load balancer can retry elsewhere.
+
+    Endpoints:
+        POST /run     {"query": "...", "email": "..."} -> final State as JSON
+        POST /resume  {"run_id": "..."} -> final State of a checkpointed run, continued where it failed
+        POST /jobs    {"query": "...", "email": "..."} -> 202 {"job_id": "..."}, run later by `run.py worker`
+        GET  /jobs/<job_id>  the job's status, with its final State once done
+        GET  /health  liveness plus load and runtime status
+        GET  /metrics       node, external call, cache and LLM metrics (Prometheus text format)
+        GET  /metrics.json  the same metrics as JSON, with estimated p50/p95/p99
+    """
+
+    def __init__(
+        self,
+        runtime: Optional[ShopyRuntime] = None,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        jobs: Optional[JobQueue] = None,
+    ):
+        self.runtime = runtime
+        self.jobs = jobs
+        self.host = host
+        self.port = port
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._coalescer = SingleFlight()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.running = 0
+        self.waiting = 0
+        self.served = 0
+        self.rejected = 0
+        self.started_at = time.time()
+
+    async def start(self) -> None:
+        """Builds the runtime (if needed) and starts listening."""
+        if self.runtime is None:
+            self.runtime = get_runtime()
+        if not await self.runtime.ensure_authenticated():
+            logger.warning("LLM authentication failed; the server will start anyway.")
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Shopy server listening on http://%s:%d", self.host, self.port)
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self.runtime is not None:
+            await self.runtime.aclose()
+        if self.jobs is not None:
+            self.jobs.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    await self._write_response(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                status, payload = await self._dispatch(method, path, body)
+                await self._write_response(writer, status, payload, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, sep, value = line.decode("latin-1").partition(":")
+            if not sep:
+                raise HTTPError(400, "Malformed header")
+            headers[key.strip().lower()] = value.strip()
+        else:
+            raise HTTPError(400, "Too many headers")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length < 0:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    async def _write_response(self, writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool = True) -> None:
+        # Strings are sent as plain text (the Prometheus exposition format); anything else as JSON.
+        if isinstance(payload, str):
+            data = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            data = json.dumps(payload, default=str).encode("utf-8")
+            content_type = "application/json"
+        headers = [
+            f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(data)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == 503:
+            headers.append("Retry-After: 1")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        if path == "/health":
+            if method != "GET":
+                return 405, {"error": "Use GET"}
+            return 200, self.health()
+        if path in ("/metrics", "/metrics.json"):
+            if method != "GET":
+                return 405, {"error": "Use GET"}
+            return 200, REGISTRY.to_prometheus() if path == "/metrics" else REGISTRY.to_dict()
+        if path == "/jobs" or path.startswith("/jobs/"):
+            try:
+                return await self.handle_jobs(method, path, body)
+            except HTTPError as e:
+                return e.status, {"error": e.message}
+            except Exception as e:
+                logger.exception("Unhandled error serving %s: %s", path, e)
+                return 500, {"error": "Internal server error"}
+        if path in ("/run", "/resume"):
+            if method != "POST":
+                return 405, {"error": "Use POST"}
+            try:
+                return await (self.handle_run(body) if path == "/run" else self.handle_resume(body))
+            except HTTPError as e:
+                return e.status, {"error": e.message}
+            except RunFailedError as e:
+                # The client can POST the run ID to /resume once the failing backend recovers.
+                return 502, {"error": str(e), "run_id": e.run_id}
+            except Exception as e:
+                logger.exception("Unhandled error serving %s: %s", path, e)
+                return 500, {"error": "Internal server error"}
+        return 404, {"error": f"No route for {path}"}
+
+    async def handle_run(self, body: bytes) -> Tuple[int, Any]:
+        """Validates a /run request and returns the (possibly shared) result of the run."""
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            raise HTTPError(400, "Body must be JSON")
+        if not isinstance(request, dict) or not isinstance(request.get("query"), str) or not request["query"].strip():
+            raise HTTPError(400, "A non-empty 'query' string is required")
+        query = request["query"]
+        email = request.get("email") or ""
+
+        # Followers of an in-flight identical query add no work, so only leaders
+        # are subject to admission control.
+        key = make_cache_key("run", normalize_query(query), email)
+        return 200, await self._coalescer.do(key, lambda: self._admit_and_run(query, email))
+
+    async def handle_resume(self, body: bytes) -> Tuple[int, Any]:
+        """Validates a /resume request and continues the run it names."""
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            raise HTTPError(400, "Body must be JSON")
+        if not isinstance(request, dict) or not isinstance(request.get("run_id"), str) or not request["run_id"]:
+            raise HTTPError(400, "A non-empty 'run_id' string is required")
+        if self.runtime.checkpointer is None:
+            raise HTTPError(404, "Checkpointing is disabled (CHECKPOINT_ENABLED)")
+        run_id = request["run_id"]
+        try:
+            return 200, await self._coalescer.do(make_cache_key("resume", run_id), lambda: self._admit_and_run(run_id=run_id))
+        except KeyError:
+            raise HTTPError(404, f"No checkpoint for run {run_id}")
+
+    async def handle_jobs(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        """Queues a run for the worker pool (POST /jobs) or reports on one (GET /jobs/<job_id>)."""
+        if self.jobs is None:
+            config = self.runtime.config
+            self.jobs = JobQueue(
+                config.job_queue_path,
+                lease_seconds=config.job_lease_seconds,
+                max_attempts=config.job_max_attempts,
+                result_ttl=config.job_result_ttl,
+            )
+        if path == "/jobs":
+            if method != "POST":
+                return 405, {"error": "Use POST"}
+            try:
+                request = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                raise HTTPError(400, "Body must be JSON")
+            if not isinstance(request, dict) or not isinstance(request.get("query"), str) or not request["query"].strip():
+                raise HTTPError(400, "A non-empty 'query' string is required")
+            job_id = await asyncio.to_thread(self.jobs.submit, request["query"], request.get("email") or "")
+            return 202, {"job_id": job_id}
+        if method != "GET":
+            return 405, {"error": "Use GET"}
+        job_id = path[len("/jobs/"):]
+        status = await asyncio.to_thread(self.jobs.status, job_id)
+        if status is None:
+            raise HTTPError(404, f"No job {job_id}")
+        if status["status"] == DONE:
+            status["result"] = await asyncio.to_thread(self.jobs.result, job_id)
+        return 200, status
+
+    async def _admit_and_run(self, query: str = "", email: str = "", run_id: Optional[str] = None) -> Dict[str, Any]:
+        if self.running + self.waiting >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise HTTPError(503, "Server is at capacity, retry later")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            if run_id is not None:
+                final_state = await self.runtime.resume(run_id, display=False)
+            else:
+                final_state = await self.runtime.run(query, email, display=False)
+            self.served += 1
+            return final_state.dict()
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "uptime_seconds": time.time() - self.started_at,
+            "running": self.running,
+            "waiting": self.waiting,
+            "in_flight_queries": len(self._coalescer),
+            "coalesced": self._coalescer.shared,
+            "served": self.served,
+            "rejected": self.rejected,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "runtime": self.runtime.status() if self.runtime else None,
+        }
+
+
+async def serve(host: str, port: int, max_concurrency: int, max_queue: int) -> None:
+    """Entry point for `run.py serve`."""
+    server = ShopyServer(host=host, port=port, max_concurrency=max_concurrency, max_queue=max_queue)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
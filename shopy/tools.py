@@ -1,17 +1,16 @@
 # shopy/tools.py
-from typing import List, Dict, Any, Optional
+from typing import TYPE_CHECKING, AsyncIterator, Callable, List, Dict, Any, Optional, Set, Tuple
 import logging
 import asyncio
-from tavily import TavilyClient
+from collections import OrderedDict
 from email.message import EmailMessage
-import ssl
-import smtplib
-from rich.console import Console
-from rich.theme import Theme
-from rich.markdown import Markdown
-from rich.panel import Panel
-from rich.table import Table
 
+from shopy.cache import SingleFlight, TTLCache, make_cache_key, normalize_query
+from shopy.log import Abbrev
+from shopy.metrics import EXTERNAL_SECONDS, FALLBACKS, SEARCH_DUPLICATES
+from shopy.resilience import degraded_var, mark_degraded
+from shopy.models import EmailContent, expand_product_refs
+from shopy.outbox import EmailOutbox
 from shopy.exceptions import (
     TavilySearchError,
     DataStructuringError,
@@ -20,163 +19,730 @@ from shopy.exceptions import (
     EmailError,
 )
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# aiohttp, rich and the parsing process pool are imported on first use to keep `import shopy.tools` cheap.
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    import aiohttp
+    from rich.console import Console
+
+    from shopy.ratelimit import AdaptiveLimiter
+    from shopy.resilience import BackendGuard
 
 # Define a custom theme
-custom_theme = Theme({
+custom_theme = {
     "info": "dim cyan",
     "warning": "bold yellow",
     "error": "bold red",
     "success": "bold green",
     "header": "bold magenta",
     "best_product": "bold green",
-})
+}
+
+_console: Optional["Console"] = None
+
+
+def get_console() -> "Console":
+    """Returns the shared rich console, creating it on first use."""
+    global _console
+    if _console is None:
+        from rich.console import Console
+        from rich.theme import Theme
+        _console = Console(theme=Theme(custom_theme))
+    return _console
+
+
+class PooledSession:
+    """
+    A tool's pooled aiohttp session, opened by `open_session` on first use.
+
+    Pooled connections are bound to the event loop that opened them, so a new loop
+    (e.g. a fresh asyncio.run() call) gets a new session. The session it replaces is
+    closed rather than left holding its connections: on its own loop if that loop
+    still runs (in another thread), otherwise on the current one, which empties its
+    pool (sockets of a loop that was already closed are freed when collected).
+    """
+
+    def __init__(self, open_session: Callable[[], "aiohttp.ClientSession"]):
+        self._open_session = open_session
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Set[asyncio.Task] = set()
+
+    def session(self) -> "aiohttp.ClientSession":
+        """Returns the session for the running event loop, opening it if needed."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed:
+                self._close_stale(self._session, self._loop)
+            self._session = self._open_session()
+            self._loop = loop
+        return self._session
+
+    def _close_stale(self, session: "aiohttp.ClientSession", loop: asyncio.AbstractEventLoop) -> None:
+        if loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+            return
+        task = asyncio.get_running_loop().create_task(session.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closed)
+
+    def _closed(self, task: asyncio.Task) -> None:
+        self._closing.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Could not close a stale HTTP session: %s", task.exception())
+
+    async def aclose(self) -> None:
+        """Closes the session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
 
-console = Console(theme=custom_theme)
 
 class TavilyTool:
-    """A tool for searching using the Tavily API."""
-
-    def __init__(self, api_key: str):
-        self.client = TavilyClient(api_key=api_key) if api_key else None
-
-    async def search(self, query: str) -> List[Dict[str, str]]:
+    """
+    A tool for searching using the Tavily API.
+
+    With a `guard`, each search runs under its deadline, retry, hedging, circuit
+    breaker and rate limit policy (see `shopy.resilience`). When the guard gives up and
+    `fallback` is set, the mock results used without an API key are returned
+    instead of an error, so the run still completes in bounded time.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://api.tavily.com",
+        timeout: float = 10.0,
+        max_connections: int = 20,
+        search_depth: str = "basic",
+        cache: Optional[TTLCache] = None,
+        guard: Optional["BackendGuard"] = None,
+        fallback: bool = False,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.search_depth = search_depth
+        self.max_connections = max_connections
+        self.cache = cache
+        self.guard = guard
+        self.fallback = fallback
+        self._http = PooledSession(self._open_session)
+
+    def _open_session(self) -> "aiohttp.ClientSession":
+        import aiohttp
+
+        return aiohttp.ClientSession(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30.0),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def aclose(self) -> None:
+        """Closes the pooled HTTP session."""
+        await self._http.aclose()
+
+    @staticmethod
+    def _mock_results() -> List[Dict[str, Any]]:
+        return [
+            {"name": "Product A", "price": 100},
+            {"name": "Product B", "price": 150},
+        ]
+
+    async def _request(self, query: str, timeout: float) -> Dict[str, Any]:
+        """Sends one /search request and returns the decoded reply."""
+        import aiohttp
+
+        with EXTERNAL_SECONDS.time(service="tavily"):
+            async with self._http.session().post(
+                "/search",
+                json={"query": query, "search_depth": self.search_depth},
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as response:
+                response.raise_for_status()
+                return await response.json()
+
+    async def search(self, query: str, timeout: Optional[float] = None) -> List[Dict[str, str]]:
         """Searches for products using the Tavily API."""
-        if not self.client:
-            logging.warning("Tavily API key not configured. Using mock search results.")
-            return [
-                {"name": "Product A", "price": 100},
-                {"name": "Product B", "price": 150},
-            ]
+        if not self.api_key:
+            logger.warning("Tavily API key not configured. Using mock search results.")
+            return self._mock_results()
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_cache_key("tavily", normalize_query(query), self.search_depth)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Tavily search served from cache for query: %s", query)
+                return cached
         try:
-            search_results = self.client.search(query=query, search_depth="3")
+            if self.guard is not None:
+                search_results = await self.guard.call(lambda attempt_timeout: self._request(query, attempt_timeout))
+            else:
+                search_results = await self._request(query, timeout if timeout is not None else self.timeout)
             if search_results and isinstance(search_results, dict) and search_results.get("results"):
                 products = [{"name": item.get("title"), "url": item.get("url")} for item in search_results["results"]]
-                logging.info(f"Tavily search completed successfully for query: {query}, products: {products}")
+                logger.info("Tavily search completed successfully for query: %s, %d products", query, len(products))
+                if cache_key is not None:
+                    self.cache.set(cache_key, products)
                 return products
             else:
-                logging.warning(f"Tavily search returned no results for query: {query}")
+                logger.warning("Tavily search returned no results for query: %s", query)
                 return []
         except Exception as e:
-            logging.error(f"Error during Tavily search: {e}, query: {query}")
+            if self.fallback:
+                FALLBACKS.inc(service="tavily")
+                mark_degraded()
+                logger.warning("Tavily search failed, using mock search results: %s, query: %s", e, query)
+                return self._mock_results()
+            logger.error("Error during Tavily search: %s, query: %s", e, query)
             raise TavilySearchError(f"Error during Tavily search: {e}")
 
 
-class DataStructuringTool:
-    """A tool for structuring product data."""
+class DedupeTool:
+    """
+    Collapses search results that name the same product into one representative.
 
-    async def map_schema(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Maps the product data to a defined schema."""
-        # Mock implementation
-        logging.info("Structuring product data using mock implementation.",)
-        logging.debug(f"DataStructuringTool received products: {products}")
+    Results are grouped by canonical URL and by MinHash similarity of their
+    normalized titles (see `shopy.dedupe`); `threshold` is the estimated Jaccard
+    similarity of title shingles above which two results naming the same model
+    count as one product.
+    """
+
+    def __init__(self, threshold: float = 0.5, num_perm: int = 64):
+        self.threshold = threshold
+        self.num_perm = num_perm
+
+    def dedupe(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Returns one result per product, in search order."""
+        from shopy.dedupe import dedupe_products
+
+        kept = dedupe_products(products, threshold=self.threshold, num_perm=self.num_perm)
+        dropped = len(products) - len(kept)
+        if dropped:
+            SEARCH_DUPLICATES.inc(dropped)
+            logger.info("Dropped %d duplicate search results, %d products left", dropped, len(kept))
+        return kept
+
+
+class DataStructuringTool:
+    """
+    A tool that fetches each product page and extracts its name, price and specs.
+
+    Pages are downloaded concurrently over one pooled session, at most
+    `max_connections` at a time and `max_per_host` per shop. Each body is read up
+    to `max_page_bytes` and parsed by the streaming extractor in `shopy.extract`
+    in a pool of `parse_workers` processes, so parsing large pages never blocks
+    the event loop (0 parses in a thread instead). If a product's page can't be
+    fetched, its `alternate_urls` are tried in turn. Products without a URL, or
+    whose pages can't be fetched or parsed, keep the name and price from the
+    search result; failed ones also get an "error" field.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10.0,
+        max_connections: int = 20,
+        max_per_host: int = 4,
+        max_page_bytes: int = 2_000_000,
+        parse_workers: int = 2,
+        user_agent: str = "Mozilla/5.0 (compatible; Shopy/1.0)",
+    ):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.max_page_bytes = max_page_bytes
+        self.parse_workers = parse_workers
+        self.user_agent = user_agent
+        self._http = PooledSession(self._open_session)
+        self._pool: Optional["ProcessPoolExecutor"] = None
+
+    def _open_session(self) -> "aiohttp.ClientSession":
+        import aiohttp
+
+        return aiohttp.ClientSession(
+            headers={"User-Agent": self.user_agent, "Accept": "text/html,application/xhtml+xml"},
+            connector=aiohttp.TCPConnector(
+                limit=self.max_connections, limit_per_host=self.max_per_host, keepalive_timeout=30.0
+            ),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    def _get_pool(self) -> Optional["ProcessPoolExecutor"]:
+        """Returns the page-parsing process pool, starting it on first use; None if parsing runs in threads."""
+        if self.parse_workers <= 0:
+            return None
+        if self._pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Spawned rather than forked: this process runs logging and aiohttp threads,
+            # which fork doesn't copy safely.
+            self._pool = ProcessPoolExecutor(self.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def aclose(self) -> None:
+        """Closes the pooled HTTP session and stops the parsing processes."""
+        await self._http.aclose()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _fetch(self, url: str) -> Tuple[bytes, Optional[str]]:
+        """Downloads up to `max_page_bytes` of a page and returns the body and its declared charset."""
+        with EXTERNAL_SECONDS.time(service="product_page"):
+            async with self._http.session().get(url) as response:
+                response.raise_for_status()
+                chunks = []
+                size = 0
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.max_page_bytes:
+                        logger.debug("Page truncated at %d bytes: %s", size, url)
+                        break
+                return b"".join(chunks)[:self.max_page_bytes], response.charset
+
+    async def _parse(self, body: bytes, url: str, charset: Optional[str]) -> Dict[str, Any]:
+        from concurrent.futures import BrokenExecutor
+
+        from shopy.extract import extract_product
+
+        pool = self._get_pool()
+        if pool is not None:
+            try:
+                return await asyncio.get_running_loop().run_in_executor(pool, extract_product, body, url, charset)
+            except BrokenExecutor as e:
+                # A worker died or could not start; don't keep respawning processes that fail.
+                if self._pool is pool:
+                    logger.error("Page parsing processes failed, parsing in threads from now on: %s", e)
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+                    self.parse_workers = 0
+        return await asyncio.to_thread(extract_product, body, url, charset)
+
+    async def _structure(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns the structured record for one search result."""
+        fallback = {
+            "name": product.get("name"),
+            "url": product.get("url"),
+            "price": product.get("price"),
+            "currency": None,
+            "specs": {},
+        }
+        urls = [url for url in [product.get("url"), *product.get("alternate_urls", [])] if url]
+        if not urls:
+            return fallback
+        # Other pages for the same product (see DedupeTool) are only tried when one fails.
+        for url in urls:
+            try:
+                body, charset = await self._fetch(url)
+                break
+            except Exception as e:
+                logger.warning("Could not fetch product page: %s, url: %s", e, url)
+                error = str(e) or type(e).__name__
+        else:
+            return {**fallback, "error": error}
         try:
-            structured_products = [
-                {"name": "Product A", "specs": {"processor": "Snapdragon 888", "battery": "4500mAh"}},
-                {"name": "Product B", "specs": {"processor": "A15 Bionic", "battery": "5000mAh"}},
-            ]
-            logging.debug(f"DataStructuringTool returning product_schema: {structured_products}")
-            return structured_products
+            page = await self._parse(body, url, charset)
         except Exception as e:
-            logging.error(f"Error during data structuring: {e}, products: {products}")
+            logger.warning("Could not parse product page: %s, url: %s", e, url)
+            return {**fallback, "error": str(e) or type(e).__name__}
+        return {
+            **page,
+            "name": page["name"] or fallback["name"],
+            "price": page["price"] if page["price"] is not None else fallback["price"],
+        }
+
+    async def iter_schema(self, products: List[Dict[str, Any]]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Yields (index in `products`, structured record) for each product as soon as its page is done."""
+        tasks = [asyncio.create_task(self._structure(product)) for product in products]
+        index_of = {task: i for i, task in enumerate(tasks)}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=index_of.get):
+                    record = task.result()
+                    if "error" in record:
+                        # A page that failed this time may not next time.
+                        mark_degraded()
+                    yield index_of[task], record
+        except Exception as e:
+            logger.error("Error during data structuring: %s, products: %s", e, Abbrev(products))
             raise DataStructuringError(f"Error during data structuring: {e}")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def map_schema(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Maps the product data to a defined schema, in the order of `products`."""
+        records: List[Optional[Dict[str, Any]]] = [None] * len(products)
+        async for index, record in self.iter_schema(products):
+            records[index] = record
+        logger.debug("DataStructuringTool returning product_schema: %s", Abbrev(records))
+        return records
 
 
 class YouTubeTool:
-    """A tool for fetching YouTube review links."""
+    """
+    A tool for finding YouTube review videos of products.
+
+    `fetch_review_links` resolves the whole comparison table in one call. Product
+    names are reduced to their canonical form (`shopy.dedupe.normalize_title`), so
+    spellings of the same product share one lookup and one `cache` entry; cached
+    names are answered at once and the rest are searched on the YouTube Data API
+    concurrently, at most `max_concurrency` at a time, so the table takes about as
+    long as a single lookup. Concurrent runs asking for the same product share one
+    request. With a `guard`, each search runs under its resilience policy (see
+    `shopy.resilience`). Without an API key, mock links are returned.
+    """
+
+    def __init__(
+        self,
+        api_key: str = "",
+        base_url: str = "https://www.googleapis.com",
+        timeout: float = 10.0,
+        max_concurrency: int = 8,
+        cache: Optional[TTLCache] = None,
+        guard: Optional["BackendGuard"] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.guard = guard
+        self._lookups = SingleFlight()
+        self._http = PooledSession(self._open_session)
+
+    def _open_session(self) -> "aiohttp.ClientSession":
+        import aiohttp
+
+        # The key goes in a header rather than the query string, so it never shows up in logged URLs.
+        return aiohttp.ClientSession(
+            base_url=self.base_url,
+            headers={"X-Goog-Api-Key": self.api_key},
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=30.0),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def aclose(self) -> None:
+        """Closes the pooled HTTP session."""
+        await self._http.aclose()
+
+    @staticmethod
+    def _mock_link(product_name: str) -> str:
+        return f"https://www.youtube.com/watch?v=mock-review-{product_name.replace(' ', '-')}"
+
+    async def _request(self, query: str, timeout: float) -> str:
+        """Searches for one review video and returns its watch URL, or "" if there is none."""
+        import aiohttp
+
+        with EXTERNAL_SECONDS.time(service="youtube"):
+            async with self._http.session().get(
+                "/youtube/v3/search",
+                params={"part": "snippet", "type": "video", "maxResults": "1", "q": f"{query} review"},
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as response:
+                response.raise_for_status()
+                reply = await response.json()
+        for item in reply.get("items") or []:
+            video_id = (item.get("id") or {}).get("videoId")
+            if video_id:
+                return f"https://www.youtube.com/watch?v={video_id}"
+        return ""
+
+    async def _lookup(self, name: str, cache_key: str) -> str:
+        if self.guard is not None:
+            link = await self.guard.call(lambda attempt_timeout: self._request(name, attempt_timeout))
+        else:
+            link = await self._request(name, self.timeout)
+        if self.cache is not None:
+            self.cache.set(cache_key, link)
+        return link
+
+    async def fetch_review_links(self, products: List[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        Returns a review link for each product (keyed by `product_name`; "" where none was found).
+
+        A product whose lookup fails gets "" too and the result is flagged as degraded
+        (see `shopy.resilience.mark_degraded`); if every lookup fails, YouTubeReviewError is raised.
+        """
+        from shopy.dedupe import normalize_title
+
+        names = list(dict.fromkeys(p["product_name"] for p in products if p and p.get("product_name")))
+        if not names:
+            logger.warning("No products to look up YouTube reviews for. products: %s", Abbrev(products))
+            return {}
+        if not self.api_key:
+            return {name: self._mock_link(name) for name in names}
+
+        canonical = {name: normalize_title(name) or normalize_query(name) for name in names}
+        links: Dict[str, str] = {}
+        # Canonical name -> (cache key, the first spelling seen, which is what gets searched).
+        pending: Dict[str, Tuple[str, str]] = {}
+        for name, key_name in canonical.items():
+            if key_name in links or key_name in pending:
+                continue
+            cache_key = make_cache_key("youtube", key_name)
+            cached = self.cache.get(cache_key) if self.cache is not None else None
+            if cached is not None:
+                links[key_name] = cached
+            else:
+                pending[key_name] = (cache_key, name)
+        failures: List[BaseException] = []
+        if pending:
+            slots = asyncio.Semaphore(self.max_concurrency)
+
+            async def lookup(key_name: str, cache_key: str, name: str) -> None:
+                async with slots:
+                    try:
+                        links[key_name] = await self._lookups.do(cache_key, lambda: self._lookup(name, cache_key))
+                    except Exception as e:
+                        logger.warning("YouTube review lookup failed: %s, product: %s", e, key_name)
+                        failures.append(e)
+                        links[key_name] = ""
+
+            await asyncio.gather(*(lookup(key_name, *pending[key_name]) for key_name in pending))
+            logger.debug("Looked up %d YouTube reviews, %d from cache", len(pending), len(links) - len(pending))
+        if failures and len(failures) == len(set(canonical.values())):
+            raise YouTubeReviewError(f"Error during youtube review: {failures[0]}")
+        if failures:
+            # The failed lookups may succeed next time; keep their "" out of memoized node output.
+            mark_degraded()
+        return {name: links[canonical[name]] for name in names}
 
     async def fetch_review_link(self, best_product: Optional[Dict[str, Any]]) -> str:
         """Fetches a YouTube review link for a given product."""
-        # Mock implementation
-        try:
-            if best_product and best_product.get("product_name"):
-                product_name = best_product["product_name"]
-                mock_link = f"https://www.youtube.com/watch?v=mock-review-{product_name.replace(' ', '-')}"
-                logging.info(f"Mock YouTube link generated for {product_name}, product_name: {product_name}, link: {mock_link}")
-                return mock_link
-            else:
-                logging.warning(f"No best product to generate a YouTube link. best_product: {best_product}")
-                return ""
-        except Exception as e:
-            logging.error(f"Error during youtube review: {e}, best_product: {best_product}")
-            raise YouTubeReviewError(f"Error during youtube review: {e}")
+        if not (best_product and best_product.get("product_name")):
+            logger.warning("No best product to generate a YouTube link. best_product: %s", Abbrev(best_product))
+            return ""
+        links = await self.fetch_review_links([best_product])
+        return links[best_product["product_name"]]
 
 
 class ProductComparisonTool:
-    """A tool for comparing products."""
+    """
+    A tool for comparing products on their specs and price.
+
+    Spec strings are parsed into numeric feature columns and every candidate is
+    scored at once with NumPy against weights derived from the query (see
+    `shopy.scoring`), so a comparison takes milliseconds and no LLM calls. The
+    `top_k` best candidates are returned as the comparison, best first.
+    """
+
+    def __init__(self, top_k: int = 5):
+        self.top_k = top_k
 
     async def compare_products(self, state) -> Dict[str, Any]:
-        """Compares products based on their specs and reviews."""
-        # Mock implementation
-        logging.info("Comparing products using mock implementation.",)
+        """
+        Compares products based on their specs and reviews.
+
+        The comparison and best product refer to the products by their index in
+        `state.product_schema` (or `state.products` if it is empty), as RunState
+        holds them; see `shopy.models.expand_product_refs` for their public form.
+        """
         try:
-             logging.debug(f"ProductComparisonTool - Input: product_schema: {state.product_schema}")
-             comparison = [
-                {"product_name": "Product A", "rating": 4.5},
-                {"product_name": "Product B", "rating": 4.7},
-             ]
-             best_product = {"product_name": "Product B", "justification": "Better rating and specs"}
-             logging.debug(f"ProductComparisonTool - Output: comparison_data: {comparison}, best_product: {best_product}")
-             return {"comparison": comparison, "best_product": best_product}
+            products = state.product_schema or state.products
+            ids = [i for i, p in enumerate(products) if p and p.get("name")]
+            logger.debug("ProductComparisonTool - Input: %d candidates: %s", len(ids), Abbrev(products))
+            if not ids:
+                logger.warning("No products to compare. query: %s", state.query)
+                return {"comparison": [], "best_product": {}}
+            ranked = self.rank_refs([products[i] for i in ids], state.query)
+            for ref in [*ranked["comparison"], ranked["best_product"]]:
+                ref["id"] = ids[ref["id"]]
+            return ranked
         except Exception as e:
-            logging.error(f"Error during product comparison: {e}, product_schema: {state.product_schema}")
+            logger.error("Error during product comparison: %s, product_schema: %s", e, Abbrev(state.product_schema))
             raise ProductComparisonError(f"Error during product comparison: {e}")
 
+    def rank(self, candidates: List[Dict[str, Any]], query: str) -> Dict[str, Any]:
+        """Scores `candidates` for `query` and returns the top-k comparison and the best product."""
+        return expand_product_refs({"products": candidates, **self.rank_refs(candidates, query)})
+
+    def rank_refs(self, candidates: List[Dict[str, Any]], query: str) -> Dict[str, Any]:
+        """Like `rank`, with the comparison rows and best product referring to `candidates` by index."""
+        from shopy import scoring
+
+        scores, raw, scaled, weights = scoring.score(candidates, query)
+        best = scoring.top_k(scores, self.top_k)
+        comparison = [
+            {"id": int(i), "rating": round(float(scores[i]) * 5, 1), "score": round(float(scores[i]) * 100, 1)}
+            for i in best
+        ]
+        winner = int(best[0])
+        best_product = {
+            "id": winner,
+            "justification": scoring.justification(winner, candidates, query, raw, scaled, weights),
+            "score": comparison[0]["score"],
+        }
+        logger.debug("ProductComparisonTool - Output: comparison_data: %s, best_product: %s", Abbrev(comparison), Abbrev(best_product))
+        return {"comparison": comparison, "best_product": best_product}
+
 
 class EmailTool:
     """A tool to send emails using Gmail."""
 
-    def __init__(self, gmail_user, gmail_pass):
+    # Runs whose email was delivered while waiting for it, remembered so that a resumed
+    # run that repeats its email step (see ShopyAgent.resume) does not mail the user twice.
+    MAX_DELIVERED_RUNS = 10000
+
+    def __init__(
+        self,
+        gmail_user,
+        gmail_pass,
+        smtp_server: str = "smtp.gmail.com",
+        port: int = 465,
+        use_ssl: bool = True,
+        batch_size: int = 20,
+        max_retries: int = 5,
+        limiter: Optional["AdaptiveLimiter"] = None,
+    ):
         self.gmail_user = gmail_user
         self.gmail_pass = gmail_pass
-        self.port = 465
-        self.smtp_server = "smtp.gmail.com"
-
-
-    async def send_email(self, state, email_template_prompt, llm):
+        self.port = port
+        self.smtp_server = smtp_server
+        self.outbox = EmailOutbox(
+            smtp_server=smtp_server,
+            port=port,
+            user=gmail_user,
+            password=gmail_pass,
+            use_ssl=use_ssl,
+            batch_size=batch_size,
+            max_retries=max_retries,
+            limiter=limiter,
+        )
+        self._delivered_runs: "OrderedDict[str, None]" = OrderedDict()
+
+
+    async def send_email(self, state, email_template_prompt, llm, wait: bool = False):
+       """
+       Hands the recommendation email to the outbox and returns without waiting for it.
+
+       The content is generated and the message delivered in the background; use
+       `flush()` to wait for delivery. With `wait`, the email is composed and
+       delivered before returning, and a failure to do either raises EmailError;
+       a run whose email was already delivered this way is not mailed again.
+       """
        try:
           if not self.gmail_user or not self.gmail_pass:
-              logging.warning(f"Gmail user or password not configured. Email will not be sent., user: {self.gmail_user}, pass: {self.gmail_pass}")
+              logger.warning("Gmail user or password not configured. Email will not be sent. user: %s", self.gmail_user)
+              return
+          if not state.email:
+              logger.debug("No recipient email provided, skipping email.")
+              return
+          if not state.best_product:
+              logger.warning("No best product to recommend, email will not be sent. query: %s", state.query)
+              return
+          if getattr(state, "degraded", False):
+              logger.warning("Run is degraded (fallback or missing results), email will not be sent. query: %s", state.query)
               return
-          # Generate email content using the LLM
-          prompt = email_template_prompt.format(
-             product_name=state.best_product["product_name"],
-             justification_line=state.best_product["justification"],
-             user_query=state.query,
+          if wait and self._already_delivered(state.trace_id):
+              return
+          compose = self.compose_email(
+              to=state.email,
+              query=state.query,
+              best_product=dict(state.best_product_view()),
+              email_template_prompt=email_template_prompt,
+              llm=llm,
+          )
+          if wait:
+              message = await compose
+              if message is not None:
+                  await self.outbox.deliver(message)
+                  self._remember_delivery(state.trace_id)
+          else:
+              self.outbox.submit(compose)
+       except Exception as e:
+           logger.error("Error during email sending: %s, email: %s, product: %s", e, state.email, Abbrev(state.best_product))
+           raise EmailError(f"Error during email sending {e}")
+
+    async def compose_email(self, to, query, best_product, email_template_prompt, llm) -> Optional[EmailMessage]:
+       """Generates the email content with the LLM and builds the message."""
+       try:
+          # Generate email content using the LLM; the reply is constrained to the EmailContent schema.
+          prompt = email_template_prompt.render(
+             product_name=best_product["product_name"],
+             justification_line=best_product["justification"],
+             user_query=query,
           )
           messages = [{"role": "user", "content": prompt}]
-          email_content = await llm.agenerate(messages=messages)
-          if not email_content:
-             logging.warning(f"No email content generated, email will not be sent. product: {state.best_product}, query: {state.query}")
-             return
-
-          logging.debug(f"Email content: {email_content}, product: {state.best_product}, query: {state.query}")
-          #Parse the email content
-
-          # Create email message
-          email_msg = EmailMessage()
-          email_msg["From"] = self.gmail_user
-          email_msg["To"] = state.email
-          # Parse the JSON string
-          import json
-          parsed_email_content = json.loads(email_content)
-          email_msg["Subject"] = parsed_email_content.get("subject", "Product Recommendation")
-          email_msg.set_content(f"""
-             {parsed_email_content.get("heading", "Recommendation for you")}
-             {parsed_email_content.get("justification_line", "We have the best product for you")}
-          """)
+          email_content = await llm.agenerate_structured(messages, EmailContent)
+          if degraded_var.get():
+              logger.warning("Email text came from the fallback LLM, email will not be sent. email: %s", to)
+              return None
+          logger.debug("Email content: %s, product: %s, query: %s", Abbrev(email_content), Abbrev(best_product), query)
+          return self.build_message(
+             to,
+             subject=email_content.subject,
+             heading=email_content.heading,
+             justification_line=email_content.justification_line,
+          )
 
+       except Exception as e:
+           logger.error("Error during email composition: %s, email: %s, product: %s", e, to, Abbrev(best_product))
+           raise EmailError(f"Error during email composition {e}")
+
+    def build_message(self, to, subject, heading, justification_line) -> EmailMessage:
+       email_msg = EmailMessage()
+       email_msg["From"] = self.gmail_user
+       email_msg["To"] = to
+       email_msg["Subject"] = subject
+       email_msg.set_content(f"""
+             {heading}
+             {justification_line}
+          """)
+       return email_msg
+
+    @property
+    def configured(self) -> bool:
+        """True if Gmail credentials are set, so mail can be sent at all."""
+        return bool(self.gmail_user and self.gmail_pass)
+
+    async def deliver_content(self, to, content, run_id: str = "") -> None:
+       """Sends an email built from already generated EmailContent and waits until it is delivered, once per `run_id`."""
+       if self._already_delivered(run_id):
+          return
+       await self.outbox.deliver(
+          self.build_message(to, subject=content.subject, heading=content.heading, justification_line=content.justification_line)
+       )
+       self._remember_delivery(run_id)
+
+    def _already_delivered(self, run_id: str) -> bool:
+       if run_id and run_id in self._delivered_runs:
+          logger.info("Email of run %s was already delivered, not sending it again", run_id)
+          return True
+       return False
+
+    def _remember_delivery(self, run_id: str) -> None:
+       if run_id:
+          self._delivered_runs[run_id] = None
+          if len(self._delivered_runs) > self.MAX_DELIVERED_RUNS:
+             self._delivered_runs.popitem(last=False)
+
+    def send_content(self, to, content) -> None:
+       """Queues an email built from already generated EmailContent, skipping the LLM call."""
+       try:
+          self.outbox.enqueue(
+             self.build_message(to, subject=content.subject, heading=content.heading, justification_line=content.justification_line)
+          )
+       except Exception as e:
+           logger.error("Error queueing email: %s, email: %s", e, to)
+           raise EmailError(f"Error queueing email {e}")
 
-          # Send email
-          context = ssl.create_default_context()
-          with smtplib.SMTP_SSL(self.smtp_server, self.port, context=context) as server:
-              server.login(self.gmail_user, self.gmail_pass)
-              server.send_message(email_msg)
-              logging.info(f"Email sent successfully to {state.email}, product: {state.best_product}")
+    async def flush(self):
+        """Waits for all queued emails to be delivered."""
+        await self.outbox.flush()
 
-       except Exception as e:
-           logging.error(f"Error during email sending: {e}, email: {state.email}, product: {state.best_product}")
-           raise EmailError(f"Error during email sending {e}")
+    async def aclose(self):
+        await self.outbox.aclose()
 
 
 class DisplayTool:
@@ -184,29 +750,67 @@ class DisplayTool:
 
     async def display_data(self, display_data):
         """Displays the data using rich."""
-        
-        console.print(f"\n[info]Here is what ShopyAgent suggests: [/info] [best_product]{display_data.get('best_product', {}).get('product_name', 'No product')}[/best_product]")
+        self.show_best_product(display_data.get('best_product'))
+        self.show_youtube_link(display_data.get('youtube_link'))
+        self.show_comparison(display_data.get('comparison'), display_data.get('review_links'))
+        self.show_summary(display_data.get('summary'))
+
+    def show_products(self, products):
+        """Lists the search results as soon as they arrive."""
+        if products:
+            get_console().print(f"\n[info]Found {len(products)} products:[/info] " + ", ".join(str(p.get('name')) for p in products))
 
-        if display_data.get('best_product'):
-            md = Markdown(f"Justification:\n {display_data['best_product'].get('justification', 'No justification')}")
+    def show_best_product(self, best_product):
+        from rich.markdown import Markdown
+        from rich.panel import Panel
+
+        console = get_console()
+        console.print(f"\n[info]Here is what ShopyAgent suggests: [/info] [best_product]{(best_product or {}).get('product_name', 'No product')}[/best_product]")
+
+        if best_product:
+            md = Markdown(f"Justification:\n {best_product.get('justification', 'No justification')}")
             panel = Panel(md, title="Best Product", border_style="blue")
             console.print(panel)
 
-        if display_data.get('youtube_link'):
-            md = Markdown(f"See the review here: {display_data['youtube_link']}")
+    def show_youtube_link(self, youtube_link):
+        from rich.markdown import Markdown
+        from rich.panel import Panel
+
+        if youtube_link:
+            md = Markdown(f"See the review here: {youtube_link}")
             panel = Panel(md, title="YouTube Review Link", border_style="blue")
-            console.print(panel)
+            get_console().print(panel)
+
+    def show_comparison(self, comparison, review_links=None):
+        from rich.table import Table
 
-        if display_data.get('comparison'):
+        if comparison:
              # Create a table for product comparison
             table = Table(title="Product Comparisons",show_lines=True)
             table.add_column("Product Name", style="cyan")
             table.add_column("Rating", style="magenta")
-
-            for item in display_data['comparison']:
-                table.add_row(item.get('product_name', ''), str(item.get('rating', '')))
-            console.print(table)
-        
-        if display_data.get('summary'):
-              console.print(f"\n[info]Summary:[/info]")
-              console.print(display_data['summary'])
\ No newline at end of file
+            if review_links:
+                table.add_column("Review", style="blue")
+
+            for item in comparison:
+                row = [item.get('product_name', ''), str(item.get('rating', ''))]
+                if review_links:
+                    row.append(review_links.get(item.get('product_name'), ''))
+                table.add_row(*row)
+            get_console().print(table)
+
+    def show_summary(self, summary):
+        if summary:
+              get_console().print(f"\n[info]Summary:[/info]")
+              get_console().print(summary)
+
+    def show_summary_header(self):
+        get_console().print("\n[info]Summary:[/info]")
+
+    def show_summary_token(self, text):
+        """Prints a streamed chunk of the summary without a trailing newline."""
+        get_console().print(text, end="", markup=False, highlight=False)
+
+    def end_line(self):
+        """Finishes a line left open by streamed output."""
+        get_console().print()
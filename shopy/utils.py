@@ -1,13 +1,10 @@
 # shopy/utils.py
 import re
-from rich.console import Console
-from rich.markdown import Markdown
-from rich.panel import Panel
-import logging
 
 def clean_llm_output(data, console=None):
     """Cleans the LLM output and prints it with Rich."""
     if console is None:
+        from rich.console import Console
         console = Console()
 
     cleaned_output = {}
@@ -23,4 +20,14 @@ def clean_llm_output(data, console=None):
             cleaned_output[key] = clean_llm_output(value, console)
         else:
             cleaned_output[key] = value
-    return cleaned_output
\ No newline at end of file
+    return cleaned_output
+
+def percentile(values, pct: float) -> float:
+    """Returns the `pct` percentile (0-100) of `values` using linear interpolation."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)